@@ -39,6 +39,8 @@ def pytest_addoption(parser):
         help="The engine that should be used for this testrun.")
     parser.addoption("--agents", action="store_true",
         help="Only test agents-code from the data_directory")
+    parser.addoption("--benchmarks", action="store_true",
+        help="Also run the tests marked as benchmarks")
 
 
 def pytest_cmdline_main(config):
@@ -61,6 +63,8 @@ def pytest_configure(config):
     # register an additional marker
     config.addinivalue_line("markers",
         "engine(name): mark test to run only on the specified engine")
+    config.addinivalue_line("markers",
+        "benchmark: mark test as a benchmark, to run only if --benchmarks is given")
 
 
 def pytest_generate_tests(metafunc):
@@ -80,6 +84,8 @@ def pytest_runtest_setup(item):
         engine_marker = engine_marker.args[0]
         if engine_marker != item.callspec.params['engine']:
             pytest.skip("test requires engine %s" % engine_marker)
+    if item.get_marker("benchmark") is not None and not item.config.getoption('benchmarks'):
+        pytest.skip("benchmarks only run with --benchmarks")
     for item in os.listdir(testpath):
         if item != 'worlds' and item != 'nodenets':
             path = os.path.join(testpath, item)
@@ -247,12 +247,20 @@ class DictNodenet(Nodenet):
         return data
 
     def save(self, filename):
+        self.get_save_snapshot(filename)()
+
+    def get_save_snapshot(self, filename):
         # dict_engine saves everything to json, just dump the json export
-        with open(filename, 'w+') as fp:
-            fp.write(json.dumps(self.export_json(), sort_keys=True, indent=4))
-        if os.path.getsize(filename) < 100:
-            # kind of hacky, but we don't really know what was going on
-            raise RuntimeError("Error writing nodenet file")
+        data = json.dumps(self.export_json(), sort_keys=True, indent=4)
+
+        def write():
+            with open(filename + ".tmp", 'w+') as fp:
+                fp.write(data)
+            if os.path.getsize(filename + ".tmp") < 100:
+                # kind of hacky, but we don't really know what was going on
+                raise RuntimeError("Error writing nodenet file")
+            os.replace(filename + ".tmp", filename)
+        return write
 
     def load(self, filename):
         """Load the node net from a file"""
@@ -15,6 +15,8 @@ class Link(metaclass=ABCMeta):
     A link between two nodes, starting from a gate and ending in a slot.
     """
 
+    __slots__ = ()
+
     @property
     def signature(self):
         return self.source_node.uid + ":" + self.source_gate.type + ":" + self.target_slot.type + ":" + self.target_node.uid
@@ -27,6 +27,8 @@ class Node(metaclass=ABCMeta):
     Abstract base class for node implementations.
     """
 
+    __slots__ = ('_nodetype_name', '_nodetype', 'logger')
+
     @property
     @abstractmethod
     def uid(self):
@@ -388,6 +390,8 @@ class Gate(metaclass=ABCMeta):
     Gate activations are set by the node's node_function through calling gate_function for all of their gates.
     """
 
+    __slots__ = ()
+
     @property
     @abstractmethod
     def type(self):
@@ -493,6 +497,8 @@ class Slot(metaclass=ABCMeta):
     net step by node functions.)
     """
 
+    __slots__ = ()
+
     @property
     @abstractmethod
     def type(self):
@@ -210,6 +210,16 @@ class Nodenet(metaclass=ABCMeta):
         """
         pass  # pragma: no cover
 
+    def get_save_snapshot(self, filename):
+        """
+        Returns a function that saves the nodenet, in the state it has now, to the given main metadata json file.
+        Must be called while the nodenet can not change (holding the netlock), the returned function can then
+        do the writing without the lock, on any thread.
+        Implementations that can not take snapshots save right away and return a function that does nothing.
+        """
+        self.save(filename)
+        return lambda: None
+
     @abstractmethod
     def load(self, filename):
         """
@@ -225,6 +235,13 @@ class Nodenet(metaclass=ABCMeta):
         """
         pass  # pragma: no cover
 
+    def close(self):
+        """
+        Releases resources like threads or processes the node net holds, before it is unloaded.
+        Implementations may override this, the default does nothing.
+        """
+        pass
+
     def timed_step(self):
         start = datetime.now()
         self.step()
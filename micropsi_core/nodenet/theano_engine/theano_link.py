@@ -11,6 +11,8 @@ class TheanoLink(Link):
         theano link proxy class
     """
 
+    __slots__ = ('__nodenet', '__source_node_uid', '__source_gate_type', '__target_node_uid', '__target_slot_type')
+
     @property
     def signature(self):
         return "%s:%s:%s:%s" % (self.__source_node_uid, self.__source_gate_type, self.__target_slot_type, self.__target_node_uid)
@@ -44,7 +46,7 @@ class TheanoLink(Link):
             source_element = source_partition.allocated_node_offsets[node_from_id(self.__source_node_uid)] + ngt
             y = np.where(from_elements == source_element)[0][0]
             x = np.where(to_elements == target_element)[0][0]
-            return float(weights[x][y])
+            return float(weights[x, y])
 
     @property
     def certainty(self):
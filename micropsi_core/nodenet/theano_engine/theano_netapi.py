@@ -20,28 +20,42 @@ class TheanoNetAPI(NetAPI):
     def announce_nodes(self, nodespace_uid, numer_of_nodes, average_element_per_node):
         self.__nodenet.announce_nodes(nodespace_uid, numer_of_nodes, average_element_per_node)
 
+    def link_bulk(self, source_uids, gate_types, target_uids, slot_types, weights=1):
+        """
+        Creates (or changes the weights of) the links source_uids[i]:gate_types[i] -> target_uids[i]:slot_types[i]
+        in one operation per partition. gate_types, slot_types and weights can be lists or single values.
+        """
+        self.__nodenet.set_link_weights_bulk(source_uids, gate_types, target_uids, slot_types, weights)
+
+    def unlink_bulk(self, source_uids, gate_types, target_uids, slot_types):
+        """
+        Deletes the links source_uids[i]:gate_types[i] -> target_uids[i]:slot_types[i] in one operation per partition.
+        gate_types and slot_types can be lists or single values.
+        """
+        self.__nodenet.set_link_weights_bulk(source_uids, gate_types, target_uids, slot_types, 0)
+
     def decay_por_links(self, nodespace_uid):
         """ Decays all por-links in the given nodespace """
-        #    por_cols = T.lvector("por_cols")
-        #    por_rows = T.lvector("por_rows")
-        #    new_w = T.set_subtensor(nodenet.w[por_rows, por_cols], nodenet.w[por_rows, por_cols] - 0.0001)
-        #    self.decay = theano.function([por_cols, por_rows], None, updates={nodenet.w: new_w}, accept_inplace=True)
-        import numpy as np
-        from .theano_definitions import node_from_id, PIPE, POR
-        nodespace_uid = self.get_nodespace(nodespace_uid).uid
+        from .theano_definitions import nodespace_from_id
         porretdecay = self.__nodenet.get_modulator('base_porret_decay_factor')
         ns = self.get_nodespace(nodespace_uid)
         partition = ns._partition
         if partition.has_pipes and porretdecay != 0:
-            ns_id = node_from_id(nodespace_uid)
-            node_ids = np.where(partition.allocated_node_parents == ns_id)[0]
-            pipe_ids = np.where(partition.allocated_nodes == PIPE)[0]
-            ns_pipes = np.intersect1d(node_ids, pipe_ids, assume_unique=True)
-            por_cols = partition.allocated_node_offsets[ns_pipes] + POR
-            w = partition.w.get_value(borrow=True)
-            por_rows = np.nonzero(w[:, por_cols] > 0.)[0]
-            cols, rows = np.meshgrid(por_cols, por_rows)
-            w_update = w[rows, cols]
-            w_update *= (1 - porretdecay)
-            w[rows, cols] = w_update
-            partition.w.set_value(w, borrow=True)
+            partition.decay_por_links(nodespace_from_id(ns.uid), porretdecay)
+
+    def set_por_link_decay(self, nodespace_uid, decay=True):
+        """
+        Lets a step operator decay the por-links in the given nodespace after every step, like decay_por_links.
+        Pass decay=False to stop.
+        """
+        self.__nodenet.set_por_link_decay(self.get_nodespace(nodespace_uid).uid, decay)
+
+    def register_weight_block(self, nodespace_from_uid, group_from, nodespace_to_uid, group_to):
+        """
+        Keeps the weights of the links from group_from to group_to in a dense matrix, for groups in the same partition
+        whose weights are read and written often, e.g. by learning native modules.
+        get_link_weights then returns this matrix itself instead of a copy, updated after other changes of the links,
+        so it should only be changed with set_link_weights, which copies the new weights in place.
+        The registration ends when one of the groups is ungrouped.
+        """
+        self.__nodenet.register_weight_block(nodespace_from_uid, group_from, nodespace_to_uid, group_to)
@@ -12,6 +12,11 @@ class TheanoNode(Node):
         theano node proxy class
     """
 
+    # node proxies are created in large numbers. __dict__ is only allocated for native modules that store
+    # additional attributes on their node.
+    __slots__ = ('_numerictype', '_id', '_uid', '_parent_id', '_nodenet', '_partition', '_state',
+                 '__gatecache', '__slotcache', 'parameters', 'slot_activation_snapshot', '__dict__')
+
     def __init__(self, nodenet, partition, parent_uid, uid, type, parameters={}, **_):
 
         self._numerictype = type
@@ -99,6 +104,7 @@ class TheanoNode(Node):
         a_array = self._partition.a.get_value(borrow=True)
         a_array[self._partition.allocated_node_offsets[self._id] + GEN] = activation
         self._partition.a.set_value(a_array, borrow=True)
+        self._partition.mark_dirty('a')
 
     def get_gate(self, type):
         if type not in self.__gatecache:
@@ -184,8 +190,7 @@ class TheanoNode(Node):
 
     def unlink_completely(self):
         self._partition.unlink_node_completely(self._id)
-        if self.uid in self._nodenet.proxycache:
-            del self._nodenet.proxycache[self.uid]
+        self._nodenet.proxycache.pop(self.uid, None)
 
     def unlink(self, gate_name=None, target_node_uid=None, slot_name=None):
         for gate_name_candidate in self.nodetype.gatetypes:
@@ -209,8 +214,8 @@ class TheanoNode(Node):
                 if element in to_elements:
                     from_partition = self._nodenet.partitions[partition_from_spid]
                     element_index = np.where(to_elements == element)[0][0]
-                    slotrow = weights[element_index]
-                    links_indices = np.nonzero(slotrow)[0]
+                    slotrow = weights[element_index:element_index + 1]
+                    links_indices = np.nonzero(slotrow)[1]
                     for link_index in links_indices:
                         source_id = from_partition.allocated_elements_to_nodes[from_elements[link_index]]
                         ids.append(node_to_id(source_id, from_partition.pid))
@@ -302,11 +307,13 @@ class TheanoNode(Node):
             g_expect_array[self._partition.allocated_node_offsets[self._id] + get_numerical_gate_type("sur")] = float(value)
             g_expect_array[self._partition.allocated_node_offsets[self._id] + get_numerical_gate_type("por")] = float(value)
             self._partition.g_expect.set_value(g_expect_array, borrow=True)
+            self._partition.mark_dirty('g_expect')
         elif self.type == "Pipe" and parameter == "wait":
             g_wait_array = self._partition.g_wait.get_value(borrow=True)
             g_wait_array[self._partition.allocated_node_offsets[self._id] + get_numerical_gate_type("sur")] = int(value)
             g_wait_array[self._partition.allocated_node_offsets[self._id] + get_numerical_gate_type("por")] = int(value)
             self._partition.g_wait.set_value(g_wait_array, borrow=True)
+            self._partition.mark_dirty('g_wait')
         elif self.type == "Comment" and parameter == "comment":
             self.parameters[parameter] = value
         elif self.type in self._nodenet.native_modules:
@@ -406,6 +413,8 @@ class TheanoGate(Gate):
         theano gate proxy clas
     """
 
+    __slots__ = ('__type', '__node', '__nodenet', '__partition', '__numerictype', '__linkcache')
+
     @property
     def type(self):
         return self.__type
@@ -416,9 +425,8 @@ class TheanoGate(Gate):
 
     @property
     def empty(self):
-        w_matrix = self.__partition.w.get_value(borrow=True)
-        gatecolumn = w_matrix[:, self.__partition.allocated_node_offsets[node_from_id(self.__node.uid)] + self.__numerictype]
-        return len(np.nonzero(gatecolumn)[0]) == 0
+        element = self.__partition.allocated_node_offsets[node_from_id(self.__node.uid)] + self.__numerictype
+        return len(self.__partition.get_outgoing_elements(element)) == 0
 
     @property
     def activation(self):
@@ -429,6 +437,7 @@ class TheanoGate(Gate):
         a_array = self.__partition.a.get_value(borrow=True)
         a_array[self.__partition.allocated_node_offsets[node_from_id(self.__node.uid)] + self.__numerictype] = value
         self.__partition.a.set_value(a_array, borrow=True)
+        self.__partition.mark_dirty('a')
 
     @property
     def activations(self):
@@ -445,9 +454,8 @@ class TheanoGate(Gate):
     def get_links(self):
         if self.__linkcache is None:
             self.__linkcache = []
-            w_matrix = self.__partition.w.get_value(borrow=True)
-            gatecolumn = w_matrix[:, self.__partition.allocated_node_offsets[node_from_id(self.__node.uid)] + self.__numerictype]
-            links_indices = np.nonzero(gatecolumn)[0]
+            element = self.__partition.allocated_node_offsets[node_from_id(self.__node.uid)] + self.__numerictype
+            links_indices = self.__partition.get_outgoing_elements(element)
             for index in links_indices:
                 target_id = self.__partition.allocated_elements_to_nodes[index]
                 target_type = self.__partition.allocated_nodes[target_id]
@@ -457,7 +465,6 @@ class TheanoGate(Gate):
                 link = TheanoLink(self.__nodenet, self.__node.uid, self.__type, node_to_id(target_id, self.__partition.pid), target_slot_type)
                 self.__linkcache.append(link)
 
-            element = self.__partition.allocated_node_offsets[node_from_id(self.__node.uid)] + self.__numerictype
             # does any of the inlinks in any partition orginate from me?
             for partition_to_spid, to_partition in self.__nodenet.partitions.items():
                 if self.__partition.spid in to_partition.inlinks:
@@ -505,6 +512,8 @@ class TheanoSlot(Slot):
         theano slot proxy class
     """
 
+    __slots__ = ('__type', '__node', '__nodenet', '__partition', '__numerictype', '__linkcache')
+
     @property
     def type(self):
         return self.__type
@@ -569,8 +578,8 @@ class TheanoSlot(Slot):
                 if element in to_elements:
                     from_partition = self.__nodenet.partitions[partition_from_spid]
                     element_index = np.where(to_elements == element)[0][0]
-                    slotrow = weights[element_index]
-                    links_indices = np.nonzero(slotrow)[0]
+                    slotrow = weights[element_index:element_index + 1]
+                    links_indices = np.nonzero(slotrow)[1]
                     for link_index in links_indices:
                         source_id = from_partition.allocated_elements_to_nodes[from_elements[link_index]]
                         source_type = from_partition.allocated_nodes[source_id]
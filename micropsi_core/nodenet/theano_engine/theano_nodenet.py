@@ -5,9 +5,14 @@ Nodenet definition
 """
 import json
 import os
+import shutil
 import copy
 import math
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
+import theano
 from theano import tensor as T
 import numpy as np
 import scipy
@@ -16,15 +21,31 @@ from micropsi_core.nodenet import monitor
 from micropsi_core.nodenet.nodenet import Nodenet
 from micropsi_core.nodenet.node import Nodetype
 from micropsi_core.nodenet.stepoperators import DoernerianEmotionalModulators
+from micropsi_core.world.worldadapter import ArrayWorldAdapter
 from micropsi_core.nodenet.theano_engine.theano_node import *
 from micropsi_core.nodenet.theano_engine.theano_definitions import *
 from micropsi_core.nodenet.theano_engine.theano_stepoperators import *
 from micropsi_core.nodenet.theano_engine.theano_nodespace import *
 from micropsi_core.nodenet.theano_engine.theano_netapi import TheanoNetAPI
-from micropsi_core.nodenet.theano_engine.theano_partition import TheanoPartition
+from micropsi_core.nodenet.theano_engine.theano_partition import TheanoPartition, NPY_STORAGE_VERSION, INLINK_ARRAYS, WEIGHT_STORAGE_MODES
+from micropsi_core.nodenet.theano_engine.theano_partition import FEATURE_FLAGS, compiled_functions
+from micropsi_core.nodenet.theano_engine.theano_shards import PartitionShards, can_fork
 
 from configuration import config as settings
 
+# thread pools of map_partitions, by their number of threads. they are shared by all node nets in the
+# process, so that unloading, reverting or deleting a node net does not leave its worker threads behind
+partition_pools = {}
+partition_pools_lock = threading.Lock()
+
+
+def get_partition_pool(threads):
+    """ Returns the process-wide thread pool with the given number of threads, creating it on first use """
+    with partition_pools_lock:
+        if threads not in partition_pools:
+            partition_pools[threads] = ThreadPoolExecutor(max_workers=threads)
+        return partition_pools[threads]
+
 
 STANDARD_NODETYPES = {
     "Nodespace": {
@@ -157,6 +178,48 @@ STANDARD_NODETYPES = {
 NODENET_VERSION = 1
 
 
+class ProxyCache(OrderedDict):
+    """
+    The node and nodespace proxies by uid, forgetting the least recently used proxies when holding more than maxsize.
+    Proxies are created again when needed, so only their link caches are lost.
+    The runner and request threads use the cache at the same time, so proxies may be dropped at any moment:
+    look them up with get or pop instead of testing for them first.
+    """
+
+    def __init__(self, maxsize):
+        self.lock = threading.RLock()
+        super(ProxyCache, self).__init__()
+        self.maxsize = maxsize
+
+    def __getitem__(self, uid):
+        with self.lock:
+            proxy = super(ProxyCache, self).__getitem__(uid)
+            self.move_to_end(uid)
+            return proxy
+
+    def __setitem__(self, uid, proxy):
+        with self.lock:
+            super(ProxyCache, self).__setitem__(uid, proxy)
+            self.move_to_end(uid)
+            while len(self) > self.maxsize:
+                self.popitem(last=False)
+
+    def __delitem__(self, uid):
+        with self.lock:
+            super(ProxyCache, self).__delitem__(uid)
+
+    def get(self, uid, default=None):
+        with self.lock:
+            try:
+                return self[uid]
+            except KeyError:
+                return default
+
+    def pop(self, uid, default=None):
+        with self.lock:
+            return super(ProxyCache, self).pop(uid, default)
+
+
 class TheanoNodenet(Nodenet):
     """
         theano runtime engine implementation
@@ -240,20 +303,71 @@ class TheanoNodenet(Nodenet):
             self.logger.warn("Unsupported initial_number_of_nodes value from configuration: %s, falling back to 2000", configured_initial_number_of_nodes)
 
         sparse = True
+        self.auto_sparse = False
         configuredsparse = settings['theano']['sparse_weight_matrix']
         if configuredsparse == "True":
             sparse = True
         elif configuredsparse == "False":
             sparse = False
+        elif configuredsparse == "auto":
+            sparse = True
+            self.auto_sparse = True
         else:  # pragma: no cover
             self.logger.warn("Unsupported sparse_weight_matrix value from configuration: %s, falling back to True", configuredsparse)
             sparse = True
 
+        # densities at which partitions with automatic sparsity switch to a dense or back to a sparse w
+        self.dense_weight_matrix_density = float(settings['theano'].get('dense_weight_matrix_density', 0.25))
+        self.sparse_weight_matrix_density = float(settings['theano'].get('sparse_weight_matrix_density', 0.1))
+
+        # format of the partition data files: one .npz archive or a directory of memory-mappable .npy files per partition
+        self.partition_storage = settings['theano'].get('partition_storage', 'npz')
+        if self.partition_storage not in ('npz', 'npy'):  # pragma: no cover
+            self.logger.warn("Unsupported partition_storage value from configuration: %s, falling back to npz", self.partition_storage)
+            self.partition_storage = 'npz'
+
+        # with npy partition storage, saves write only the arrays that have changed since the last save,
+        # and every checkpoint_compaction_interval saves all of them
+        self.checkpoint_compaction_interval = int(settings['theano'].get('checkpoint_compaction_interval', 10))
+
+        # number of threads that propagate and calculate the partitions of unfused steps in parallel
+        self.partition_threads = int(settings['theano'].get('partition_threads', 1))
+        self.partition_pool = None
+
+        # number of worker processes that calculate the partitions, see can_shard_step
+        self.partition_processes = int(settings['theano'].get('partition_processes', 1))
+        self.partition_shards = None
+        self.__partition_processes_ignored = False
+
+        # calculate the steps of all partitions with one compiled propagate and one compiled calculate function
+        # where possible
+        self.fuse_steps = settings['theano'].get('fused_step', 'True') == 'True'
+        self.step_propagate_function = None
+        self.step_calculate_function = None
+        self.step_function_signature = None
+        self.steps_function = None
+        self.steps_function_signature = None
+
+        # node statistics for the dashboard, and the step and partition revisions they have been calculated for
+        self.__dashboard_statistics = None
+        self.__dashboard_statistics_key = None
+
+        # how partitions store their link weights when saved, unless chosen per partition
+        self.weight_storage = settings['theano'].get('weight_storage', 'full')
+        if self.weight_storage not in WEIGHT_STORAGE_MODES:  # pragma: no cover
+            self.logger.warn("Unsupported weight_storage value from configuration: %s, falling back to full", self.weight_storage)
+            self.weight_storage = 'full'
+
+        # number of node and nodespace changes each partition keeps in its change journal
+        self.change_journal_size = int(settings['theano'].get('change_journal_size', 100000))
+
         rootpartition = TheanoPartition(self,
                                         self.last_allocated_partition,
                                         sparse=sparse,
                                         initial_number_of_nodes=initial_number_of_nodes,
-                                        average_elements_per_node_assumption=average_elements_per_node_assumption)
+                                        average_elements_per_node_assumption=average_elements_per_node_assumption,
+                                        weight_storage=self.weight_storage,
+                                        auto_sparse=self.auto_sparse)
         self.partitions[rootpartition.spid] = rootpartition
         self.rootpartition = rootpartition
         self.partitionmap = {}
@@ -263,7 +377,10 @@ class TheanoNodenet(Nodenet):
         self._version = NODENET_VERSION  # used to check compatibility of the node net data
         self._step = 0
 
-        self.proxycache = {}
+        self.proxycache = ProxyCache(int(settings['theano'].get('proxy_cache_size', 100000)))
+
+        # uids of the nodespaces whose por-links are decayed after every step by TheanoPorLinkDecay
+        self.por_link_decay_nodespaces = set()
 
         self.stepoperators = []
         self.initialize_stepoperators()
@@ -351,30 +468,63 @@ class TheanoNodenet(Nodenet):
     def initialize_stepoperators(self):
         self.stepoperators = [
             TheanoPropagate(),
-            TheanoCalculate(self)]
+            TheanoCalculate(self),
+            TheanoPorLinkDecay()]
         if self.use_modulators:
             self.stepoperators.append(DoernerianEmotionalModulators())
         self.stepoperators.sort(key=lambda op: op.priority)
 
     def save(self, filename):
-
-        # write json metadata, which will be used by runtime to manage the net
-        with open(filename, 'w+') as fp:
-            metadata = self.metadata
-            metadata['positions'] = self.positions
-            metadata['names'] = self.names
-            metadata['actuatormap'] = self.actuatormap
-            metadata['sensormap'] = self.sensormap
-            metadata['nodes'] = self.construct_native_modules_and_comments_dict()
-            metadata['monitors'] = self.construct_monitors_dict()
-            metadata['modulators'] = self.construct_modulators_dict()
-            metadata['partition_parents'] = self.inverted_partitionmap
-            fp.write(json.dumps(metadata, sort_keys=True, indent=4))
-
+        self.get_save_snapshot(filename)()
+
+    def get_save_snapshot(self, filename):
+        # json metadata, which will be used by runtime to manage the net
+        metadata = self.metadata
+        metadata['positions'] = self.positions
+        metadata['names'] = self.names
+        metadata['actuatormap'] = self.actuatormap
+        metadata['sensormap'] = self.sensormap
+        metadata['nodes'] = self.construct_native_modules_and_comments_dict()
+        metadata['monitors'] = self.construct_monitors_dict()
+        metadata['modulators'] = self.construct_modulators_dict()
+        metadata['partition_parents'] = self.inverted_partitionmap
+        metadata['partition_storage'] = self.get_partition_storage_layout()
+        metadata['auto_sparse_partitions'] = sorted(spid for spid, partition in self.partitions.items() if partition.auto_sparse)
+        metadata['por_link_decay_nodespaces'] = sorted(self.por_link_decay_nodespaces)
+        metadata['compiled_functions'] = sorted(set(key for partition in self.partitions.values() for key in partition.get_compiled_function_keys()))
+        metadata = json.dumps(metadata, sort_keys=True, indent=4)
+
+        # bulk data in our own numpy-based file format
+        writers = []
         for partition in self.partitions.values():
-            # write bulk data to our own numpy-based file format
             datafilename = os.path.join(os.path.dirname(filename), self.uid + "-data-" + partition.spid)
-            partition.save(datafilename)
+            writers.append(partition.get_save_snapshot(datafilename, self.partition_storage))
+
+        def write():
+            for write_partition in writers:
+                write_partition()
+            with open(filename + ".tmp", 'w+') as fp:
+                fp.write(metadata)
+            os.replace(filename + ".tmp", filename)
+        return write
+
+    def get_partition_storage_layout(self, storage_format=None):
+        """
+        Returns the description of the partition data files that is stored in the metadata:
+        the format, the version of the layout and the file or directory names by partition spid
+        """
+        storage_format = storage_format or self.partition_storage
+        if storage_format == 'npy':
+            version = NPY_STORAGE_VERSION
+            extension = ""
+        else:
+            version = 1
+            extension = ".npz"
+        return {
+            'format': storage_format,
+            'version': version,
+            'partitions': dict((spid, self.uid + "-data-" + spid + extension) for spid in self.partitions)
+        }
 
     def load(self, filename):
         """Load the node net from a file"""
@@ -400,13 +550,21 @@ class TheanoNodenet(Nodenet):
             # initialize
             self.initialize_nodenet(initfrom)
 
+            # nets saved before the storage layout was recorded use .npz files
+            layout = initfrom.get('partition_storage', self.get_partition_storage_layout('npz'))
+            if layout['format'] == 'npy' and layout['version'] > NPY_STORAGE_VERSION:  # pragma: no cover
+                self.logger.warn("Partition storage version %s is newer than the supported version %s", layout['version'], NPY_STORAGE_VERSION)
+
+            datafilenames = {}
             for partition in self.partitions.values():
-                datafilename = os.path.join(os.path.dirname(filename), self.uid + "-data-" + partition.spid + ".npz")
-                partition.load_data(datafilename, nodes_data)
+                datafilename = layout['partitions'].get(partition.spid, self.uid + "-data-" + partition.spid + ".npz")
+                datafilenames[partition.spid] = os.path.join(os.path.dirname(filename), datafilename)
 
             for partition in self.partitions.values():
-                datafilename = os.path.join(os.path.dirname(filename), self.uid + "-data-" + partition.spid + ".npz")
-                partition.load_inlinks(datafilename)
+                partition.load_data(datafilenames[partition.spid], nodes_data)
+
+            for partition in self.partitions.values():
+                partition.load_inlinks(datafilenames[partition.spid])
 
             # reloading native modules ensures the types in allocated_nodes are up to date
             # (numerical native module types are runtime dependent and may differ from when allocated_nodes
@@ -424,7 +582,11 @@ class TheanoNodenet(Nodenet):
         neighbors = os.listdir(os.path.dirname(filename))
         for neighbor in neighbors:
             if neighbor.startswith(self.uid):
-                os.remove(os.path.join(os.path.dirname(filename), neighbor))
+                path = os.path.join(os.path.dirname(filename), neighbor)
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
 
     def initialize_nodenet(self, initfrom):
 
@@ -435,6 +597,8 @@ class TheanoNodenet(Nodenet):
 
         self._nodespace_ui_properties = initfrom.get('nodespace_ui_properties', {})
 
+        self.por_link_decay_nodespaces = set(initfrom.get('por_link_decay_nodespaces', []))
+
         if len(initfrom) != 0:
             # now merge in all init data (from the persisted file typically)
             self.merge_data(initfrom, keep_uids=True, native_module_instances_only=True)
@@ -473,6 +637,7 @@ class TheanoNodenet(Nodenet):
 
         # instantiate partitions
         partitions_to_instantiate = nodenet_data.get('partition_parents', {})
+        auto_sparse_partitions = nodenet_data.get('auto_sparse_partitions', [])
         largest_pid = 0
         for partition_spid, parent_uid in partitions_to_instantiate.items():
             pid = int(partition_spid)
@@ -483,7 +648,8 @@ class TheanoNodenet(Nodenet):
                                   sparse=True,
                                   initial_number_of_nodes=round(node_maxindex * 1.2 + 1),
                                   average_elements_per_node_assumption=7,
-                                  initial_number_of_nodespaces=round(len(set(nodenet_data.get('nodespaces', {}).keys())) * 1.2) + 1)
+                                  initial_number_of_nodespaces=round(len(set(nodenet_data.get('nodespaces', {}).keys())) * 1.2) + 1,
+                                  auto_sparse=self.auto_sparse or partition_spid in auto_sparse_partitions)
         self.last_allocated_partition = largest_pid
 
         # merge in spaces, make sure that parent nodespaces exist before children are initialized
@@ -508,8 +674,16 @@ class TheanoNodenet(Nodenet):
                 del data['gate_parameters']
                 invalid_nodes.append(uid)
             if native_module_instances_only:
-                node = TheanoNode(self, self.get_partition(uid), parent_uid, uid, get_numerical_node_type(data['type'], nativemodules=self.native_modules), parameters=data.get('parameters'))
-                self.proxycache[node.uid] = node
+                partition = self.get_partition(uid)
+                numerictype = get_numerical_node_type(data['type'], nativemodules=self.native_modules)
+                node = TheanoNode(self, partition, parent_uid, uid, numerictype, parameters=data.get('parameters'))
+                # kept by the partition, so the proxies with their parameters can not be dropped from the proxy cache
+                if numerictype == COMMENT:
+                    partition.comment_instances[node.uid] = node
+                elif numerictype > MAX_STD_NODETYPE:
+                    partition.native_module_instances[node.uid] = node
+                else:
+                    self.proxycache[node.uid] = node
                 new_uid = node.uid
             else:
                 new_uid = self.create_node(
@@ -605,6 +779,9 @@ class TheanoNodenet(Nodenet):
             for operator in self.stepoperators:
                 operator.execute(self, None, self.netapi)
 
+            for partition in self.partitions.values():
+                partition.compact_weights()
+
         steps = sorted(list(self.deleted_items.keys()))
         if steps:
             for i in steps:
@@ -626,8 +803,9 @@ class TheanoNodenet(Nodenet):
             return partition.native_module_instances[uid]
         elif uid in partition.comment_instances:
             return partition.comment_instances[uid]
-        elif uid in self.proxycache:
-            return self.proxycache[uid]
+        proxy = self.proxycache.get(uid)
+        if proxy is not None:
+            return proxy
         elif self.is_node(uid):
             id = node_from_id(uid)
             parent_id = partition.allocated_node_parents[id]
@@ -663,6 +841,7 @@ class TheanoNodenet(Nodenet):
         partition.announce_nodes(number_of_nodes, average_elements_per_node)
 
     def create_node(self, nodetype, nodespace_uid, position, name=None, uid=None, parameters=None, gate_parameters=None, gate_functions=None):
+        self.__dashboard_statistics = None
         nodespace_uid = self.get_nodespace(nodespace_uid).uid
         partition = self.get_partition(nodespace_uid)
         nodespace_id = nodespace_from_id(nodespace_uid)
@@ -694,6 +873,7 @@ class TheanoNodenet(Nodenet):
 
     def delete_node(self, uid):
 
+        self.__dashboard_statistics = None
         partition = self.get_partition(uid)
         node_id = node_from_id(uid)
 
@@ -704,6 +884,8 @@ class TheanoNodenet(Nodenet):
         associated_uids = []
 
         # find this node in links coming in from other partitions, and nullify the inter-partition-weight matrix
+        if partition.inlinks:
+            partition.mark_dirty(*INLINK_ARRAYS)
         for partition_from_spid, inlinks in partition.inlinks.copy().items():
             for numeric_slot in range(0, get_slots_per_type(nodetype, self.native_modules)):
                 element = partition.allocated_node_offsets[node_id] + numeric_slot
@@ -713,21 +895,22 @@ class TheanoNodenet(Nodenet):
                 if element in to_elements:
                     from_partition = self.partitions[partition_from_spid]
                     element_index = np.where(to_elements == element)[0][0]
-                    slotrow = weights[element_index]
-                    links_indices = np.nonzero(slotrow)[0]
+                    slotrow = weights[element_index:element_index + 1]
+                    links_indices = np.nonzero(slotrow)[1]
                     for link_index in links_indices:
                         source_id = from_partition.allocated_elements_to_nodes[from_elements[link_index]]
                         associated_uids.append(node_to_id(source_id, from_partition.pid))
                     # set all weights for this element to 0
-                    new_weights = np.delete(weights, element_index, 0)
-                    if len(new_weights) == 0:
+                    new_weights = weights[np.delete(np.arange(weights.shape[0]), element_index)]
+                    if new_weights.shape[0] == 0:
                         # if this was the last link, remove whole inlinks information for this partition pair
                         del partition.inlinks[partition_from_spid]
                         break
                     # find empty columns (elements linking only to this element)
-                    zero_columns = np.where(~new_weights.any(axis=0))[0]
+                    nonzero_columns = np.unique(np.nonzero(new_weights)[1])
+                    zero_columns = np.setdiff1d(np.arange(new_weights.shape[1]), nonzero_columns)
                     # remove empty columns from weight matrix:
-                    new_weights = np.delete(new_weights, zero_columns, 1)
+                    new_weights = new_weights[:, nonzero_columns]
                     # save new weight matrix
                     partition.inlinks[partition_from_spid][2].set_value(new_weights)
                     # remove this element
@@ -738,6 +921,7 @@ class TheanoNodenet(Nodenet):
         # find this node in links going out to other partitions, and nullify the inter-partition-weight matrix
         for partition_to_spid, to_partition in self.partitions.items():
             if partition.spid in to_partition.inlinks:
+                to_partition.mark_dirty(*INLINK_ARRAYS)
                 for numeric_gate in range(0, get_gates_per_type(nodetype, self.native_modules)):
                     element = partition.allocated_node_offsets[node_id] + numeric_gate
                     inlinks = to_partition.inlinks[partition.spid]
@@ -752,15 +936,16 @@ class TheanoNodenet(Nodenet):
                             target_id = to_partition.allocated_elements_to_nodes[to_elements[link_index]]
                             associated_uids.append(node_to_id(target_id, to_partition.pid))
                         # set all weights for this element to 0
-                        new_weights = np.delete(weights, element_index, 1)
-                        if len(new_weights) == 0:
+                        new_weights = weights[:, np.delete(np.arange(weights.shape[1]), element_index)]
+                        if new_weights.shape[0] == 0:
                             # if this was the last link, remove whole inlinks information for target partition
                             del to_partition.inlinks[partition.spid]
                             break
                         # find empty rows (elements linked only by this node)
-                        zero_rows = np.where(~new_weights.any(axis=1))[0]
+                        nonzero_rows = np.unique(np.nonzero(new_weights)[0])
+                        zero_rows = np.setdiff1d(np.arange(new_weights.shape[0]), nonzero_rows)
                         # remove empty rows from weight matrix
-                        new_weights = np.delete(new_weights, zero_rows, 0)
+                        new_weights = new_weights[nonzero_rows]
                         # save new weights
                         to_partition.inlinks[partition.spid][2].set_value(new_weights)
                         # remove this element
@@ -791,8 +976,7 @@ class TheanoNodenet(Nodenet):
                     proxy.get_gate(g).invalidate_caches()
                 for s in proxy.get_slot_types():
                     proxy.get_slot(s).invalidate_caches()
-            if uid_to_clear in self.proxycache:
-                del self.proxycache[uid_to_clear]
+            self.proxycache.pop(uid_to_clear, None)
 
     def set_node_gate_parameter(self, uid, gate_type, parameter, value):
         partition = self.get_partition(uid)
@@ -829,8 +1013,9 @@ class TheanoNodenet(Nodenet):
 
         partition = self.get_partition(uid)
 
-        if uid in self.proxycache:
-            return self.proxycache[uid]
+        nodespace = self.proxycache.get(uid)
+        if nodespace is not None:
+            return nodespace
         else:
             nodespace = TheanoNodespace(self, partition, uid)
             self.proxycache[uid] = nodespace
@@ -850,10 +1035,11 @@ class TheanoNodenet(Nodenet):
         for uid in positions:
             pos = (positions[uid] + [0] * 3)[:3]
             self.positions[uid] = pos
-            if uid in self.proxycache:
-                self.proxycache[uid].position = pos
+            proxy = self.proxycache.get(uid)
+            if proxy is not None:
+                proxy.position = pos
 
-    def create_partition(self, pid, parent_uid, sparse, initial_number_of_nodes, average_elements_per_node_assumption, initial_number_of_nodespaces):
+    def create_partition(self, pid, parent_uid, sparse, initial_number_of_nodes, average_elements_per_node_assumption, initial_number_of_nodespaces, weight_storage=None, auto_sparse=None):
 
         if parent_uid is None:
             parent_uid = self.get_nodespace(None).uid
@@ -864,7 +1050,9 @@ class TheanoNodenet(Nodenet):
                                     sparse=sparse,
                                     initial_number_of_nodes=initial_number_of_nodes,
                                     average_elements_per_node_assumption=average_elements_per_node_assumption,
-                                    initial_number_of_nodespaces=initial_number_of_nodespaces)
+                                    initial_number_of_nodespaces=initial_number_of_nodespaces,
+                                    weight_storage=weight_storage or self.weight_storage,
+                                    auto_sparse=self.auto_sparse if auto_sparse is None else auto_sparse)
         self.partitions[partition.spid] = partition
         if parent_uid not in self.partitionmap:
             self.partitionmap[parent_uid] = []
@@ -890,6 +1078,7 @@ class TheanoNodenet(Nodenet):
         for otherpartition in self.partitions.values():
             if spid in otherpartition.inlinks:
                 del otherpartition.inlinks[spid]
+                otherpartition.mark_dirty(*INLINK_ARRAYS)
                 for uid, node in otherpartition.native_module_instances.items():
                     for g in node.get_gate_types():
                         node.get_gate(g).invalidate_caches()
@@ -940,6 +1129,7 @@ class TheanoNodenet(Nodenet):
                     self.logger.warn("Unsupported initial_number_of_nodes value from configuration: %s, falling back to 2000", configured_initial_number_of_nodes)  # pragma: no cover
 
             sparse = True
+            auto_sparse = False
             if "sparse" in options:
                 sparse = options["sparse"]
             else:
@@ -948,9 +1138,14 @@ class TheanoNodenet(Nodenet):
                     sparse = True
                 elif configuredsparse == "False":
                     sparse = False
+                elif configuredsparse == "auto":
+                    sparse = "auto"
                 else:
                     self.logger.warn("Unsupported sparse_weight_matrix value from configuration: %s, falling back to True", configuredsparse)  # pragma: no cover
                     sparse = True
+            if sparse == "auto":
+                sparse = True
+                auto_sparse = True
 
             self.last_allocated_partition += 1
             spid = self.create_partition(
@@ -959,7 +1154,9 @@ class TheanoNodenet(Nodenet):
                 sparse=sparse,
                 initial_number_of_nodes=initial_number_of_nodes,
                 average_elements_per_node_assumption=average_elements_per_node_assumption,
-                initial_number_of_nodespaces=initial_number_of_nodespaces)
+                initial_number_of_nodespaces=initial_number_of_nodespaces,
+                weight_storage=options.get('weight_storage'),
+                auto_sparse=auto_sparse)
             partition = self.partitions[spid]
             id = partition.create_nodespace(0, id_to_pass)
             uid = nodespace_to_id(id, partition.pid)
@@ -985,11 +1182,19 @@ class TheanoNodenet(Nodenet):
             self.delete_partition(partition.pid)
         else:
             partition.delete_nodespace(nodespace_id)
+        if self.por_link_decay_nodespaces:
+            # child nodespaces have been deleted as well
+            self.por_link_decay_nodespaces = set(uid for uid in self.por_link_decay_nodespaces if self.is_nodespace(uid))
+
+    def set_por_link_decay(self, nodespace_uid, decay=True):
+        if decay:
+            self.por_link_decay_nodespaces.add(nodespace_uid)
+        else:
+            self.por_link_decay_nodespaces.discard(nodespace_uid)
 
     def clear_supplements(self, uid):
         # clear from proxycache
-        if uid in self.proxycache:
-            del self.proxycache[uid]
+        self.proxycache.pop(uid, None)
 
         # clear from name and positions dicts
         if uid in self.names:
@@ -1026,6 +1231,7 @@ class TheanoNodenet(Nodenet):
 
     def set_link_weight(self, source_node_uid, gate_type, target_node_uid, slot_type, weight=1, certainty=1):
 
+        self.__dashboard_statistics = None
         source_partition = self.get_partition(source_node_uid)
         target_partition = self.get_partition(target_node_uid)
 
@@ -1059,10 +1265,12 @@ class TheanoNodenet(Nodenet):
         else:
             source_partition.set_link_weight(source_node_id, gate_type, target_node_id, slot_type, weight)
 
-        if source_node_uid in self.proxycache:
-            self.proxycache[source_node_uid].get_gate(gate_type).invalidate_caches()
-        if target_node_uid in self.proxycache:
-            self.proxycache[target_node_uid].get_slot(slot_type).invalidate_caches()
+        source_proxy = self.proxycache.get(source_node_uid)
+        if source_proxy is not None:
+            source_proxy.get_gate(gate_type).invalidate_caches()
+        target_proxy = self.proxycache.get(target_node_uid)
+        if target_proxy is not None:
+            target_proxy.get_slot(slot_type).invalidate_caches()
         for partition in self.partitions.values():
             if source_node_uid in partition.native_module_instances:
                 partition.native_module_instances[source_node_uid].get_gate(gate_type).invalidate_caches()
@@ -1074,6 +1282,82 @@ class TheanoNodenet(Nodenet):
     def delete_link(self, source_node_uid, gate_type, target_node_uid, slot_type):
         return self.set_link_weight(source_node_uid, gate_type, target_node_uid, slot_type, 0)
 
+    def set_link_weights_bulk(self, source_node_uids, gate_types, target_node_uids, slot_types, weights=1):
+        """
+        Sets the weights of the links source_node_uids[i]:gate_types[i] -> target_node_uids[i]:slot_types[i].
+        gate_types, slot_types and weights can be given as lists or as a single value for all links.
+        Applies one update per partition and one per pair of linked partitions.
+        """
+        self.__dashboard_statistics = None
+        source_node_uids = np.asarray(source_node_uids, dtype=object)
+        target_node_uids = np.asarray(target_node_uids, dtype=object)
+        count = len(source_node_uids)
+        if len(target_node_uids) != count:
+            raise ValueError("Got %i source nodes, but %i target nodes" % (count, len(target_node_uids)))
+        if count == 0:
+            return True
+        # single values apply to all links
+        gate_type_array, slot_type_array = np.empty(count, dtype=object), np.empty(count, dtype=object)
+        gate_type_array[:] = gate_types
+        slot_type_array[:] = slot_types
+        gate_types, slot_types = gate_type_array, slot_type_array
+        weights = np.zeros(count, dtype=T.config.floatX) + np.asarray(weights, dtype=T.config.floatX)
+
+        source_spids = np.asarray([uid[1:4] for uid in source_node_uids], dtype=object)
+        target_spids = np.asarray([uid[1:4] for uid in target_node_uids], dtype=object)
+        gate_elements = np.zeros(count, dtype=np.int64)
+        slot_elements = np.zeros(count, dtype=np.int64)
+        for spid in np.unique(np.concatenate((source_spids, target_spids))):
+            partition = self.partitions.get(spid)
+            if partition is None:
+                raise ValueError("No partition with id %s exists" % spid)
+            selected = np.where(source_spids == spid)[0]
+            gate_elements[selected] = self.__get_link_elements(partition, source_node_uids[selected], gate_types[selected], True)
+            selected = np.where(target_spids == spid)[0]
+            slot_elements[selected] = self.__get_link_elements(partition, target_node_uids[selected], slot_types[selected], False)
+
+        for source_spid, target_spid in set(zip(source_spids, target_spids)):
+            selected = np.where((source_spids == source_spid) & (target_spids == target_spid))[0]
+            if source_spid == target_spid:
+                self.partitions[source_spid].set_link_weights_by_elements(slot_elements[selected], gate_elements[selected], weights[selected])
+            else:
+                self.partitions[target_spid].set_inlink_weights(source_spid, gate_elements[selected], slot_elements[selected], weights[selected], pairwise=True)
+
+        for uids, types, getter in ((source_node_uids, gate_types, 'get_gate'), (target_node_uids, slot_types, 'get_slot')):
+            for uid, type in set(zip(uids, types)):
+                proxy = self.proxycache.get(uid)
+                if proxy is None:
+                    proxy = self.partitions[uid[1:4]].native_module_instances.get(uid)
+                if proxy is not None:
+                    getattr(proxy, getter)(type).invalidate_caches()
+
+        return True
+
+    def __get_link_elements(self, partition, node_uids, types, gates):
+        # resolves the gate (or slot) elements of the given nodes, once per combination of nodetype and gate/slot type
+        ids = np.asarray([node_from_id(uid) for uid in node_uids], dtype=np.int32)
+        if len(ids) == 0:
+            return ids
+        nodetypes = partition.allocated_nodes[ids]
+        if np.any(nodetypes == 0):
+            raise ValueError("Node %s does not exist" % node_uids[np.where(nodetypes == 0)[0][0]])
+        numerical_types = np.zeros(len(ids), dtype=np.int32)
+        for nodetype, type in set(zip(nodetypes, types)):
+            definition = None
+            if nodetype > MAX_STD_NODETYPE:
+                definition = self.get_nodetype(get_string_node_type(nodetype, self.native_modules))
+            selected = np.where((nodetypes == nodetype) & (types == type))[0]
+            if gates:
+                numerical_type = get_numerical_gate_type(type, definition)
+                if numerical_type > get_gates_per_type(nodetype, self.native_modules):
+                    raise ValueError("Node %s does not have a gate of type %s" % (node_uids[selected[0]], type))
+            else:
+                numerical_type = get_numerical_slot_type(type, definition)
+                if numerical_type > get_slots_per_type(nodetype, self.native_modules):
+                    raise ValueError("Node %s does not have a slot of type %s" % (node_uids[selected[0]], type))
+            numerical_types[selected] = numerical_type
+        return partition.allocated_node_offsets[ids] + numerical_types
+
     def reload_native_modules(self, native_modules):
 
         self.native_module_definitions = native_modules
@@ -1142,6 +1426,8 @@ class TheanoNodenet(Nodenet):
             for id in native_module_ids:
                 instance = self.get_node(node_to_id(id, partition.pid))
                 partition.allocated_nodes[id] = get_numerical_node_type(instance.type, self.native_modules)
+            if len(native_module_ids):
+                partition.mark_dirty('allocated_nodes')
 
     def get_nodespace_data(self, nodespace_uid, include_links=True):
         partition = self.get_partition(nodespace_uid)
@@ -1163,33 +1449,36 @@ class TheanoNodenet(Nodenet):
 
         return data
 
-    def get_activation_data(self, nodespace_uids=[], rounded=1):
-        if rounded is not None:
-            mult = math.pow(10, rounded)
-        activations = {}
+    def get_activation_snapshot(self, nodespace_uids=[]):
+        """
+        Returns a dict of partition spids to the columnar activation snapshots (node_ids, offsets, counts, activations)
+        of the nodes in the given nodespaces, or of all nodes if no nodespaces are given
+        """
+        snapshot = {}
         if nodespace_uids == []:
-            for partition in self.partitions.values():
-                ids = np.nonzero(partition.allocated_nodes)[0]
-                for id in ids:
-                    elements = get_elements_per_type(partition.allocated_nodes[id], self.native_modules)
-                    offset = partition.allocated_node_offsets[id]
-                    if rounded is None:
-                        activations[node_to_id(id, partition.pid)] = [n.item() for n in partition.a.get_value()[offset:offset+elements]]
-                    else:
-                        activations[node_to_id(id, partition.pid)] = [n.item() / mult for n in np.rint(partition.a.get_value()[offset:offset+elements]*mult)]
+            for spid, partition in self.partitions.items():
+                snapshot[spid] = partition.get_activation_snapshot()
         else:
+            ids_by_partition = {}
             for nsuid in nodespace_uids:
                 nodespace = self.get_nodespace(nsuid)
-                partition = self.get_nodespace(nodespace.uid).partition
+                partition = nodespace.partition
                 nodespace_id = nodespace_from_id(nodespace.uid)
-                ids = np.where(partition.allocated_node_parents == nodespace_id)[0]
-                for id in ids:
-                    elements = get_elements_per_type(partition.allocated_nodes[id], self.native_modules)
-                    offset = partition.allocated_node_offsets[id]
-                    if rounded is None:
-                        activations[node_to_id(id, partition.pid)] = [n.item() for n in partition.a.get_value()[offset:offset+elements]]
-                    else:
-                        activations[node_to_id(id, partition.pid)] = [n.item() / mult for n in np.rint(partition.a.get_value()[offset:offset+elements]*mult)]
+                ids_by_partition.setdefault(partition.spid, []).append(np.where(partition.allocated_node_parents == nodespace_id)[0])
+            for spid, ids in ids_by_partition.items():
+                snapshot[spid] = self.partitions[spid].get_activation_snapshot(np.concatenate(ids))
+        return snapshot
+
+    def get_activation_data(self, nodespace_uids=[], rounded=1):
+        activations = {}
+        for spid, (ids, offsets, counts, values) in self.get_activation_snapshot(nodespace_uids).items():
+            pid = self.partitions[spid].pid
+            if rounded is not None:
+                mult = math.pow(10, rounded)
+                values = np.rint(values * mult).astype(np.float64) / mult
+            values = values.tolist()
+            for id, offset, count in zip(ids.tolist(), offsets.tolist(), counts.tolist()):
+                activations[node_to_id(id, pid)] = values[offset:offset + count]
         return activations
 
     def get_nodetype(self, type):
@@ -1210,7 +1499,7 @@ class TheanoNodenet(Nodenet):
                 node_ids = np.where(partition.allocated_node_parents == parent)[0]
             else:
                 node_ids = np.nonzero(partition.allocated_nodes)[0]
-            w_matrix = partition.w.get_value(borrow=True)
+            w_matrix = partition.get_w_columns()
             for node_id in node_ids:
 
                 source_type = partition.allocated_nodes[node_id]
@@ -1245,8 +1534,8 @@ class TheanoNodenet(Nodenet):
                     to_elements = inlinks[1].get_value(borrow=True)
                     weights = inlinks[2].get_value(borrow=True)
                     for i, element in enumerate(to_elements):
-                        slotrow = weights[i]
-                        links_indices = np.nonzero(slotrow)[0]
+                        slotrow = weights[i:i + 1]
+                        links_indices = np.nonzero(slotrow)[1]
                         for link_index in links_indices:
                             source_id = partition.allocated_elements_to_nodes[from_elements[link_index]]
                             source_type = partition.allocated_nodes[source_id]
@@ -1349,52 +1638,396 @@ class TheanoNodenet(Nodenet):
         """
         Sets the values for sensors and actuator_feedback from the worldadapter
         """
-        # convert from python types:
-        sensor_values = np.array([])
-        actuator_feedback_values = np.array([])
-        if self._worldadapter_instance:
-            sensor_values = np.concatenate((sensor_values, np.asarray(self._worldadapter_instance.get_datasource_values())))
-            actuator_feedback_values = np.concatenate((actuator_feedback_values, np.asarray(self._worldadapter_instance.get_datatarget_feedback_values())))
-        if self.use_modulators:
-            # include modulators
-            readables = [0 for _ in DoernerianEmotionalModulators.readable_modulators]
-            for idx, key in enumerate(sorted(DoernerianEmotionalModulators.readable_modulators)):
-                readables[idx] = self.get_modulator(key)
-            sensor_values = np.concatenate((sensor_values, np.asarray(readables)))
-            writeables = [0 for _ in DoernerianEmotionalModulators.writeable_modulators]
-            for idx, key in enumerate(sorted(DoernerianEmotionalModulators.writeable_modulators)):
-                writeables[idx] = 1
-            actuator_feedback_values = np.concatenate((actuator_feedback_values, np.asarray(writeables)))
-
+        sensor_values, actuator_feedback_values = self.get_sensor_and_actuator_feedback_values()
         for partition in self.partitions.values():
             a_array = partition.a.get_value(borrow=True)
             a_array[partition.sensor_indices] = sensor_values
             a_array[partition.actuator_indices] = actuator_feedback_values
             partition.a.set_value(a_array, borrow=True)
 
-    def set_actuator_values(self):
+    def get_sensor_and_actuator_feedback_values(self):
+        """
+        Returns the values for sensors and actuator_feedback from the worldadapter.
+        The returned arrays are the nodenet's preallocated buffers and are overwritten every step.
+        """
+        if self._worldadapter_instance:
+            datasource_values = self._worldadapter_instance.get_datasource_values()
+            if datasource_values is not self.worldadapter_datasource_values:
+                self.worldadapter_datasource_values[:] = datasource_values
+            feedback_values = self._worldadapter_instance.get_datatarget_feedback_values()
+            if feedback_values is not self.worldadapter_datatarget_feedback_values:
+                self.worldadapter_datatarget_feedback_values[:] = feedback_values
+        if self.readable_modulators:
+            offset = len(self.sensor_values) - len(self.readable_modulators)
+            for idx, key in enumerate(self.readable_modulators):
+                self.sensor_values[offset + idx] = self.get_modulator(key)
+
+        return self.sensor_values, self.actuator_feedback_values
+
+    def set_actuator_values(self, activations=None):
         """
-        Writes the values from the actuators to datatargets and modulators
+        Writes the values from the actuators to datatargets and modulators. The activations of the actuators
+        are taken from the partitions, or from the given dict of activation arrays by spid.
         """
-        actuator_values_to_write = np.zeros_like(self.rootpartition.actuator_indices)
+        actuator_values = self.actuator_values
+        actuator_values.fill(0)
         for partition in self.partitions.values():
-            a_array = partition.a.get_value(borrow=True)
-            actuator_values_to_write = actuator_values_to_write + a_array[partition.actuator_indices]
-        if self.use_modulators and bool(self.actuatormap):
-            writeables = sorted(DoernerianEmotionalModulators.writeable_modulators)
+            if activations is not None:
+                a_array = activations[partition.spid]
+            else:
+                a_array = partition.a.get_value(borrow=True)
+            a_array.take(partition.actuator_indices, out=self.partition_actuator_values)
+            actuator_values += self.partition_actuator_values
+        self.write_actuator_values(actuator_values)
+
+    def write_actuator_values(self, actuator_values_to_write):
+        """
+        Writes the given actuator values to datatargets and modulators
+        """
+        if self.writeable_modulators:
             # remove modulators from actuator values
-            modulator_values = actuator_values_to_write[-len(writeables):]
-            actuator_values_to_write = actuator_values_to_write[:-len(writeables)]
-            for idx, key in enumerate(writeables):
-                if key in self.actuatormap:
-                    self.set_modulator(key, modulator_values[idx])
+            modulator_values = actuator_values_to_write[-len(self.writeable_modulators):]
+            if bool(self.actuatormap):
+                for idx, key in enumerate(self.writeable_modulators):
+                    if key in self.actuatormap:
+                        self.set_modulator(key, modulator_values[idx])
         if self._worldadapter_instance:
-            self._worldadapter_instance.set_datatarget_values(actuator_values_to_write)
+            if actuator_values_to_write is self.actuator_values:
+                datatarget_values = self.worldadapter_datatarget_values
+            else:
+                datatarget_values = actuator_values_to_write[:len(actuator_values_to_write) - len(self.writeable_modulators)]
+            self._worldadapter_instance.set_datatarget_values(datatarget_values)
+
+    def _allocate_worldadapter_buffers(self):
+        """
+        Preallocates the sensor, actuator feedback and actuator value arrays that are exchanged with the
+        worldadapter and the modulators every step, and hands views on them to array worldadapters, which can
+        then fill the sensor and feedback values in place. The actuator values are copied to the worldadapter,
+        since the buffer is zeroed and refilled every step
+        """
+        if self.use_modulators:
+            self.readable_modulators = sorted(DoernerianEmotionalModulators.readable_modulators)
+            self.writeable_modulators = sorted(DoernerianEmotionalModulators.writeable_modulators)
+        else:
+            self.readable_modulators = []
+            self.writeable_modulators = []
+        num_datasources = len(self.get_datasources())
+        num_datatargets = len(self.get_datatargets())
+
+        self.sensor_values = np.zeros(num_datasources, dtype=T.config.floatX)
+        self.actuator_feedback_values = np.zeros(num_datatargets, dtype=T.config.floatX)
+        # writeable modulators always report success
+        self.actuator_feedback_values[num_datatargets - len(self.writeable_modulators):] = 1
+        # the worldadapters have so far been handed float64 values, keep it that way
+        self.actuator_values = np.zeros(num_datatargets, dtype=np.float64)
+        self.partition_actuator_values = np.zeros(num_datatargets, dtype=T.config.floatX)
+
+        self.worldadapter_datasource_values = self.sensor_values[:num_datasources - len(self.readable_modulators)]
+        self.worldadapter_datatarget_feedback_values = self.actuator_feedback_values[:num_datatargets - len(self.writeable_modulators)]
+        self.worldadapter_datatarget_values = self.actuator_values[:num_datatargets - len(self.writeable_modulators)]
+        if isinstance(self._worldadapter_instance, ArrayWorldAdapter):
+            self._worldadapter_instance.set_value_buffers(
+                self.worldadapter_datasource_values,
+                self.worldadapter_datatarget_values,
+                self.worldadapter_datatarget_feedback_values)
+
+    def get_weight_storage_report(self):
+        """
+        Returns, by partition spid, how the partition's link weights are stored, and the memory and precision
+        of the stored weights compared to floatX weights. See TheanoPartition.get_weight_storage_report
+        """
+        return dict((spid, partition.get_weight_storage_report()) for spid, partition in self.partitions.items())
+
+    def map_partitions(self, function):
+        """
+        Calls function for every partition and returns when all calls are done.
+        With partition_threads > 1, the calls are distributed over a pool of that many threads, so function may
+        only change the partition it is called for.
+        """
+        partitions = list(self.partitions.values())
+        if self.partition_threads < 2 or len(partitions) < 2:
+            for partition in partitions:
+                function(partition)
+            return
+        self.partition_pool = get_partition_pool(self.partition_threads)
+        # start with the largest partitions, so that no large partition is left for the end of the phase
+        partitions.sort(key=lambda partition: partition.NoE, reverse=True)
+        # consuming the results waits for all calls, and re-raises their exceptions
+        for _ in self.partition_pool.map(function, partitions):
+            pass
+
+    def can_shard_step(self):
+        """
+        Returns True if the partitions can be calculated by partition_processes worker processes, i.e. if there
+        are several partitions, and no native modules need python in this process during the step
+        """
+        if self.partition_processes < 2 or len(self.partitions) < 2 or not can_fork():
+            return False
+        for partition in self.partitions.values():
+            if partition.native_module_instances:
+                if not self.__partition_processes_ignored:
+                    self.logger.info("Node net %s has native modules, partition_processes is ignored and its "
+                                     "partitions are calculated in the runtime process" % self.uid)
+                    self.__partition_processes_ignored = True
+                return False
+        self.__partition_processes_ignored = False
+        return True
+
+    def calculate_sharded_step(self):
+        """
+        Propagates and calculates all partitions in the worker processes, which are started if there are none yet,
+        or restarted if nodes, inlinks or partitions have changed since they have been started. Other changes to
+        the partitions are sent to the workers with the step.
+        """
+        # switching between sparse and dense w recompiles the propagation, which is sent to the workers with w
+        for partition in self.partitions.values():
+            partition.update_sparsity()
+        updates = None
+        if self.partition_shards is not None:
+            updates = self.partition_shards.get_updates()
+            if updates is None:
+                self.stop_partition_shards()
+        if self.partition_shards is None:
+            self.partition_shards = PartitionShards(self, self.partition_processes)
+            updates = [{} for spids in self.partition_shards.assignments]
+        exchange_values = self._worldadapter_instance is not None or bool(self.sensormap) or bool(self.actuatormap)
+        self.partition_shards.step(self.current_step, updates, exchange_values)
+
+    def stop_partition_shards(self):
+        """ Ends the partition worker processes, if any """
+        if self.partition_shards is not None:
+            self.partition_shards.stop()
+            self.partition_shards = None
+
+    def close(self):
+        self.stop_partition_shards()
+
+    def can_fuse_step(self):
+        """
+        Returns True if propagation and calculation of all partitions can be done by the fused step function,
+        i.e. if no native modules need to be calculated in python between the two
+        """
+        if not self.fuse_steps:
+            return False
+        for partition in self.partitions.values():
+            if partition.native_module_instances:
+                return False
+        return True
+
+    def calculate_fused_step(self):
+        """
+        Propagates and calculates all partitions with one call to the fused propagate function and one call to
+        the fused calculate function, which are recompiled only if partitions, inlinks or the features used by
+        the partitions changed. As in the unfused step, the actuator values are written between the two, before
+        the sensor values are read.
+        """
+        partitions = [self.partitions[spid] for spid in sorted(self.partitions.keys())]
+        for partition in partitions:
+            partition.flush_link_updates()
+            partition.update_sparsity()
+            partition.prepare_calculate()
+
+        signature = tuple(partition.get_step_graph_signature() for partition in partitions)
+        if self.step_calculate_function is None or signature != self.step_function_signature:
+            self.compile_step_functions(partitions)
+            self.step_function_signature = signature
+
+        self.step_propagate_function()
+        self.set_actuator_values()
+
+        sensor_values, actuator_feedback_values = self.get_sensor_and_actuator_feedback_values()
+        arguments = []
+        for partition in partitions:
+            arguments.extend([partition.sensor_indices, sensor_values, partition.actuator_indices, actuator_feedback_values])
+            if partition.has_directional_activators or partition.has_sampling_activators:
+                arguments.append(partition.allocated_elements_to_activators)
+        self.step_calculate_function(*arguments)
+
+    def compile_step_functions(self, partitions):
+        """
+        Compiles the step graphs of the given partitions into the fused propagate and calculate functions
+        """
+        propagate_updates = []
+        inputs = []
+        updates = []
+        for partition in partitions:
+            propagate_updates.extend(partition.get_step_propagate_graph())
+            partition_inputs, partition_updates = partition.get_step_calculate_graph()
+            inputs.extend(partition_inputs)
+            updates.extend(partition_updates)
+        self.logger.debug("Compiling fused step functions for %i partitions" % len(partitions))
+        self.step_propagate_function = theano.function([], None, updates=propagate_updates)
+        self.step_calculate_function = theano.function(inputs, None, updates=updates)
+
+    def can_run_steps(self):
+        """
+        Returns True if several steps can be calculated by one call to a compiled scan function,
+        i.e. if no native modules, sensors, actuators, modulators or monitors need python between the steps
+        """
+        if not self.can_fuse_step():
+            return False
+        if self.worldadapter_instance is not None or self.sensormap or self.actuatormap:
+            return False
+        return not self.use_modulators and not self._monitors
+
+    def run_steps(self, steps, node_uids=None):
+        """
+        Calculates the given number of steps. If possible, all steps are calculated by one compiled
+        theano.scan function, otherwise the steps are calculated one by one, updating the monitors.
+        Returns a dict of the activations of the given nodes' elements after each step, as arrays of shape
+        (steps, number of elements), i.e. one column per gate for all but native modules. The final state of the net is the same as after calling step() repeatedly.
+        """
+        node_uids = node_uids or []
+        elements = {}
+        columns = {}
+        for uid in node_uids:
+            partition = self.get_partition(uid)
+            id = node_from_id(uid)
+            offset = partition.allocated_node_offsets[id]
+            number_of_elements = get_elements_per_type(partition.allocated_nodes[id], self.native_modules)
+            partition_elements = elements.setdefault(partition.spid, [])
+            columns[uid] = (partition.spid, len(partition_elements), len(partition_elements) + number_of_elements)
+            partition_elements.extend(range(offset, offset + number_of_elements))
+
+        if steps > 0 and self.can_run_steps():
+            with self.netlock:
+                recorded = self.calculate_steps(steps, elements)
+        else:
+            recorded = dict((spid, np.zeros((max(steps, 0), len(elements[spid])), dtype=self.numpyfloatX)) for spid in elements)
+            for i in range(steps):
+                self.step()
+                self.update_monitors()
+                for spid in elements:
+                    recorded[spid][i] = self.partitions[spid].a.get_value(borrow=True)[elements[spid]]
+
+        return dict((uid, recorded[spid][:, start:end]) for uid, (spid, start, end) in columns.items())
+
+    def calculate_steps(self, steps, elements):
+        """
+        Calculates the given number of steps with the compiled scan function and returns the activations
+        of the given elements (a dict of element lists by spid) after each step, by spid
+        """
+        # the scan function changes the partitions in this process, which leaves the worker processes behind
+        self.stop_partition_shards()
+        partitions = [self.partitions[spid] for spid in sorted(self.partitions.keys())]
+        for partition in partitions:
+            partition.flush_link_updates()
+            partition.update_sparsity()
+            partition.prepare_calculate()
+
+        record_elements = tuple((spid, tuple(elements[spid])) for spid in sorted(elements.keys()))
+        signature = (tuple(partition.get_step_graph_signature() for partition in partitions), record_elements)
+        if self.steps_function is None or signature != self.steps_function_signature:
+            self.compile_steps_function(partitions, record_elements)
+            self.steps_function_signature = signature
+
+        arguments = [steps, self.current_step + 1]
+        for partition in partitions:
+            if partition.has_directional_activators or partition.has_sampling_activators:
+                arguments.append(partition.allocated_elements_to_activators)
+        outputs = self.steps_function(*arguments)
+
+        self._step += steps
+        for partition in partitions:
+            partition.t.set_value(np.int32(self.current_step))
+            partition.compact_weights()
+
+        steps_to_keep = sorted(list(self.deleted_items.keys()))
+        for i in steps_to_keep:
+            if i >= self.current_step - 100:
+                break
+            else:
+                del self.deleted_items[i]
+
+        return dict((spid, outputs[i]) for i, (spid, record) in enumerate(record_elements))
+
+    def compile_steps_function(self, partitions, record_elements):
+        """
+        Compiles a theano.scan function calculating a number of steps of the given partitions, returning
+        the activations of the elements given in record_elements after each step
+        """
+        steps = T.iscalar("steps")
+        first_step = T.iscalar("first_step")
+        inputs = [steps, first_step]
+
+        # recurrent states: a, a_in and (for pipes) countdown of each partition
+        states = []
+        for partition in partitions:
+            states.extend([partition.a, partition.a_in])
+            if partition.has_pipes:
+                states.append(partition.g_countdown)
+        non_sequences = []
+        for partition in partitions:
+            if partition.has_directional_activators or partition.has_sampling_activators:
+                non_sequences.append(T.ivector("elements_to_activators_%s" % partition.spid))
+        inputs.extend(non_sequences)
+        record_elements = dict(record_elements)
+
+        def step(t, *arguments):
+            arguments = list(arguments)
+            activations = {}
+            partition_states = {}
+            for partition in partitions:
+                a, a_in = arguments.pop(0), arguments.pop(0)
+                countdown = arguments.pop(0) if partition.has_pipes else None
+                activations[partition.spid] = a
+                partition_states[partition.spid] = (a, a_in, countdown)
+            new_states = []
+            outputs = []
+            for partition in partitions:
+                a, a_in, countdown = partition_states[partition.spid]
+                elements_to_activators = None
+                if partition.has_directional_activators or partition.has_sampling_activators:
+                    elements_to_activators = arguments.pop(0)
+                propagated = partition.get_propagate_graph(a, a_in, activations)
+                gatefunctions, countdown, g_factor = partition.get_calculate_graph(propagated, a, countdown, t, elements_to_activators)
+                new_states.extend([gatefunctions, T.zeros_like(a_in)])
+                if partition.has_pipes:
+                    new_states.append(countdown)
+                outputs.append(a)
+                if elements_to_activators is not None:
+                    outputs.append(g_factor)
+                if partition.spid in record_elements:
+                    outputs.append(gatefunctions[np.asarray(record_elements[partition.spid], dtype=np.int32)])
+            return new_states + outputs
+
+        number_of_outputs = 0
+        for partition in partitions:
+            number_of_outputs += 1
+            if partition.has_directional_activators or partition.has_sampling_activators:
+                number_of_outputs += 1
+            if partition.spid in record_elements:
+                number_of_outputs += 1
+
+        results, updates = theano.scan(fn=step,
+                                       sequences=[T.arange(first_step, first_step + steps, dtype='int32')],
+                                       outputs_info=states + [None] * number_of_outputs,
+                                       non_sequences=non_sequences,
+                                       n_steps=steps)
+
+        updates = list(updates.items())
+        recorded = []
+        results = list(results)
+        for partition in partitions:
+            updates.append((partition.a, results.pop(0)[-1]))
+            updates.append((partition.a_in, results.pop(0)[-1]))
+            if partition.has_pipes:
+                updates.append((partition.g_countdown, results.pop(0)[-1]))
+        for partition in partitions:
+            updates.append((partition.a_prev, results.pop(0)[-1]))
+            if partition.has_directional_activators or partition.has_sampling_activators:
+                updates.append((partition.g_factor, results.pop(0)[-1]))
+            if partition.spid in record_elements:
+                recorded.append(results.pop(0))
+
+        self.logger.debug("Compiling scan function for %i partitions" % len(partitions))
+        self.steps_function = theano.function(inputs, recorded, updates=updates)
 
     def _rebuild_sensor_actor_indices(self, partition=None):
         """
         Rebuilds the actor and sensor indices of the given partition or all partitions if None
         """
+        self._allocate_worldadapter_buffers()
         if partition is not None:
             partitions = [partition]
         else:
@@ -1468,6 +2101,16 @@ class TheanoNodenet(Nodenet):
         partition = self.get_partition(nodespace_uid)
         partition.ungroup_nodes(nodespace_uid, group)
 
+    def register_weight_block(self, nodespace_from_uid, group_from, nodespace_to_uid, group_to):
+        if nodespace_from_uid is None:
+            nodespace_from_uid = self.get_nodespace(None).uid
+        if nodespace_to_uid is None:
+            nodespace_to_uid = self.get_nodespace(None).uid
+        partition = self.get_partition(nodespace_from_uid)
+        if partition != self.get_partition(nodespace_to_uid):
+            raise ValueError("Weight blocks can only be registered for groups in the same partition")
+        partition.register_weight_block(nodespace_from_uid, group_from, nodespace_to_uid, group_to)
+
     def dump_group(self, nodespace_uid, group):
         if nodespace_uid is None:
             nodespace_uid = self.get_nodespace(None).uid
@@ -1522,11 +2165,15 @@ class TheanoNodenet(Nodenet):
             indices_from = np.searchsorted(inlinks[0].get_value(borrow=True), partition_from.nodegroups[nodespace_from_uid][group_from])
             indices_to = np.searchsorted(inlinks[1].get_value(borrow=True), partition_to.nodegroups[nodespace_to_uid][group_to])
             cols, rows = np.meshgrid(indices_from, indices_to)
-            return inlinks[2].get_value(borrow=True)[rows, cols]
+            weights = inlinks[2].get_value(borrow=True)[rows, cols]
+            if scipy.sparse.issparse(weights):
+                return weights.toarray()
+            return weights
         else:
             return partition_from.get_link_weights(nodespace_from_uid, group_from, nodespace_to_uid, group_to)
 
     def set_link_weights(self, nodespace_from_uid, group_from, nodespace_to_uid, group_to, new_w):
+        self.__dashboard_statistics = None
         if nodespace_from_uid is None:
             nodespace_from_uid = self.get_nodespace(None).uid
         if nodespace_to_uid is None:
@@ -1548,14 +2195,20 @@ class TheanoNodenet(Nodenet):
         else:
             partition_from.set_link_weights(nodespace_from_uid, group_from, nodespace_to_uid, group_to, new_w)
 
-        self.proxycache.clear()
-
-        # uids_to_invalidate = self.get_node_uids(nodespace_from_uid, group_from)
-        # uids_to_invalidate.extend(self.get_node_uids(nodespace_to_uid, group_to))
-
-        # for uid in uids_to_invalidate:
-        #     if uid in self.proxycache:
-        #         del self.proxycache[uid]
+        self.invalidate_link_caches(partition_from, partition_from.nodegroups[nodespace_from_uid][group_from])
+        self.invalidate_link_caches(partition_to, partition_to.nodegroups[nodespace_to_uid][group_to])
+
+    def invalidate_link_caches(self, partition, elements):
+        """ Drops the cached links of the nodes the given elements of the given partition belong to """
+        for id in np.unique(partition.allocated_elements_to_nodes[elements]):
+            uid = node_to_id(id, partition.pid)
+            self.proxycache.pop(uid, None)
+            proxy = partition.native_module_instances.get(uid)
+            if proxy is not None:
+                for gate_type in proxy.get_gate_types():
+                    proxy.get_gate(gate_type).invalidate_caches()
+                for slot_type in proxy.get_slot_types():
+                    proxy.get_slot(slot_type).invalidate_caches()
 
     def get_available_gatefunctions(self):
         return ["identity", "absolute", "sigmoid", "tanh", "rect", "one_over_x"]
@@ -1585,13 +2238,15 @@ class TheanoNodenet(Nodenet):
         if nodespace_uids == []:
             nodespace_uids = self.get_nodespace_uids()
 
+        # deleted_items only holds the steps in which something has been deleted
+        for i in sorted(self.deleted_items.keys()):
+            if i >= since_step:
+                result['nodespaces_deleted'].extend(self.deleted_items[i].get('nodespaces_deleted', []))
+                result['nodes_deleted'].extend(self.deleted_items[i].get('nodes_deleted', []))
+
         for nsuid in nodespace_uids:
             nodespace = self.get_nodespace(nsuid)
             partition = self.get_partition(nodespace.uid)
-            for i in range(since_step, self.current_step + 1):
-                if i in self.deleted_items:
-                    result['nodespaces_deleted'].extend(self.deleted_items[i].get('nodespaces_deleted', []))
-                    result['nodes_deleted'].extend(self.deleted_items[i].get('nodes_deleted', []))
             changed_nodes, changed_nodespaces = partition.get_nodespace_changes(nodespace.uid, since_step)
             for uid in changed_nodes:
                 uid = node_to_id(uid, partition.pid)
@@ -1603,12 +2258,27 @@ class TheanoNodenet(Nodenet):
 
     def get_dashboard(self):
         data = super(TheanoNodenet, self).get_dashboard()
-        data['count_nodes'] = 0
         data['count_links'] = -1
-        data['count_positive_nodes'] = 0
-        data['count_negative_nodes'] = 0
         data['modulators'] = self.construct_modulators_dict()
-        data['nodetypes'] = {'NativeModules': 0}
+        # activations set between steps change the statistics, too, and mark the partition dirty
+        key = (self.current_step, tuple((spid, partition.revision) for spid, partition in sorted(self.partitions.items())))
+        if self.__dashboard_statistics is None or self.__dashboard_statistics_key != key:
+            self.__dashboard_statistics = self.get_node_statistics()
+            self.__dashboard_statistics_key = key
+        data.update(copy.deepcopy(self.__dashboard_statistics))
+        return data
+
+    def get_node_statistics(self):
+        """
+        Returns the node counts shown in the dashboard: nodes per type, nodes with positive or negative
+        gen activation, and the states of the concepts and schemas (pipes without sur links)
+        """
+        data = {
+            'count_nodes': 0,
+            'count_positive_nodes': 0,
+            'count_negative_nodes': 0,
+            'nodetypes': {'NativeModules': 0}
+        }
         data['concepts'] = {
             'checking': 0,
             'verified': 0,
@@ -1625,38 +2295,63 @@ class TheanoNodenet(Nodenet):
         for uid, partition in self.partitions.items():
             node_ids = np.nonzero(partition.allocated_nodes)[0]
             data['count_nodes'] += len(node_ids)
-            for id in node_ids:
-                if partition.allocated_nodes[id] <= MAX_STD_NODETYPE:
-                    nodetype = get_string_node_type(partition.allocated_nodes[id])
-                    if nodetype not in data['nodetypes']:
-                        data['nodetypes'][nodetype] = 1
-                    else:
-                        data['nodetypes'][nodetype] += 1
+            node_types = partition.allocated_nodes[node_ids]
+            for type in np.unique(node_types).tolist():
+                count = int(np.count_nonzero(node_types == type))
+                if type <= MAX_STD_NODETYPE:
+                    nodetype = get_string_node_type(type)
+                    data['nodetypes'][nodetype] = data['nodetypes'].get(nodetype, 0) + count
                 else:
-                    data['nodetypes']['NativeModules'] += 1
-                act = float(partition.a.get_value(borrow=True)[partition.allocated_node_offsets[id] + GEN])
-                if act > 0:
-                    data['count_positive_nodes'] += 1
-                elif act < 0:
-                    data['count_negative_nodes'] += 1
-                if partition.allocated_nodes[id] == PIPE:
-                    node = self.get_node(node_to_id(id, partition.pid))
-                    if node.get_gate('gen').activation == 0 and node.get_gate('sub').activation > 0 and len(node.get_gate('sub').get_links()):
-                        data['concepts']['checking'] += 1
-                        if node.get_gate('sur').get_links() == []:
-                            data['schemas']['checking'] += 1
-                    elif node.get_gate('sub').activation > 0 and node.activation > 0.5:
-                        data['concepts']['verified'] += 1
-                        if node.get_gate('sur').get_links() == []:
-                            data['schemas']['verified'] += 1
-                    elif node.activation < 0:
-                        data['concepts']['failed'] += 1
-                        if node.get_gate('sur').get_links() == []:
-                            data['schemas']['failed'] += 1
-                    else:
-                        data['concepts']['off'] += 1
-                        if node.get_gate('sur').get_links() == []:
-                            data['schemas']['off'] += 1
+                    data['nodetypes']['NativeModules'] += count
+
+            a = partition.a.get_value(borrow=True)
+            offsets = partition.allocated_node_offsets[node_ids]
+            gen = a[offsets + GEN]
+            data['count_positive_nodes'] += int(np.count_nonzero(gen > 0))
+            data['count_negative_nodes'] += int(np.count_nonzero(gen < 0))
+
+            pipe_offsets = offsets[node_types == PIPE]
+            if len(pipe_offsets) == 0:
+                continue
+            gen = a[pipe_offsets + GEN]
+            sub = a[pipe_offsets + SUB]
+            sub_linked = partition.get_linked_gate_flags(pipe_offsets + SUB)
+            sur_unlinked = np.logical_not(partition.get_linked_gate_flags(pipe_offsets + SUR))
+
+            checking = (gen == 0) & (sub > 0) & sub_linked
+            verified = np.logical_not(checking) & (sub > 0) & (gen > 0.5)
+            failed = np.logical_not(checking | verified) & (gen < 0)
+            off = np.logical_not(checking | verified | failed)
+            for state, mask in (('checking', checking), ('verified', verified), ('failed', failed), ('off', off)):
+                data['concepts'][state] += int(np.count_nonzero(mask))
+                data['schemas'][state] += int(np.count_nonzero(mask & sur_unlinked))
         data['schemas']['total'] = sum(data['schemas'].values())
         data['concepts']['total'] = sum(data['concepts'].values())
         return data
+
+
+def warm_up_compiled_functions(keys):
+    """
+    Compiles the propagate and calculate_nodes functions for the given keys of the compiled function cache,
+    as saved in the compiled_functions metadata of theano node nets, on small throwaway partitions.
+    Keys for another floatX or another set of feature flags are skipped.
+    """
+    nodenet = None
+    for key in sorted(set(tuple(key) for key in keys)):
+        if key in compiled_functions or len(key) < 3 or key[1] != T.config.floatX:
+            continue
+        if key[0] == 'propagate' and len(key) == 3:
+            sparse, flags = key[2], ()
+        elif key[0] == 'calculate_nodes' and len(key) == 2 + len(FEATURE_FLAGS):
+            sparse, flags = True, key[2:]
+        else:
+            continue
+        if nodenet is None:
+            nodenet = TheanoNodenet(name="warm-up", use_modulators=False)
+        # creating the partition compiles its propagate function
+        partition = TheanoPartition(nodenet, 0, sparse=sparse, initial_number_of_nodes=1, average_elements_per_node_assumption=1,
+                                    initial_number_of_nodespaces=1)
+        if flags:
+            for name, value in zip(FEATURE_FLAGS, flags):
+                setattr(partition, name, value)
+            partition.compile_calculate()
@@ -1,9 +1,11 @@
 
 
+import json
 import os
 
 import theano
 from theano import tensor as T
+from theano.compile.sharedvalue import SharedVariable
 import numpy as np
 import scipy.sparse as sp
 import theano.sparse as ST
@@ -12,6 +14,95 @@ from theano.tensor import nnet as N
 from micropsi_core.nodenet.theano_engine.theano_definitions import *
 
 
+# version of the layout of partitions stored as directories of .npy files.
+# version 1 has one <key>.npy file per array, version 2 adds a manifest naming the latest file of each array
+NPY_STORAGE_VERSION = 2
+
+# name of the manifest file in .npy partition directories
+NPY_MANIFEST = "manifest.json"
+
+# the ways the link weights of a partition can be stored: in floatX, as float16, or as int8 with one scale per row
+WEIGHT_STORAGE_MODES = ('full', 'float16', 'int8')
+
+# the arrays saved per partition, grouped by the operations that change them
+LINK_ARRAYS = ('w_data', 'w_indices', 'w_indptr', 'w_scale')
+INLINK_ARRAYS = ('inlink_pids', 'inlink_from_lengths', 'inlink_to_lengths', 'inlink_weight_lengths', 'inlink_from_elements',
+                 'inlink_to_elements', 'inlink_weight_rows', 'inlink_weight_cols', 'inlink_weight_data')
+NODE_ARRAYS = ('sizeinformation', 'allocated_nodes', 'allocated_node_offsets', 'allocated_elements_to_nodes', 'allocated_node_parents',
+               'allocated_nodespaces', 'allocated_elements_to_activators', 'allocated_nodespaces_por_activators',
+               'allocated_nodespaces_ret_activators', 'allocated_nodespaces_sub_activators', 'allocated_nodespaces_sur_activators',
+               'allocated_nodespaces_cat_activators', 'allocated_nodespaces_exp_activators', 'allocated_nodespaces_sampling_activators')
+GATE_ARRAYS = ('g_theta', 'g_threshold', 'g_amplification', 'g_min', 'g_max', 'g_function_selector', 'g_expect', 'g_wait', 'n_function_selector')
+STATE_ARRAYS = ('a', 'g_factor', 'g_countdown')
+PARTITION_ARRAYS = LINK_ARRAYS + INLINK_ARRAYS + NODE_ARRAYS + GATE_ARRAYS + STATE_ARRAYS
+# the arrays whose changes can be copied to another copy of the partition with get_values and set_values
+VALUE_ARRAYS = LINK_ARRAYS + GATE_ARRAYS + STATE_ARRAYS
+
+# the flags for the features a partition uses, which determine the graph of its calculate_nodes function
+FEATURE_FLAGS = ('has_pipes', 'has_lstms', 'has_directional_activators', 'has_sampling_activators',
+                 'has_gatefunction_absolute', 'has_gatefunction_sigmoid', 'has_gatefunction_tanh',
+                 'has_gatefunction_rect', 'has_gatefunction_one_over_x')
+
+# the shared variables of a partition that its propagate and calculate_nodes functions read and update
+COMPILED_FUNCTION_VARIABLES = ('w', 't', 'a', 'a_in', 'a_prev', 'a_shifted', 'g_theta', 'g_theta_shifted', 'g_factor',
+                               'g_threshold', 'g_amplification', 'g_min', 'g_max', 'g_function_selector', 'g_expect',
+                               'g_countdown', 'g_wait', 'n_function_selector', 'n_node_porlinked', 'n_node_retlinked')
+
+# propagate and calculate_nodes functions compiled with the shared variables as explicit inputs, shared by
+# all partitions of all node nets in the process. keys are those of TheanoPartition.get_compiled_function_keys,
+# values are the function and the names of the shared variables it reads and updates.
+# the partitions run copies of these functions, see copy_function.
+compiled_functions = {}
+
+# kinds of entries in the change journal of partitions
+CHANGED_NODE = 0
+CHANGED_NODESPACE = 1
+
+
+def copy_function(function):
+    """
+    Returns a copy of the compiled theano function with storage of its own. A theano function must not be called
+    from several threads at once, so partitions that may be calculated in parallel each run their own copy.
+    Copying only links the already optimized graph again, which is much cheaper than compiling it.
+    """
+    if hasattr(function, 'copy'):
+        return function.copy()
+    # theano 0.7 has no Function.copy
+    return function.maker.create()
+
+
+def read_npy_manifest(path):
+    """ Returns the manifest of the .npy partition directory at path, or None if it has none """
+    filename = os.path.join(path, NPY_MANIFEST)
+    if not os.path.isfile(filename):
+        return None
+    with open(filename) as fp:
+        return json.load(fp)
+
+
+class NpyDirectory():
+    """
+    Read access to partition data stored as one .npy file per array, with the interface of the NpzFile
+    returned by np.load. The arrays are memory-mapped copy-on-write, so their pages are read on demand.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.manifest = read_npy_manifest(path)
+
+    def __filename(self, key):
+        if self.manifest is not None:
+            return self.manifest['arrays'].get(key)
+        return key + ".npy"
+
+    def __contains__(self, key):
+        filename = self.__filename(key)
+        return filename is not None and os.path.isfile(os.path.join(self.path, filename))
+
+    def __getitem__(self, key):
+        return np.load(os.path.join(self.path, self.__filename(key)), mmap_mode='c')
+
+
 class TheanoPartition():
 
     @property
@@ -22,6 +113,22 @@ class TheanoPartition():
     def rootnodespace_uid(self):
         return "s%s1" % self.spid
 
+    @property
+    def w(self):
+        # weights kept in float16 or int8 between steps are expanded to floatX before anyone gets to see w
+        if not self.__w_expanded:
+            self.__expand_weights()
+        # link changes to sparse partitions are staged, so merge them before anyone gets to see w
+        if self.__staged_link_rows or self.__staged_link_chunks:
+            self.flush_link_updates()
+        return self.__w
+
+    @w.setter
+    def w(self, value):
+        self.__w = value
+        self.__w_expanded = True
+        self.mark_dirty(*LINK_ARRAYS)
+
     @property
     def has_new_usages(self):
         return self.__has_new_usages
@@ -120,7 +227,64 @@ class TheanoPartition():
             self.__has_new_usages = True
             self.__has_gatefunction_one_over_x = value
 
-    def __init__(self, nodenet, pid, sparse=True, initial_number_of_nodes=2000, average_elements_per_node_assumption=5, initial_number_of_nodespaces=10):
+    def __init__(self, nodenet, pid, sparse=True, initial_number_of_nodes=2000, average_elements_per_node_assumption=5, initial_number_of_nodespaces=10, weight_storage='full', auto_sparse=False):
+
+        # names of the saved arrays that have changed since the last save, see mark_dirty
+        self.dirty_arrays = set(PARTITION_ARRAYS)
+
+        # incremented by mark_dirty, tells whether the partition has changed since a given revision
+        self.revision = 0
+
+        # names of the arrays that have changed since partition worker processes have last been given the
+        # partition's values, see mark_dirty and PartitionShards
+        self.changed_arrays = set(PARTITION_ARRAYS)
+
+        # with float16 or int8 weight_storage, the weights are kept in that precision between steps: the stored data,
+        # the row scales (int8 only) and, for sparse w, its indices and indptr, or None if w has changed since.
+        # w then holds an empty matrix, and is expanded to floatX when it is accessed, see compact_weights
+        self.__w_compact = None
+        self.__w_expanded = True
+
+        # whether the links have changed since update_sparsity last measured the density of w
+        self.__density_changed = True
+
+        # per nodespace id, the positions of the por-links of its pipes in w, and the w they have been found in.
+        # see get_por_link_entries
+        self.__por_link_entries = {}
+
+        # dense weight matrices of pairs of node groups, see register_weight_block
+        self.__weight_blocks = {}
+
+        # the .npy directory this partition has last been saved to or loaded from, its manifest,
+        # the number of incremental saves since all arrays have been written, and the step of the last save
+        self.__checkpoint_path = None
+        self.__checkpoint_manifest = None
+        self.__checkpoint_deltas = 0
+        self.__checkpoint_step = None
+
+        # staged link weight changes for sparse partitions (rows, cols and weights of single set_link_weight calls,
+        # and chunks of arrays), merged into w in one operation by flush_link_updates
+        self.__staged_link_rows = []
+        self.__staged_link_cols = []
+        self.__staged_link_weights = []
+        self.__staged_link_chunks = []
+
+        # column-oriented (CSC) copy of a sparse w for lookups of outgoing links, and the w it has been built from
+        self.__w_columns = None
+        self.__w_columns_source = None
+
+        # a and g_theta with 7 zero guard elements on each side, and the (NoE, 14) strided views on them that
+        # are set as a_shifted and g_theta_shifted. g_theta is copied only if it has changed since the last step.
+        self.__a_padded = None
+        self.__a_padded_shifted = None
+        self.__g_theta_padded = None
+        self.__g_theta_padded_shifted = None
+        self.__g_theta_shifted_dirty = True
+
+        # indices of the sur elements of pipes and of the elements controlled by an activator,
+        # rebuilt on demand after nodes or activators have changed
+        self.__sur_elements = None
+        self.__activated_elements = None
 
         # logger used by this partition
         self.logger = nodenet.logger
@@ -152,6 +316,15 @@ class TheanoPartition():
         # sparsity flag for this partition
         self.sparse = sparse
 
+        # if set, w is switched between sparse and dense depending on its density, see update_sparsity
+        self.auto_sparse = auto_sparse
+
+        # how the link weights are stored between steps and when the partition is saved, one of WEIGHT_STORAGE_MODES.
+        # weights are always calculated in floatX
+        if weight_storage not in WEIGHT_STORAGE_MODES:
+            raise ValueError("Unsupported weight storage: %s" % weight_storage)
+        self.weight_storage = weight_storage
+
         # array, index is node id, value is numeric node type
         self.allocated_nodes = None
 
@@ -176,6 +349,11 @@ class TheanoPartition():
         # array, index is nodespace id, value is nodenet-step where the immediate children of this nodespace were last modified
         self.nodespaces_contents_last_changed = np.zeros(self.NoNS, dtype=np.int32) - 1
 
+        # ring buffer of the changes of nodes and nodespaces, with the step, the id, the parent nodespace id and the kind
+        # (CHANGED_NODE or CHANGED_NODESPACE) of each change, see get_nodespace_changes
+        self.change_journal_size = nodenet.change_journal_size
+        self.clear_change_journal()
+
         # directional activator assignment, key is nodespace ID, value is activator ID
         self.allocated_nodespaces_por_activators = None
         self.allocated_nodespaces_ret_activators = None
@@ -242,6 +420,11 @@ class TheanoPartition():
 
         self.inlinks = {}
 
+        # inlink weight blocks are stored as sparse matrices if they have at least sparse_inlinks_min_size entries,
+        # of which at most a share of sparse_inlinks_max_density are links
+        self.sparse_inlinks_min_size = 4096
+        self.sparse_inlinks_max_density = 0.1
+
         self.deleted_items = {}
 
         # instantiate theano data structures
@@ -319,31 +502,135 @@ class TheanoPartition():
         self.__has_gatefunction_one_over_x = False
         self.por_ret_dirty = True
 
-        self.last_allocated_node = 0
         self.last_allocated_offset = 0
         self.last_allocated_nodespace = 0
 
+        # free-list allocator state: a stack of free node IDs (lowest ID on top), and per range size a stack of
+        # offsets of free element ranges of that size. filled by delete_node and grow_*, rebuilt by load_data.
+        self.free_node_ids = []
+        self.free_element_ranges = {}
+        self.rebuild_free_lists()
+
+        # this partition's copies of the functions in compiled_functions, by key
+        self.compiled_function_copies = {}
         self.compile_propagate()
 
     def compile_propagate(self):
+        self.propagate = self.get_compiled_function(self.get_compiled_function_keys()[0], self.__get_propagate_updates)
+
+    def compile_calculate_nodes(self):
+        self.calculate_nodes = self.get_compiled_function(self.get_compiled_function_keys()[1], self.__get_calculate_nodes_updates)
+
+    def __get_propagate_updates(self):
         if self.sparse:
-            self.propagate = theano.function([], None, updates=[(self.a_prev, self.a), (self.a, self.a_in + ST.dot(self.w, self.a)),
-                                                                          (self.a_in, T.zeros_like(self.a_in))])
+            propagated = self.a_in + ST.dot(self.w, self.a)
         else:
-            self.propagate = theano.function([], None, updates=[(self.a_prev, self.a), (self.a, self.a_in + T.dot(self.w, self.a)),
-                                                                          (self.a_in, T.zeros_like(self.a_in))])
+            propagated = self.a_in + T.dot(self.w, self.a)
+        return [(self.a_prev, self.a), (self.a, propagated), (self.a_in, T.zeros_like(self.a_in))]
 
-    def compile_calculate_nodes(self):
-        slots = self.a_shifted
-        biases = self.g_theta_shifted
-        countdown = self.g_countdown
+    def __get_calculate_nodes_updates(self):
+        gatefunctions, countdown = self.get_calculate_nodes_graph(self.a, self.a_prev, self.a_shifted, self.g_theta_shifted, self.g_factor)
+        if self.has_pipes:
+            return [(self.a, gatefunctions), (self.g_countdown, countdown)]
+        return [(self.a, gatefunctions)]
+
+    def get_feature_flags(self):
+        """ Returns the values of the FEATURE_FLAGS of this partition """
+        return tuple(getattr(self, name) for name in FEATURE_FLAGS)
+
+    def get_values(self, keys):
+        """
+        Returns the values of the given VALUE_ARRAYS and the feature flags, to be set on another copy of the
+        partition with set_values. Changed LINK_ARRAYS are returned as the whole of w.
+        """
+        values = {'features': self.get_feature_flags()}
+        if any(key in keys for key in LINK_ARRAYS):
+            values['w'] = (self.sparse, self.w.get_value(borrow=True))
+        for key in GATE_ARRAYS + STATE_ARRAYS:
+            if key in keys:
+                values[key] = getattr(self, key).get_value(borrow=True)
+        return values
+
+    def set_values(self, values):
+        """ Sets the values returned by get_values of another copy of this partition """
+        if 'w' in values:
+            sparse, w_matrix = values['w']
+            self.set_sparse(sparse)
+            self.w.set_value(w_matrix, borrow=True)
+            self.mark_dirty(*LINK_ARRAYS)
+            self.invalidate_w_columns()
+            self.por_ret_dirty = True
+        for key in GATE_ARRAYS + STATE_ARRAYS:
+            if key in values:
+                getattr(self, key).set_value(values[key], borrow=True)
+        if 'g_theta' in values:
+            self.__g_theta_shifted_dirty = True
+        for name, value in zip(FEATURE_FLAGS, values['features']):
+            setattr(self, name, value)
+
+    def get_compiled_function_keys(self):
+        """
+        Returns the keys of the propagate and the calculate_nodes function of this partition in compiled_functions.
+        The compiled functions only depend on floatX, the sparsity of w and the feature flags, not on the partition.
+        """
+        return ('propagate', T.config.floatX, self.sparse), ('calculate_nodes', T.config.floatX) + self.get_feature_flags()
+
+    def get_compiled_function(self, key, get_updates):
+        """
+        Returns a callable that runs this partition's copy of the function for key from compiled_functions on the
+        shared variables of this partition and stores the results in them. If the function is not cached yet, it is
+        compiled from the (shared variable, new value) pairs returned by get_updates, with the shared variables as
+        inputs.
+        """
+        if key not in compiled_functions:
+            updates = get_updates()
+            outputs = [value for variable, value in updates]
+            names = dict((id(getattr(self, name)), name) for name in COMPILED_FUNCTION_VARIABLES)
+            shared_inputs = [variable for variable in theano.gof.graph.inputs(outputs) if isinstance(variable, SharedVariable)]
+            if not all(id(variable) in names for variable in shared_inputs + [variable for variable, value in updates]):
+                # the graph uses other shared variables, compile it for this partition only
+                return theano.function([], None, updates=updates)
+            inputs = [variable.type() for variable in shared_inputs]
+            outputs = theano.clone(outputs, replace=dict(zip(shared_inputs, inputs)))
+            self.logger.debug("Compiling %s function" % key[0])
+            compiled_functions[key] = (theano.function(inputs, outputs),
+                                       [names[id(variable)] for variable in shared_inputs],
+                                       [names[id(variable)] for variable, value in updates])
+
+        function, input_names, output_names = compiled_functions[key]
+        if key not in self.compiled_function_copies:
+            self.compiled_function_copies[key] = copy_function(function)
+        function = self.compiled_function_copies[key]
+        # the shared variables are only replaced by load_data and set_sparse, which compile the functions again.
+        # w is still read through its property, which expands compact weights and merges staged link changes
+        inputs = [getattr(self, name) for name in input_names]
+        outputs = [getattr(self, name) for name in output_names]
+        w_index = input_names.index('w') if 'w' in input_names else None
+
+        def run():
+            arguments = [variable.get_value(borrow=True, return_internal_type=True) for variable in inputs]
+            if w_index is not None:
+                arguments[w_index] = self.w.get_value(borrow=True, return_internal_type=True)
+            values = function(*arguments)
+            for variable, value in zip(outputs, values):
+                variable.set_value(value, borrow=True)
+        return run
+
+    def get_calculate_nodes_graph(self, a, a_prev, slots, biases, g_factor, countdown=None, t=None):
+        """
+        Returns the theano expressions for the new gate activations and pipe countdowns, calculated from
+        the propagated activations a, the activations of the previous step a_prev, the shifted slot and bias
+        matrices and the activator factors g_factor. Countdown and step default to the shared variables.
+        """
+        if countdown is None:
+            countdown = self.g_countdown
+        if t is None:
+            t = self.t
         por_linked = self.n_node_porlinked
         ret_linked = self.n_node_retlinked
 
         # node functions implemented with identity by default (native modules are calculated by python)
-        nodefunctions = self.a
-        a_prev = self.a_prev
-        t = self.t
+        nodefunctions = a
 
         # pipe logic
 
@@ -446,12 +733,12 @@ class TheanoPartition():
         if self.has_pipes:
             if self.has_directional_activators:
                 nodefunctions = T.switch(T.eq(self.n_function_selector, NFPG_PIPE_GEN), pipe_gen, nodefunctions)
-                nodefunctions = T.switch(T.eq(self.n_function_selector, NFPG_PIPE_POR), pipe_por * self.g_factor, nodefunctions)
-                nodefunctions = T.switch(T.eq(self.n_function_selector, NFPG_PIPE_RET), pipe_ret * self.g_factor, nodefunctions)
-                nodefunctions = T.switch(T.eq(self.n_function_selector, NFPG_PIPE_SUB), pipe_sub * self.g_factor, nodefunctions)
-                nodefunctions = T.switch(T.eq(self.n_function_selector, NFPG_PIPE_SUR), pipe_sur * self.g_factor, nodefunctions)
-                nodefunctions = T.switch(T.eq(self.n_function_selector, NFPG_PIPE_CAT), pipe_cat * self.g_factor, nodefunctions)
-                nodefunctions = T.switch(T.eq(self.n_function_selector, NFPG_PIPE_EXP), pipe_exp * self.g_factor, nodefunctions)
+                nodefunctions = T.switch(T.eq(self.n_function_selector, NFPG_PIPE_POR), pipe_por * g_factor, nodefunctions)
+                nodefunctions = T.switch(T.eq(self.n_function_selector, NFPG_PIPE_RET), pipe_ret * g_factor, nodefunctions)
+                nodefunctions = T.switch(T.eq(self.n_function_selector, NFPG_PIPE_SUB), pipe_sub * g_factor, nodefunctions)
+                nodefunctions = T.switch(T.eq(self.n_function_selector, NFPG_PIPE_SUR), pipe_sur * g_factor, nodefunctions)
+                nodefunctions = T.switch(T.eq(self.n_function_selector, NFPG_PIPE_CAT), pipe_cat * g_factor, nodefunctions)
+                nodefunctions = T.switch(T.eq(self.n_function_selector, NFPG_PIPE_EXP), pipe_exp * g_factor, nodefunctions)
             else:
                 nodefunctions = T.switch(T.eq(self.n_function_selector, NFPG_PIPE_GEN), pipe_gen, nodefunctions)
                 nodefunctions = T.switch(T.eq(self.n_function_selector, NFPG_PIPE_POR), pipe_por, nodefunctions)
@@ -480,7 +767,7 @@ class TheanoPartition():
 
         sample = T.eq(T.mod(t, 3), 0)
         if self.has_sampling_activators:
-            sample = sample * T.gt(self.g_factor, 0.99)
+            sample = sample * T.gt(g_factor, 0.99)
 
         ### gen
         s = slots[:, 7]
@@ -560,63 +847,197 @@ class TheanoPartition():
 
         gatefunctions = limited_gate_function_output
 
-        # put the theano graph into a callable function to be executed
-        if self.has_pipes:
-            self.calculate_nodes = theano.function([], None, updates=[(self.a, gatefunctions), (self.g_countdown, countdown)])
-        else:
-            self.calculate_nodes = theano.function([], None, updates=[(self.a, gatefunctions)])
+        return gatefunctions, countdown
 
     def get_compiled_propagate_inlinks(self, from_partition, from_elements, to_elements, weights):
-        propagated_a = T.dot(weights, from_partition.a[from_elements])
+        if sp.issparse(weights.get_value(borrow=True)):
+            propagated_a = ST.dot(weights, from_partition.a[from_elements])
+        else:
+            propagated_a = T.dot(weights, from_partition.a[from_elements])
         a_in = T.inc_subtensor(self.a_in[to_elements], propagated_a, inplace=True, tolerate_inplace_aliasing=True)
         return theano.function([], None, updates=[(self.a_in, a_in)], accept_inplace=True)
 
-    def calculate(self):
+    def get_step_propagate_graph(self):
+        """
+        Returns the updates of the theano graph for the propagation part of a step of this partition:
+        propagation across w and all inlinks, with the activations of the previous step kept in a_prev.
+        The nodenet compiles the graphs of all partitions into one fused propagate function.
+        """
+        activations = dict((spid, partition.a) for spid, partition in self.nodenet.partitions.items())
+        a = self.get_propagate_graph(self.a, self.a_in, activations)
+        return [(self.a_prev, self.a), (self.a, a), (self.a_in, T.zeros_like(self.a_in))]
+
+    def get_step_calculate_graph(self):
+        """
+        Returns the inputs and updates of the theano graph for the calculation part of a step of this partition,
+        after the propagation: sensor and actuator feedback values, node and gate functions.
+        The nodenet compiles the graphs of all partitions into one fused calculate function.
+        Inputs are the sensor indices and values, the actuator indices and feedback values and, if activators
+        are used, the element-to-activator mapping.
+        """
+        sensor_indices = T.ivector("sensor_indices_%s" % self.spid)
+        sensor_values = T.vector("sensor_values_%s" % self.spid, dtype=T.config.floatX)
+        actuator_indices = T.ivector("actuator_indices_%s" % self.spid)
+        actuator_feedback_values = T.vector("actuator_feedback_values_%s" % self.spid, dtype=T.config.floatX)
+        inputs = [sensor_indices, sensor_values, actuator_indices, actuator_feedback_values]
+        updates = []
+
+        a = T.set_subtensor(self.a[sensor_indices], sensor_values)
+        a = T.set_subtensor(a[actuator_indices], actuator_feedback_values)
+
+        elements_to_activators = None
+        if self.has_directional_activators or self.has_sampling_activators:
+            elements_to_activators = T.ivector("elements_to_activators_%s" % self.spid)
+            inputs.append(elements_to_activators)
+
+        gatefunctions, countdown, g_factor = self.get_calculate_graph(a, self.a_prev, elements_to_activators=elements_to_activators)
+        if elements_to_activators is not None:
+            updates.append((self.g_factor, g_factor))
+        updates.append((self.a, gatefunctions))
+        if self.has_pipes:
+            updates.append((self.g_countdown, countdown))
 
-        self.t.set_value(np.int32(self.nodenet.current_step))
+        return inputs, updates
 
-        if self.has_new_usages:
-            self.compile_propagate()
-            self.compile_calculate_nodes()
-            self.has_new_usages = False
+    def get_propagate_graph(self, a, a_in, activations):
+        """
+        Returns the theano expression for the activations propagated across w and all inlinks, given the
+        activations of this partition, its a_in vector and a dict of the activations of all partitions by spid
+        """
+        if self.sparse:
+            propagated = a_in + ST.dot(self.w, a)
+        else:
+            propagated = a_in + T.dot(self.w, a)
+        for spid, inlinks in sorted(self.inlinks.items()):
+            if sp.issparse(inlinks[2].get_value(borrow=True)):
+                propagated_a = ST.dot(inlinks[2], activations[spid][inlinks[0]])
+            else:
+                propagated_a = T.dot(inlinks[2], activations[spid][inlinks[0]])
+            propagated = T.inc_subtensor(propagated[inlinks[1]], propagated_a)
+        return propagated
+
+    def get_calculate_graph(self, a, a_prev, countdown=None, t=None, elements_to_activators=None):
+        """
+        Returns the theano expressions for the new gate activations, pipe countdowns and activator factors,
+        calculated from the propagated activations a and the activations of the previous step a_prev.
+        The activator factors are only calculated if the element-to-activator mapping is given.
+        """
+        g_factor = self.g_factor
+        if elements_to_activators is not None:
+            a = T.set_subtensor(a[0], 1)
+            g_factor = a[elements_to_activators]
+
+        if self.has_pipes or self.has_lstms:
+            slots = self.get_shifted_graph(a)
+            biases = self.get_shifted_graph(self.g_theta)
+        else:
+            slots = self.a_shifted
+            biases = self.g_theta_shifted
+
+        gatefunctions, countdown = self.get_calculate_nodes_graph(a, a_prev, slots, biases, g_factor, countdown=countdown, t=t)
+        return gatefunctions, countdown, g_factor
+
+    def get_shifted_graph(self, vector):
+        """
+        Returns a theano expression for the (NoE, 14) matrix of the given vector's values shifted by -7 to 6,
+        padded with zeros, i.e. the symbolic equivalent of a_shifted
+        """
+        padding = T.zeros((7,), dtype=vector.dtype)
+        padded = T.concatenate([padding, vector, padding])
+        length = vector.shape[0]
+        return T.concatenate([padded[i:i + length].dimshuffle(0, 'x') for i in range(14)], axis=1)
+
+    def get_step_graph_signature(self):
+        """ Returns a key that changes whenever get_step_propagate_graph or get_step_calculate_graph would return a different graph """
+        shared_variables = (self.w, self.t, self.a, self.a_in, self.a_prev, self.a_shifted, self.g_theta, self.g_theta_shifted,
+                            self.g_factor, self.g_threshold, self.g_amplification, self.g_min, self.g_max,
+                            self.g_function_selector, self.g_countdown, self.n_function_selector,
+                            self.n_node_porlinked, self.n_node_retlinked)
+        flags = self.get_feature_flags()
+        inlinks = tuple((spid, id(inlinks[2])) for spid, inlinks in sorted(self.inlinks.items()))
+        return self.spid, tuple(id(variable) for variable in shared_variables), flags, inlinks
+
+    def prepare_calculate(self):
+        """ Updates the step counter and the por/ret flags before the node functions are calculated """
+
+        self.t.set_value(np.int32(self.nodenet.current_step))
 
         if self.por_ret_dirty:
             self.rebuild_por_linked()
             self.rebuild_ret_linked()
             self.por_ret_dirty = False
 
+    def calculate(self, native_modules=True):
+        """
+        Calculates the node functions of the partition, and, unless native_modules is False, its native modules.
+        If native_modules is False, calculate_native_modules needs to be called afterwards.
+        """
+        self.compile_calculate()
+
+        self.prepare_calculate()
+
         self.__take_native_module_slot_snapshots()
         if self.has_pipes or self.has_lstms:
             self.__rebuild_shifted()
         if self.has_directional_activators or self.__has_sampling_activators:
             self.__calculate_g_factors()
         self.calculate_nodes()
-        self.__calculate_native_modules()
+        if native_modules:
+            self.calculate_native_modules()
+
+    def compile_calculate(self):
+        """ Recompiles propagate and calculate_nodes if the features used by the partition have changed """
+        if self.has_new_usages:
+            self.compile_propagate()
+            self.compile_calculate_nodes()
+            self.has_new_usages = False
 
     def __take_native_module_slot_snapshots(self):
         for uid, instance in self.native_module_instances.items():
             instance.take_slot_activation_snapshot()
 
-    def __calculate_native_modules(self):
+    def calculate_native_modules(self):
         for uid, instance in self.native_module_instances.items():
             instance.node_function()
 
     def __calculate_g_factors(self):
         a = self.a.get_value(borrow=True)
         a[0] = 1.
-        g_factor = a[self.allocated_elements_to_activators]
+        if self.__activated_elements is None:
+            # gather for all elements once, so elements without activator are reset to 1
+            self.__activated_elements = np.nonzero(self.allocated_elements_to_activators)[0]
+            g_factor = a[self.allocated_elements_to_activators]
+        else:
+            g_factor = self.g_factor.get_value(borrow=True)
+            g_factor[self.__activated_elements] = a[self.allocated_elements_to_activators[self.__activated_elements]]
         self.g_factor.set_value(g_factor, borrow=True)
 
+    def get_sur_elements(self):
+        """ Returns the indices of the sur gate elements of all pipes in this partition """
+        if self.__sur_elements is None:
+            self.__sur_elements = np.where(self.n_function_selector.get_value(borrow=True) == NFPG_PIPE_SUR)[0]
+        return self.__sur_elements
+
+    def __invalidate_element_indices(self):
+        self.__sur_elements = None
+        self.__activated_elements = None
+
     def __rebuild_shifted(self):
         a_array = self.a.get_value(borrow=True)
-        a_rolled_array = np.roll(a_array, 7)
-        a_shifted_matrix = np.lib.stride_tricks.as_strided(a_rolled_array, shape=(self.NoE, 14), strides=(self.nodenet.byte_per_float, self.nodenet.byte_per_float))
-        self.a_shifted.set_value(a_shifted_matrix, borrow=True)
+        if self.__a_padded is None or len(self.__a_padded) != self.NoE + 14:
+            self.__a_padded = np.zeros(self.NoE + 14, dtype=a_array.dtype)
+            self.__a_padded_shifted = np.lib.stride_tricks.as_strided(self.__a_padded, shape=(self.NoE, 14), strides=(self.__a_padded.itemsize, self.__a_padded.itemsize))
+            self.__g_theta_padded = np.zeros(self.NoE + 14, dtype=a_array.dtype)
+            self.__g_theta_padded_shifted = np.lib.stride_tricks.as_strided(self.__g_theta_padded, shape=(self.NoE, 14), strides=(self.__g_theta_padded.itemsize, self.__g_theta_padded.itemsize))
+            self.__g_theta_shifted_dirty = True
 
-        g_theta_array = self.g_theta.get_value(borrow=True)
-        g_theta_rolled_array = np.roll(g_theta_array, 7)
-        g_theta_shifted_matrix = np.lib.stride_tricks.as_strided(g_theta_rolled_array, shape=(self.NoE, 14), strides=(self.nodenet.byte_per_float, self.nodenet.byte_per_float))
-        self.g_theta_shifted.set_value(g_theta_shifted_matrix, borrow=True)
+        self.__a_padded[7:-7] = a_array
+        self.a_shifted.set_value(self.__a_padded_shifted, borrow=True)
+
+        if self.__g_theta_shifted_dirty:
+            self.__g_theta_padded[7:-7] = self.g_theta.get_value(borrow=True)
+            self.g_theta_shifted.set_value(self.__g_theta_padded_shifted, borrow=True)
+            self.__g_theta_shifted_dirty = False
 
     def rebuild_por_linked(self):
 
@@ -689,61 +1110,334 @@ class TheanoPartition():
         new_node_changed_offsets[0:self.NoN] = self.nodes_last_changed
         self.nodes_last_changed = new_node_changed_offsets
 
+        # the new IDs go on top of the free ID stack, lowest first
+        self.free_node_ids.extend(range(new_NoN - 1, self.NoN - 1, -1))
+
         self.NoN = new_NoN
         self.has_new_usages = True
 
-    def save(self, datafilename):
-
-        allocated_nodes = self.allocated_nodes
-        allocated_node_offsets = self.allocated_node_offsets
-        allocated_elements_to_nodes = self.allocated_elements_to_nodes
-        allocated_node_parents = self.allocated_node_parents
-        allocated_nodespaces = self.allocated_nodespaces
-        allocated_elements_to_activators = self.allocated_elements_to_activators
-
-        allocated_nodespaces_por_activators = self.allocated_nodespaces_por_activators
-        allocated_nodespaces_ret_activators = self.allocated_nodespaces_ret_activators
-        allocated_nodespaces_sub_activators = self.allocated_nodespaces_sub_activators
-        allocated_nodespaces_sur_activators = self.allocated_nodespaces_sur_activators
-        allocated_nodespaces_cat_activators = self.allocated_nodespaces_cat_activators
-        allocated_nodespaces_exp_activators = self.allocated_nodespaces_exp_activators
-
-        allocated_nodespaces_sampling_activators = self.allocated_nodespaces_sampling_activators
-
-        w = self.w.get_value(borrow=True)
-
-        # if we're sparse, convert to sparse matrix for persistency
-        if not self.sparse:
-            w = sp.csr_matrix(w)
-
-        a = self.a.get_value(borrow=True)
-        g_theta = self.g_theta.get_value(borrow=True)
-        g_factor = self.g_factor.get_value(borrow=True)
-        g_threshold = self.g_threshold.get_value(borrow=True)
-        g_amplification = self.g_amplification.get_value(borrow=True)
-        g_min = self.g_min.get_value(borrow=True)
-        g_max = self.g_max.get_value(borrow=True)
-        g_function_selector = self.g_function_selector.get_value(borrow=True)
-        g_expect = self.g_expect.get_value(borrow=True)
-        g_countdown = self.g_countdown.get_value(borrow=True)
-        g_wait = self.g_wait.get_value(borrow=True)
-        n_function_selector = self.n_function_selector.get_value(borrow=True)
+    def mark_dirty(self, *keys):
+        """ Records that the given saved arrays (all arrays, if none are given) have changed since the last save """
+        self.revision += 1
+        if not keys or 'w_data' in keys or 'w_indices' in keys:
+            # whoever changes w works on the floatX weights, which need to be stored again
+            if not self.__w_expanded:
+                self.__expand_weights()
+            self.__w_compact = None
+        if keys:
+            self.dirty_arrays.update(keys)
+            self.changed_arrays.update(keys)
+        else:
+            self.dirty_arrays.update(PARTITION_ARRAYS)
+            self.changed_arrays.update(PARTITION_ARRAYS)
+        if not keys or 'w_indices' in keys:
+            self.__density_changed = True
+            # entries may have been inserted into or removed from w in place, which moves the others
+            for block in self.__weight_blocks.values():
+                block['positions'] = None
+                block['source'] = None
+        if not keys or 'w_indices' in keys or 'allocated_node_parents' in keys:
+            self.__por_link_entries = {}
+        if not keys or 'w_data' in keys:
+            for block in self.__weight_blocks.values():
+                block['stale'] = True
+
+    def update_sparsity(self):
+        """
+        For partitions with auto_sparse set, measures the density of w if the links have changed, and
+        switches w to a dense matrix if the density is at least nodenet.dense_weight_matrix_density,
+        or to a sparse matrix if it is at most nodenet.sparse_weight_matrix_density.
+        Returns True if w has been switched.
+        """
+        if not self.auto_sparse or not self.__density_changed:
+            return False
+        w_matrix = self.w.get_value(borrow=True)
+        self.__density_changed = False
+        if self.sparse:
+            density = w_matrix.nnz / float(self.NoE * self.NoE)
+            if density < self.nodenet.dense_weight_matrix_density:
+                return False
+        else:
+            density = np.count_nonzero(w_matrix) / float(self.NoE * self.NoE)
+            if density > self.nodenet.sparse_weight_matrix_density:
+                return False
+        self.logger.info("Weight matrix density of partition %i is %.4f, switching to a %s matrix" %
+                         (self.pid, density, "dense" if self.sparse else "sparse"))
+        self.set_sparse(not self.sparse)
+        return True
+
+    def set_sparse(self, sparse):
+        """ Converts w to a sparse (scipy CSR) or dense matrix, and recompiles the propagation """
+        if sparse == self.sparse:
+            return
+        w_matrix = self.w.get_value(borrow=True)
+        if sparse:
+            w_matrix = sp.csr_matrix(w_matrix, dtype=self.nodenet.scipyfloatX)
+        else:
+            w_matrix = w_matrix.toarray().astype(T.config.floatX)
+        self.sparse = sparse
+        self.w = theano.shared(value=w_matrix, name="w", borrow=True)
+        self.__density_changed = False
+        self.invalidate_w_columns()
+        self.compile_propagate()
 
-        sizeinformation = [self.NoN, self.NoE, self.NoNS]
+    def save(self, datafilename, storage_format="npz"):
+        """
+        Saves the partition's bulk data to datafilename + ".npz", or, if storage_format is "npy",
+        to one .npy file per array in the directory datafilename.
+        If the partition has been saved to or loaded from that directory before, only the arrays that have changed
+        since are written, and the directory's manifest is updated to point to them. Every
+        nodenet.checkpoint_compaction_interval saves, all arrays are written again and the old files are removed.
+        """
+        self.get_save_snapshot(datafilename, storage_format)()
+
+    def get_save_snapshot(self, datafilename, storage_format="npz"):
+        """
+        Copies the arrays a save to datafilename would write, and returns a function that writes them.
+        The copy needs to be taken while the nodenet does not change, the returned function can be called
+        from any thread. See save for the arguments.
+        """
+        if self.nodenet.current_step != self.__checkpoint_step:
+            # the step has changed the state arrays, which is no change to the partition's revision
+            self.dirty_arrays.update(STATE_ARRAYS)
+        self.__checkpoint_step = self.nodenet.current_step
+
+        if storage_format != "npy":
+            arrays = self.__copy_saved_arrays(PARTITION_ARRAYS)
+            self.__checkpoint_path = None
+            self.__checkpoint_manifest = None
+            self.dirty_arrays = set()
+
+            def write():
+                with open(datafilename + ".npz.tmp", 'wb') as fp:
+                    np.savez(fp, **arrays)
+                os.replace(datafilename + ".npz.tmp", datafilename + ".npz")
+            return write
+
+        # write everything if the directory does not hold our last save, or if it is time for a compaction
+        interval = self.nodenet.checkpoint_compaction_interval
+        manifest = read_npy_manifest(datafilename) if os.path.isdir(datafilename) else None
+        full = manifest is None or \
+            manifest != self.__checkpoint_manifest or \
+            self.__checkpoint_path != datafilename or \
+            interval < 1 or \
+            self.__checkpoint_deltas + 1 >= interval
+
+        if full:
+            keys = PARTITION_ARRAYS
+        else:
+            keys = [key for key in PARTITION_ARRAYS if key in self.dirty_arrays]
+            if not keys:
+                return lambda: None
+
+        generation = manifest['generation'] + 1 if manifest is not None else 1
+        arrays = self.__copy_saved_arrays(keys)
+        files = {} if full else dict(manifest['arrays'])
+        for key in arrays:
+            files[key] = "%s.%i.npy" % (key, generation)
+        manifest = {
+            'version': NPY_STORAGE_VERSION,
+            'generation': generation,
+            'deltas': 0 if full else self.__checkpoint_deltas + 1,
+            'arrays': files
+        }
+
+        # the next save builds on this one. should writing it fail, the next save writes everything.
+        self.__checkpoint_path = datafilename
+        self.__checkpoint_manifest = manifest
+        self.__checkpoint_deltas = manifest['deltas']
+        self.dirty_arrays = set()
+
+        def write():
+            try:
+                self.__write_npy_directory(datafilename, arrays, manifest)
+            except:
+                self.__checkpoint_manifest = None
+                raise
+        return write
+
+    def __copy_saved_arrays(self, keys):
+        return dict((key, np.array(value)) for key, value in self.get_saved_arrays(keys).items())
+
+    def __write_npy_directory(self, datafilename, arrays, manifest):
+        if not os.path.isdir(datafilename):
+            os.makedirs(datafilename)
+
+        # new arrays go to new files, so that the files of the last complete save, and arrays still
+        # mapped from them, stay valid until the manifest has been replaced
+        files = manifest['arrays']
+        for key, value in arrays.items():
+            with open(os.path.join(datafilename, files[key]), 'wb') as fp:
+                np.save(fp, value)
+
+        filename = os.path.join(datafilename, NPY_MANIFEST)
+        with open(filename + ".tmp", 'w') as fp:
+            fp.write(json.dumps(manifest, sort_keys=True, indent=4))
+        os.replace(filename + ".tmp", filename)
+
+        # remove the files the manifest does not point to anymore
+        current = set(files.values())
+        current.add(NPY_MANIFEST)
+        for filename in os.listdir(datafilename):
+            if filename not in current:
+                try:
+                    os.remove(os.path.join(datafilename, filename))
+                except OSError:  # pragma: no cover
+                    self.logger.warn("Could not remove outdated partition data file %s" % filename)
+
+    def get_saved_arrays(self, keys=PARTITION_ARRAYS):
+        """ Returns a dict of the arrays with the given names, as they are saved """
+        keys = set(keys)
+        arrays = {}
+
+        if keys.intersection(LINK_ARRAYS):
+            if self.__w_compact is not None and self.sparse:
+                data, scale, indices, indptr = self.__w_compact
+            else:
+                w = self.w.get_value(borrow=True)
+                # if we're dense, convert to sparse matrix for persistency
+                if not self.sparse:
+                    w = sp.csr_matrix(w)
+                data, scale = self.quantize_weights(w)
+                indices, indptr = w.indices, w.indptr
+            arrays['w_data'] = data
+            arrays['w_indices'] = indices
+            arrays['w_indptr'] = indptr
+            if scale is not None:
+                arrays['w_scale'] = scale
+
+        if keys.intersection(INLINK_ARRAYS):
+            arrays.update(self.__get_saved_inlink_arrays())
+
+        arrays['sizeinformation'] = [self.NoN, self.NoE, self.NoNS]
+        for key in NODE_ARRAYS[1:]:
+            arrays[key] = getattr(self, key)
+
+        arrays['a'] = self.a.get_value(borrow=True)
+        arrays['g_theta'] = self.g_theta.get_value(borrow=True)
+        arrays['g_factor'] = self.g_factor.get_value(borrow=True)
+        arrays['g_threshold'] = self.g_threshold.get_value(borrow=True)
+        arrays['g_amplification'] = self.g_amplification.get_value(borrow=True)
+        arrays['g_min'] = self.g_min.get_value(borrow=True)
+        arrays['g_max'] = self.g_max.get_value(borrow=True)
+        arrays['g_function_selector'] = self.g_function_selector.get_value(borrow=True)
+        arrays['g_expect'] = self.g_expect.get_value(borrow=True)
+        arrays['g_countdown'] = self.g_countdown.get_value(borrow=True)
+        arrays['g_wait'] = self.g_wait.get_value(borrow=True)
+        arrays['n_function_selector'] = self.n_function_selector.get_value(borrow=True)
+
+        return dict((key, value) for key, value in arrays.items() if key in keys)
+
+    def quantize_weights(self, w):
+        """
+        Returns the data of the given weight matrix (CSR or dense) in the partition's weight_storage precision,
+        and for int8 storage the scale of each row (None otherwise). The weights of row i are data * scale[i].
+        """
+        data = w.data if sp.issparse(w) else np.asarray(w)
+        if self.weight_storage == 'float16':
+            return data.astype(np.float16), None
+        if self.weight_storage == 'int8':
+            if sp.issparse(w):
+                rows = np.repeat(np.arange(w.shape[0]), np.diff(w.indptr))
+                maxima = np.zeros(w.shape[0], dtype=self.nodenet.numpyfloatX)
+                np.maximum.at(maxima, rows, np.abs(data))
+            else:
+                rows = (slice(None), None)
+                maxima = np.abs(data).max(axis=1) if data.shape[1] else np.zeros(data.shape[0], dtype=self.nodenet.numpyfloatX)
+            scale = (maxima / 127).astype(self.nodenet.numpyfloatX)
+            scale[scale == 0] = 1
+            return np.rint(data / scale[rows]).astype(np.int8), scale
+        return data, None
+
+    def dequantize_weights(self, data, scale, indptr=None):
+        """
+        Returns the floatX weights for data and scale as returned by quantize_weights. For CSR data,
+        indptr is the row pointer array of the matrix.
+        """
+        if scale is None:
+            return data.astype(T.config.floatX)
+        if indptr is not None:
+            return data.astype(T.config.floatX) * scale[np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))]
+        return data.astype(T.config.floatX) * scale[:, None]
+
+    def compact_weights(self):
+        """
+        With float16 or int8 weight_storage, replaces the floatX weights by their data in that precision, from
+        which w is expanded again when it is next accessed. Only weights that have changed are converted.
+        Called by the nodenet after every step, so the floatX weights only take up memory during the step.
+        Partitions with por-link decay keep their floatX weights.
+        """
+        if self.weight_storage == 'full' or not self.__w_expanded:
+            return
+        if any(self.nodenet.get_partition(uid) is self for uid in self.nodenet.por_link_decay_nodespaces):
+            # por-link decay changes weights by less than the stored precision, which would round them back
+            return
+        self.flush_link_updates()
+        w_matrix = self.__w.get_value(borrow=True)
+        if self.__w_compact is None:
+            data, scale = self.quantize_weights(w_matrix)
+            if self.sparse:
+                self.__w_compact = (data, scale, w_matrix.indices, w_matrix.indptr)
+            else:
+                self.__w_compact = (data, scale, None, None)
+        if self.sparse:
+            self.__w.set_value(sp.csr_matrix((self.NoE, self.NoE), dtype=self.nodenet.scipyfloatX), borrow=True)
+        else:
+            self.__w.set_value(np.zeros((0, 0), dtype=T.config.floatX), borrow=True)
+        self.__w_expanded = False
 
+    def __expand_weights(self):
+        data, scale, indices, indptr = self.__w_compact
+        if self.sparse:
+            w_matrix = sp.csr_matrix((self.dequantize_weights(data, scale, indptr), indices, indptr), shape=(self.NoE, self.NoE))
+        else:
+            w_matrix = self.dequantize_weights(data, scale)
+        self.__w.set_value(w_matrix, borrow=True)
+        self.__w_expanded = True
+
+    def get_weight_storage_report(self):
+        """
+        Returns a dict comparing the weights the partition keeps in memory between steps with weights kept in floatX:
+        the weight_storage, the number of links, the bytes of the kept and of floatX weight data, the largest
+        absolute difference of a kept weight to its floatX value (non-zero only for weights that have changed
+        since the last step), and whether w is currently expanded to floatX
+        """
+        if self.__w_compact is not None:
+            data, scale, indices, indptr = self.__w_compact
+            max_error = 0.
+        else:
+            w = self.w.get_value(borrow=True)
+            values = w.data if self.sparse else np.asarray(w)
+            data, scale = self.quantize_weights(w)
+            stored = self.dequantize_weights(data, scale, w.indptr if self.sparse else None)
+            max_error = float(np.max(np.abs(stored - values))) if values.size else 0.
+        return {
+            'weight_storage': self.weight_storage,
+            'links': len(data) if self.sparse else int(np.count_nonzero(data)),
+            'bytes': data.nbytes + (scale.nbytes if scale is not None else 0),
+            'full_bytes': data.size * np.dtype(T.config.floatX).itemsize,
+            'max_error': max_error,
+            'expanded': self.__w_expanded
+        }
+
+    def __get_saved_inlink_arrays(self):
         inlink_from_element_count = 0
         inlink_to_element_count = 0
-        weight_count = 0
+        inlink_entries = {}
         for spid, inlinks in self.inlinks.items():
             inlink_from_element_count += len(inlinks[0].get_value(borrow=True))
             inlink_to_element_count += len(inlinks[1].get_value(borrow=True))
-            weight_count += len(inlinks[0].get_value(borrow=True)) * len(inlinks[1].get_value(borrow=True))
+            inlink_entries[spid] = self.get_inlink_entries(spid)
+        weight_count = sum(len(entries[2]) for entries in inlink_entries.values())
         inlinks_pids = np.zeros(len(self.inlinks), dtype=np.int16)
         inlink_from_lengths = np.zeros(len(self.inlinks), dtype=np.int32)
         inlink_to_lengths = np.zeros(len(self.inlinks), dtype=np.int32)
+        inlink_weight_lengths = np.zeros(len(self.inlinks), dtype=np.int32)
         inlink_from_elements = np.zeros(inlink_from_element_count, dtype=np.int32)
         inlink_to_elements = np.zeros(inlink_to_element_count, dtype=np.int32)
-        inlink_weights = np.zeros(weight_count, dtype=self.nodenet.numpyfloatX)
+        inlink_weight_rows = np.zeros(weight_count, dtype=np.int32)
+        inlink_weight_cols = np.zeros(weight_count, dtype=np.int32)
+        inlink_weight_data = np.zeros(weight_count, dtype=self.nodenet.numpyfloatX)
 
         from_offset = 0
         to_offset = 0
@@ -752,71 +1446,61 @@ class TheanoPartition():
             inlinks_pids[i] = int(spid)
             from_elements = self.inlinks[spid][0].get_value(borrow=True)
             to_elements = self.inlinks[spid][1].get_value(borrow=True)
-            weights = self.inlinks[spid][2].get_value(borrow=True)
+            rows, cols, weights = inlink_entries[spid]
             from_length = len(from_elements)
             to_length = len(to_elements)
+            weight_length = len(weights)
             inlink_from_lengths[i] = from_length
             inlink_to_lengths[i] = to_length
+            inlink_weight_lengths[i] = weight_length
             inlink_from_elements[from_offset:from_offset+from_length] = from_elements
             inlink_to_elements[to_offset:to_offset+to_length] = to_elements
-            inlink_weights[weight_offset:weight_offset+(from_length*to_length)] = np.ravel(weights)
-            weight_offset += from_length * to_length
+            inlink_weight_rows[weight_offset:weight_offset+weight_length] = rows
+            inlink_weight_cols[weight_offset:weight_offset+weight_length] = cols
+            inlink_weight_data[weight_offset:weight_offset+weight_length] = weights
+            weight_offset += weight_length
             from_offset += from_length
             to_offset += to_length
 
-        np.savez(datafilename,
-                 allocated_nodes=allocated_nodes,
-                 allocated_node_offsets=allocated_node_offsets,
-                 allocated_elements_to_nodes=allocated_elements_to_nodes,
-                 allocated_node_parents=allocated_node_parents,
-                 allocated_nodespaces=allocated_nodespaces,
-                 w_data=w.data,
-                 w_indices=w.indices,
-                 w_indptr=w.indptr,
-                 a=a,
-                 g_theta=g_theta,
-                 g_factor=g_factor,
-                 g_threshold=g_threshold,
-                 g_amplification=g_amplification,
-                 g_min=g_min,
-                 g_max=g_max,
-                 g_function_selector=g_function_selector,
-                 g_expect=g_expect,
-                 g_countdown=g_countdown,
-                 g_wait=g_wait,
-                 n_function_selector=n_function_selector,
-                 sizeinformation=sizeinformation,
-                 allocated_elements_to_activators=allocated_elements_to_activators,
-                 allocated_nodespaces_por_activators=allocated_nodespaces_por_activators,
-                 allocated_nodespaces_ret_activators=allocated_nodespaces_ret_activators,
-                 allocated_nodespaces_sub_activators=allocated_nodespaces_sub_activators,
-                 allocated_nodespaces_sur_activators=allocated_nodespaces_sur_activators,
-                 allocated_nodespaces_cat_activators=allocated_nodespaces_cat_activators,
-                 allocated_nodespaces_exp_activators=allocated_nodespaces_exp_activators,
-                 allocated_nodespaces_sampling_activators=allocated_nodespaces_sampling_activators,
-                 inlink_pids=inlinks_pids,
-                 inlink_from_lengths=inlink_from_lengths,
-                 inlink_to_lengths=inlink_to_lengths,
-                 inlink_from_elements=inlink_from_elements,
-                 inlink_to_elements=inlink_to_elements,
-                 inlink_weights=inlink_weights)
-
-    def load_data(self, datafilename, nodes_data):
-        """Load the node net from a file"""
-        # try to access file
-
+        return dict(inlink_pids=inlinks_pids,
+                    inlink_from_lengths=inlink_from_lengths,
+                    inlink_to_lengths=inlink_to_lengths,
+                    inlink_weight_lengths=inlink_weight_lengths,
+                    inlink_from_elements=inlink_from_elements,
+                    inlink_to_elements=inlink_to_elements,
+                    inlink_weight_rows=inlink_weight_rows,
+                    inlink_weight_cols=inlink_weight_cols,
+                    inlink_weight_data=inlink_weight_data)
+
+    def __open_datafile(self, datafilename):
+        """ Returns the data stored at datafilename, an .npz file or a directory of .npy files, or None """
+        if os.path.isdir(datafilename):
+            return NpyDirectory(datafilename)
         datafile = None
         if os.path.isfile(datafilename):
             try:
-                self.logger.info("Loading nodenet %s partition %i bulk data from file %s" % (self.nodenet.name, self.pid, datafilename))
                 datafile = np.load(datafilename)
             except ValueError:  # pragma: no cover
-                self.logger.warn("Could not read nodenet data from file %s" % datafile)
-                return False
+                self.logger.warn("Could not read nodenet data from file %s" % datafilename)
             except IOError:  # pragma: no cover
-                self.logger.warn("Could not open nodenet file %s" % datafile)
-                return False
+                self.logger.warn("Could not open nodenet file %s" % datafilename)
+        return datafile
+
+    def __borrowable(self, array, dtype=None):
+        """ Returns a loaded array as an ndarray of the given dtype (floatX by default), without copying if possible """
+        if dtype is None:
+            dtype = T.config.floatX
+        if array.dtype == dtype:
+            return np.asarray(array)
+        return array.astype(dtype)
 
+    def load_data(self, datafilename, nodes_data):
+        """Load the node net from a file"""
+        self.__invalidate_element_indices()
+        # try to access file
+
+        self.logger.info("Loading nodenet %s partition %i bulk data from %s" % (self.nodenet.name, self.pid, datafilename))
+        datafile = self.__open_datafile(datafilename)
         if not datafile:
             return
 
@@ -829,6 +1513,7 @@ class TheanoPartition():
             self.nodes_last_changed = np.zeros(self.NoN, dtype=np.int32) - 1
             self.nodespaces_last_changed = np.zeros(self.NoNS, dtype=np.int32) - 1
             self.nodespaces_contents_last_changed = np.zeros(self.NoNS, dtype=np.int32) - 1
+            self.clear_change_journal()
 
             a_prev_array = np.zeros(self.NoE, dtype=self.nodenet.numpyfloatX)
             self.a_prev = theano.shared(value=a_prev_array.astype(T.config.floatX), name="a_prev", borrow=True)
@@ -903,77 +1588,100 @@ class TheanoPartition():
             self.logger.warn("no allocated_nodespaces_por_activators in file, falling back to defaults")  # pragma: no cover
 
         if 'w_data' in datafile and 'w_indices' in datafile and 'w_indptr' in datafile:
-            w = sp.csr_matrix((datafile['w_data'], datafile['w_indices'], datafile['w_indptr']), shape = (self.NoE, self.NoE))
-            # if we're configured to be dense, convert from csr
-            if not self.sparse:
-                w = w.todense()
-            self.w = theano.shared(value=w.astype(T.config.floatX), name="w", borrow=False)
-            self.a = theano.shared(value=datafile['a'].astype(T.config.floatX), name="a", borrow=False)
-            self.a_in = theano.shared(value=np.zeros_like(datafile['a']).astype(T.config.floatX), name="a_in", borrow=False)
+            self.discard_link_updates()
+            w_data = datafile['w_data']
+            w_indices = datafile['w_indices']
+            w_indptr = datafile['w_indptr']
+            w_scale = None
+            # the stored dtype tells how the weights have been stored
+            if w_data.dtype == np.int8:
+                self.weight_storage = 'int8'
+                w_scale = datafile['w_scale']
+            elif w_data.dtype == np.float16:
+                self.weight_storage = 'float16'
+            else:
+                self.weight_storage = 'full'
+            if self.weight_storage != 'full' and self.sparse:
+                # keep the weights as stored, w is expanded to floatX when it is first accessed
+                self.w = theano.shared(value=sp.csr_matrix((self.NoE, self.NoE), dtype=self.nodenet.scipyfloatX), name="w", borrow=True)
+                self.__w_compact = (w_data, w_scale, w_indices, w_indptr)
+                self.__w_expanded = False
+            else:
+                w = sp.csr_matrix((self.dequantize_weights(w_data, w_scale, w_indptr), w_indices, w_indptr), shape=(self.NoE, self.NoE))
+                # if we're configured to be dense, convert from csr
+                if not self.sparse:
+                    w = w.todense()
+                self.w = theano.shared(value=w.astype(T.config.floatX), name="w", borrow=False)
+            self.a = theano.shared(value=self.__borrowable(datafile['a']), name="a", borrow=True)
+            self.a_in = theano.shared(value=np.zeros(self.NoE, dtype=T.config.floatX), name="a_in", borrow=True)
         else:
             self.logger.warn("no w_data, w_indices or w_indptr in file, falling back to defaults")  # pragma: no cover
 
         if 'g_theta' in datafile:
-            self.g_theta = theano.shared(value=datafile['g_theta'].astype(T.config.floatX), name="theta", borrow=False)
+            self.g_theta = theano.shared(value=self.__borrowable(datafile['g_theta']), name="theta", borrow=True)
+            self.__g_theta_shifted_dirty = True
         else:
             self.logger.warn("no g_theta in file, falling back to defaults")  # pragma: no cover
 
         if 'g_factor' in datafile:
-            self.g_factor = theano.shared(value=datafile['g_factor'].astype(T.config.floatX), name="g_factor", borrow=False)
+            self.g_factor = theano.shared(value=self.__borrowable(datafile['g_factor']), name="g_factor", borrow=True)
         else:
             self.logger.warn("no g_factor in file, falling back to defaults")  # pragma: no cover
 
         if 'g_threshold' in datafile:
-            self.g_threshold = theano.shared(value=datafile['g_threshold'].astype(T.config.floatX), name="g_threshold", borrow=False)
+            self.g_threshold = theano.shared(value=self.__borrowable(datafile['g_threshold']), name="g_threshold", borrow=True)
         else:
             self.logger.warn("no g_threshold in file, falling back to defaults")  # pragma: no cover
 
         if 'g_amplification' in datafile:
-            self.g_amplification = theano.shared(value=datafile['g_amplification'].astype(T.config.floatX), name="g_amplification", borrow=False)
+            self.g_amplification = theano.shared(value=self.__borrowable(datafile['g_amplification']), name="g_amplification", borrow=True)
         else:
             self.logger.warn("no g_amplification in file, falling back to defaults")  # pragma: no cover
 
         if 'g_min' in datafile:
-            self.g_min = theano.shared(value=datafile['g_min'].astype(T.config.floatX), name="g_min", borrow=False)
+            self.g_min = theano.shared(value=self.__borrowable(datafile['g_min']), name="g_min", borrow=True)
         else:
             self.logger.warn("no g_min in file, falling back to defaults")  # pragma: no cover
 
         if 'g_max' in datafile:
-            self.g_max = theano.shared(value=datafile['g_max'].astype(T.config.floatX), name="g_max", borrow=False)
+            self.g_max = theano.shared(value=self.__borrowable(datafile['g_max']), name="g_max", borrow=True)
         else:
             self.logger.warn("no g_max in file, falling back to defaults")  # pragma: no cover
 
         if 'g_function_selector' in datafile:
-            self.g_function_selector = theano.shared(value=datafile['g_function_selector'], name="gatefunction", borrow=False)
+            self.g_function_selector = theano.shared(value=np.asarray(datafile['g_function_selector']), name="gatefunction", borrow=True)
         else:
             self.logger.warn("no g_function_selector in file, falling back to defaults")  # pragma: no cover
 
         if 'g_expect' in datafile:
-            self.g_expect = theano.shared(value=datafile['g_expect'], name="expectation", borrow=False)
+            self.g_expect = theano.shared(value=np.asarray(datafile['g_expect']), name="expectation", borrow=True)
         else:
             self.logger.warn("no g_expect in file, falling back to defaults")  # pragma: no cover
 
         if 'g_countdown' in datafile:
-            self.g_countdown = theano.shared(value=datafile['g_countdown'], name="countdown", borrow=False)
+            self.g_countdown = theano.shared(value=np.asarray(datafile['g_countdown']), name="countdown", borrow=True)
         else:
             self.logger.warn("no g_countdown in file, falling back to defaults")  # pragma: no cover
 
         if 'g_wait' in datafile:
-            self.g_wait = theano.shared(value=datafile['g_wait'], name="wait", borrow=False)
+            self.g_wait = theano.shared(value=np.asarray(datafile['g_wait']), name="wait", borrow=True)
         else:
             self.logger.warn("no g_wait in file, falling back to defaults")  # pragma: no cover
 
         if 'n_function_selector' in datafile:
-            self.n_function_selector = theano.shared(value=datafile['n_function_selector'], name="nodefunction_per_gate", borrow=False)
+            self.n_function_selector = theano.shared(value=np.asarray(datafile['n_function_selector']), name="nodefunction_per_gate", borrow=True)
         else:
             self.logger.warn("no n_function_selector in file, falling back to defaults")  # pragma: no cover
 
         # reconstruct other states
         self.por_ret_dirty = True
+        self.rebuild_free_lists()
+
+        # the shared variables have been replaced, so the compiled functions need to be bound to them again
+        self.has_new_usages = True
 
         if 'g_function_selector' in datafile:
             g_function_selector = datafile['g_function_selector']
-            self.has_new_usages = True
             self.has_pipes = PIPE in self.allocated_nodes
             self.has_lstms = LSTM in self.allocated_nodes
             self.has_directional_activators = \
@@ -1023,28 +1731,71 @@ class TheanoPartition():
         if self.has_directional_activators or self.__has_sampling_activators:
             self.__calculate_g_factors()
 
-    def load_inlinks(self, datafilename):
-        datafile = None
-        if os.path.isfile(datafilename):
-            try:
-                datafile = np.load(datafilename)
-            except ValueError:  # pragma: no cover
-                self.logger.warn("Could not read nodenet data from file %s" % datafile)
-                return False
-            except IOError:  # pragma: no cover
-                self.logger.warn("Could not open nodenet file %s" % datafile)
-                return False
+        # what we have just loaded is what the next save to this directory can build on
+        if isinstance(datafile, NpyDirectory) and datafile.manifest is not None:
+            self.__checkpoint_path = datafilename
+            self.__checkpoint_manifest = datafile.manifest
+            self.__checkpoint_deltas = datafile.manifest['deltas']
+        else:
+            self.__checkpoint_path = None
+            self.__checkpoint_manifest = None
+        self.__checkpoint_step = self.nodenet.current_step
+        self.dirty_arrays = set(INLINK_ARRAYS)
 
+    def load_inlinks(self, datafilename):
+        datafile = self.__open_datafile(datafilename)
         if not datafile:
             return
 
+        # the inlinks set up here are the ones in the file
+        dirty_arrays = set(self.dirty_arrays)
+
         if 'inlink_pids' in datafile and \
+            'inlink_from_lengths' in datafile and \
+            'inlink_to_lengths' in datafile and \
+            'inlink_weight_lengths' in datafile and \
+            'inlink_from_elements' in datafile and \
+            'inlink_to_elements' in datafile and \
+            'inlink_weight_rows' in datafile and \
+            'inlink_weight_cols' in datafile and \
+            'inlink_weight_data' in datafile:
+
+            inlink_pids = datafile['inlink_pids']
+            inlink_from_lengths = datafile['inlink_from_lengths']
+            inlink_to_lengths = datafile['inlink_to_lengths']
+            inlink_weight_lengths = datafile['inlink_weight_lengths']
+
+            inlink_from_offset = 0
+            inlink_to_offset = 0
+            weight_offset = 0
+
+            for i, pid in enumerate(inlink_pids):
+
+                inlink_from_elements = datafile['inlink_from_elements'][inlink_from_offset:inlink_from_offset+inlink_from_lengths[i]]
+                inlink_to_elements = datafile['inlink_to_elements'][inlink_to_offset:inlink_to_offset+inlink_to_lengths[i]]
+                weight_slice = slice(weight_offset, weight_offset+inlink_weight_lengths[i])
+
+                self.set_inlink_entries(
+                    "%03i" % pid,
+                    inlink_from_elements,
+                    inlink_to_elements,
+                    datafile['inlink_weight_rows'][weight_slice],
+                    datafile['inlink_weight_cols'][weight_slice],
+                    datafile['inlink_weight_data'][weight_slice].astype(T.config.floatX)
+                )
+
+                weight_offset += inlink_weight_lengths[i]
+                inlink_from_offset += inlink_from_lengths[i]
+                inlink_to_offset += inlink_to_lengths[i]
+
+        elif 'inlink_pids' in datafile and \
             'inlink_from_lengths' in datafile and \
             'inlink_to_lengths' in datafile and \
             'inlink_from_elements' in datafile and \
             'inlink_to_elements' in datafile and \
             'inlink_weights' in datafile:
 
+            # files written before inlinks could be sparse contain the dense weight matrices
             inlink_pids = datafile['inlink_pids']
             inlink_from_lengths = datafile['inlink_from_lengths']
             inlink_to_lengths = datafile['inlink_to_lengths']
@@ -1072,8 +1823,12 @@ class TheanoPartition():
         else:
             self.logger.warn("no or incomplete inlink information in file, no inter-partition links will be loaded")  # pragma: no cover
 
+        self.dirty_arrays = dirty_arrays.difference(INLINK_ARRAYS)
+
     def grow_number_of_nodespaces(self, growby):
 
+        self.mark_dirty(*NODE_ARRAYS)
+
         new_NoNS = int(self.NoNS + growby)
 
         new_allocated_nodespaces = np.zeros(new_NoNS, dtype=np.int32)
@@ -1121,6 +1876,9 @@ class TheanoPartition():
 
     def grow_number_of_elements(self, growby):
 
+        self.__invalidate_element_indices()
+        self.mark_dirty()
+
         new_NoE = int(self.NoE + growby)
 
         new_allocated_elements_to_nodes = np.zeros(new_NoE, dtype=np.int32)
@@ -1206,6 +1964,8 @@ class TheanoPartition():
         new_n_node_retlinked = np.zeros(new_NoE, dtype=np.int8)
         self.n_node_retlinked.set_value(new_n_node_retlinked, borrow=True)
 
+        self.free_element_ranges.setdefault(new_NoE - self.NoE, []).append(self.NoE)
+
         self.NoE = new_NoE
         self.has_new_usages = True
 
@@ -1232,63 +1992,24 @@ class TheanoPartition():
 
     def create_node(self, nodetype, nodespace_id, id=None, parameters=None, gate_parameters=None, gate_functions=None):
 
-        # find a free ID / index in the allocated_nodes vector to hold the node type
-        if id is None:
-            id = 0
-            for i in range((self.last_allocated_node + 1), self.NoN):
-                if self.allocated_nodes[i] == 0:
-                    id = i
-                    break
-
-            if id < 1:
-                for i in range(self.last_allocated_node - 1):
-                    if self.allocated_nodes[i] == 0:
-                        id = i
-                        break
-
-            if id < 1:
-                growby = self.NoN // 2
-                self.logger.info("All %d node IDs in partition %i in use, growing id vectors by %d elements" % (self.NoN, self.pid, growby))
-                id = self.NoN
-                self.grow_number_of_nodes(growby)
+        self.__invalidate_element_indices()
+        self.mark_dirty(*(NODE_ARRAYS + GATE_ARRAYS + STATE_ARRAYS))
 
+        # take a free ID / index in the allocated_nodes vector to hold the node type
+        if id is None:
+            id = self.allocate_node_id()
         else:
             if id > self.NoN:
                 growby = id - (self.NoN - 2)
                 self.logger.info("Requested ID larger than current size in partition %i, growing id vectors by %d elements" % (self.pid, growby))
                 self.grow_number_of_nodes(growby)
 
-        # now find a range of free elements to be used by this node
+        # now take a range of free elements to be used by this node
         number_of_elements = get_elements_per_type(get_numerical_node_type(nodetype, self.nodenet.native_modules), self.nodenet.native_modules)
-        has_restarted_from_zero = False
-        offset = 0
-        i = self.last_allocated_offset + 1
-        while offset < 1:
-            freecount = 0
-            for j in range(0, number_of_elements):
-                if i+j < len(self.allocated_elements_to_nodes) and self.allocated_elements_to_nodes[i+j] == 0:
-                    freecount += 1
-                else:
-                    break
-            if freecount >= number_of_elements:
-                offset = i
-                break
-            else:
-                i += freecount+1
-
-            if i >= self.NoE:
-                if not has_restarted_from_zero:
-                    i = 0
-                    has_restarted_from_zero = True
-                else:
-                    growby = max(number_of_elements +1, self.NoE // 2)
-                    self.logger.info("All %d elements in use in partition %i, growing elements vectors by %d elements" % (self.NoE, self.pid, growby))
-                    offset = self.NoE
-                    self.grow_number_of_elements(growby)
+        offset = self.allocate_elements(number_of_elements)
 
         uid = node_to_id(id, self.pid)
 
-        self.last_allocated_node = id
         self.last_allocated_offset = offset
         self.allocated_nodes[id] = get_numerical_node_type(nodetype, self.nodenet.native_modules)
         self.nodes_last_changed[id] = self.nodenet.current_step
@@ -1297,9 +2018,9 @@ class TheanoPartition():
         if nodespace_id < len(self.nodespaces_contents_last_changed):
             # due to the order of initializing, nodespaces might just not be here yet.
             self.nodespaces_contents_last_changed[nodespace_id] = self.nodenet.current_step
+        self.journal_changes(CHANGED_NODE, [id], [nodespace_id])
 
-        for element in range (0, get_elements_per_type(self.allocated_nodes[id], self.nodenet.native_modules)):
-            self.allocated_elements_to_nodes[offset + element] = id
+        self.allocated_elements_to_nodes[offset:offset + number_of_elements] = id
 
         if parameters is None:
             parameters = {}
@@ -1402,14 +2123,81 @@ class TheanoPartition():
 
         # initialize activation to zero
         a_array = self.a.get_value(borrow=True)
-        for element in range (0, get_elements_per_type(get_numerical_node_type(nodetype, self.nodenet.native_modules), self.nodenet.native_modules)):
-            a_array[offset + element] = 0
-        self.a.set_value(a_array)
+        a_array[offset:offset + number_of_elements] = 0
+        self.a.set_value(a_array, borrow=True)
 
         return id
 
+    def allocate_node_id(self):
+        """ Pops a free node ID from the free ID stack, growing the ID vectors if there is none left """
+        while self.free_node_ids:
+            id = self.free_node_ids.pop()
+            # IDs requested explicitly in create_node are not removed from the stack, skip them here
+            if id < self.NoN and self.allocated_nodes[id] == 0:
+                return id
+
+        growby = self.NoN // 2 or 1
+        self.logger.info("All %d node IDs in partition %i in use, growing id vectors by %d elements" % (self.NoN, self.pid, growby))
+        self.grow_number_of_nodes(growby)
+        return self.free_node_ids.pop()
+
+    def allocate_elements(self, number_of_elements):
+        """ Returns the offset of a free range of number_of_elements elements, growing the element vectors if needed """
+        if number_of_elements == 0:
+            # nodes without elements (comments) don't claim anything
+            return self.last_allocated_offset + 1
+
+        offset = self.__pop_free_element_range(number_of_elements)
+        if offset is None:
+            # ranges freed by delete_node are not merged with their neighbours, so defragment before growing
+            self.rebuild_free_lists()
+            offset = self.__pop_free_element_range(number_of_elements)
+        if offset is None:
+            growby = max(number_of_elements + 1, self.NoE // 2)
+            self.logger.info("All %d elements in use in partition %i, growing elements vectors by %d elements" % (self.NoE, self.pid, growby))
+            self.grow_number_of_elements(growby)
+            offset = self.__pop_free_element_range(number_of_elements)
+        return offset
+
+    def __pop_free_element_range(self, number_of_elements):
+        # take an exact fit if there is one, otherwise split the smallest free range that is large enough
+        if number_of_elements in self.free_element_ranges:
+            size = number_of_elements
+        else:
+            larger_sizes = [size for size in self.free_element_ranges if size > number_of_elements]
+            if not larger_sizes:
+                return None
+            size = min(larger_sizes)
+
+        offsets = self.free_element_ranges[size]
+        offset = offsets.pop()
+        if not offsets:
+            del self.free_element_ranges[size]
+        if size > number_of_elements:
+            self.free_element_ranges.setdefault(size - number_of_elements, []).append(offset + number_of_elements)
+        return offset
+
+    def rebuild_free_lists(self):
+        """ Rebuilds the free node ID stack and the free element ranges from the allocation vectors """
+        # node ID 0 is reserved, free IDs are handed out lowest first
+        free_ids = np.where(self.allocated_nodes == 0)[0]
+        self.free_node_ids = free_ids[free_ids > 0][::-1].tolist()
+
+        # element 0 is reserved, too. find the runs of free elements and bucket them by length
+        free_elements = (self.allocated_elements_to_nodes == 0).astype(np.int8)
+        free_elements[0] = 0
+        edges = np.diff(np.concatenate(([0], free_elements, [0])))
+        starts = np.where(edges == 1)[0]
+        sizes = np.where(edges == -1)[0] - starts
+        self.free_element_ranges = {}
+        for start, size in zip(starts[::-1].tolist(), sizes[::-1].tolist()):
+            self.free_element_ranges.setdefault(size, []).append(start)
+
     def delete_node(self, node_id):
 
+        self.__invalidate_element_indices()
+        self.mark_dirty(*(NODE_ARRAYS + GATE_ARRAYS + STATE_ARRAYS))
+
         type = self.allocated_nodes[node_id]
         offset = self.allocated_node_offsets[node_id]
         parent = self.allocated_node_parents[node_id]
@@ -1419,15 +2207,19 @@ class TheanoPartition():
         self.nodespaces_contents_last_changed[self.allocated_node_parents[node_id]] = self.nodenet.current_step
 
         # forget
+        number_of_elements = get_elements_per_type(type, self.nodenet.native_modules)
         self.allocated_nodes[node_id] = 0
         self.allocated_node_offsets[node_id] = 0
         self.allocated_node_parents[node_id] = 0
         g_function_selector_array = self.g_function_selector.get_value(borrow=True)
-        for element in range (0, get_elements_per_type(type, self.nodenet.native_modules)):
-            self.allocated_elements_to_nodes[offset + element] = 0
-            g_function_selector_array[offset + element] = 0
+        self.allocated_elements_to_nodes[offset:offset + number_of_elements] = 0
+        g_function_selector_array[offset:offset + number_of_elements] = 0
         self.g_function_selector.set_value(g_function_selector_array, borrow=True)
-        self.allocated_elements_to_nodes[np.where(self.allocated_elements_to_nodes == node_id)[0]] = 0
+
+        # hand the ID and the elements back to the allocator
+        self.free_node_ids.append(node_id)
+        if number_of_elements > 0:
+            self.free_element_ranges.setdefault(number_of_elements, []).append(offset)
 
         if type == SENSOR:
             sensor_index = np.where(self.sensor_indices == node_id)[0]
@@ -1457,9 +2249,6 @@ class TheanoPartition():
             n_function_selector_array[offset + GFG] = NFPG_PIPE_NON
             self.n_function_selector.set_value(n_function_selector_array, borrow=True)
 
-        # hint at the free ID
-        self.last_allocated_node = node_id - 1
-
         # remove the native module or comment instance if there should be one
         uid = node_to_id(node_id, self.pid)
         if uid in self.native_module_instances:
@@ -1468,8 +2257,8 @@ class TheanoPartition():
             del self.comment_instances[uid]
 
         # clear activator usage if there should be one
-        used_as_activator_by = np.where(self.allocated_elements_to_activators == offset)
-        if len(used_as_activator_by) > 0:
+        if type == ACTIVATOR:
+            used_as_activator_by = np.where(self.allocated_elements_to_activators == offset)
             self.allocated_elements_to_activators[used_as_activator_by] = 0
 
         if self.allocated_nodespaces_por_activators[parent] == node_id:
@@ -1488,30 +2277,79 @@ class TheanoPartition():
             self.allocated_nodespaces_sampling_activators[parent] = 0
 
     def node_changed(self, uid):
-        node_id = node_from_id(uid)
-        self.nodes_last_changed[node_id] = self.nodenet.current_step
-        self.nodespaces_contents_last_changed[self.allocated_node_parents[node_id]] = self.nodenet.current_step
+        self.nodes_changed([node_from_id(uid)])
+
+    def nodes_changed(self, node_ids):
+        """ Records that the given nodes have changed in the current step """
+        node_ids = np.asarray(node_ids, dtype=np.int32)
+        parents = self.allocated_node_parents[node_ids]
+        self.nodes_last_changed[node_ids] = self.nodenet.current_step
+        self.nodespaces_contents_last_changed[parents] = self.nodenet.current_step
+        self.journal_changes(CHANGED_NODE, node_ids, parents)
+
+    def journal_changes(self, kind, ids, nodespace_ids):
+        """ Appends changes of the given kind of the nodes or nodespaces with the given ids and parents to the change journal """
+        count = len(ids)
+        if count == 0:
+            return
+        size = self.change_journal_size
+        if count >= size:
+            # the changes overwrite the whole journal, including some of themselves
+            self.__change_journal_lost_step = self.nodenet.current_step
+            ids, nodespace_ids = ids[-size:], nodespace_ids[-size:]
+            count = size
+        elif self.__change_journal_length + count > size:
+            # remember the step of the latest entry that will be overwritten
+            lost = (self.__change_journal_length + count - size - 1) % size
+            self.__change_journal_lost_step = self.change_journal_steps[lost]
+        positions = (self.__change_journal_length + np.arange(count)) % size
+        self.change_journal_steps[positions] = self.nodenet.current_step
+        self.change_journal_ids[positions] = ids
+        self.change_journal_nodespaces[positions] = nodespace_ids
+        self.change_journal_kinds[positions] = kind
+        self.__change_journal_length += count
+
+    def clear_change_journal(self):
+        """ Empties the change journal, and allocates it with change_journal_size entries """
+        self.change_journal_steps = np.zeros(self.change_journal_size, dtype=np.int32)
+        self.change_journal_ids = np.zeros(self.change_journal_size, dtype=np.int32)
+        self.change_journal_nodespaces = np.zeros(self.change_journal_size, dtype=np.int32)
+        self.change_journal_kinds = np.zeros(self.change_journal_size, dtype=np.int8)
+        # number of entries ever written to the change journal
+        self.__change_journal_length = 0
+        # the step of the latest change that has been overwritten: changes since later steps are all in the journal
+        self.__change_journal_lost_step = -1
+
+    def __get_journal_changes(self, since_step):
+        """ Returns the ids, parent nodespace ids and kinds of the changes since the given step, from the change journal """
+        size = self.change_journal_size
+        first = max(0, self.__change_journal_length - size)
+        end = self.__change_journal_length
+        # the steps of the entries increase in the order they were written
+        while first < end:
+            middle = (first + end) // 2
+            if self.change_journal_steps[middle % size] < since_step:
+                first = middle + 1
+            else:
+                end = middle
+        positions = np.arange(first, self.__change_journal_length) % size
+        return self.change_journal_ids[positions], self.change_journal_nodespaces[positions], self.change_journal_kinds[positions]
 
     def unlink_node_completely(self, node_id):
+        connecting_elements, connected_elements = self.get_associated_elements(node_id)
         type = self.allocated_nodes[node_id]
         offset = self.allocated_node_offsets[node_id]
         w_matrix = self.w.get_value(borrow=True)
         number_of_elements = get_elements_per_type(type, self.nodenet.native_modules)
-        connecting_elements = np.nonzero(w_matrix[offset:offset+number_of_elements, :])[1]
-        connected_elements = np.nonzero(w_matrix[:, offset:offset+number_of_elements])[0]
         w_matrix[offset:offset+number_of_elements, connecting_elements] = 0
         w_matrix[connected_elements, offset:offset+number_of_elements] = 0
         self.w.set_value(w_matrix, borrow=True)
+        self.mark_dirty(*LINK_ARRAYS)
+        self.invalidate_w_columns()
         connecting_nodes = self.allocated_elements_to_nodes[connecting_elements]
         connected_nodes = self.allocated_elements_to_nodes[connected_elements]
-        # update all involved elements' changed-steps
-        self.nodes_last_changed[node_id] = self.nodenet.current_step
-        self.nodes_last_changed[connected_nodes] = self.nodenet.current_step
-        self.nodes_last_changed[connecting_nodes] = self.nodenet.current_step
-        # update all involved elements' parents' changed-steps
-        self.nodespaces_contents_last_changed[self.allocated_node_parents[node_id]] = self.nodenet.current_step
-        self.nodespaces_contents_last_changed[self.allocated_node_parents[connected_nodes]] = self.nodenet.current_step
-        self.nodespaces_contents_last_changed[self.allocated_node_parents[connecting_nodes]] = self.nodenet.current_step
+        # update all involved elements' and their parents' changed-steps
+        self.nodes_changed(np.unique(np.concatenate(([node_id], connected_nodes, connecting_nodes))))
 
     def get_associated_elements(self, node_id):
         type = self.allocated_nodes[node_id]
@@ -1519,9 +2357,91 @@ class TheanoPartition():
         w_matrix = self.w.get_value(borrow=True)
         number_of_elements = get_elements_per_type(type, self.nodenet.native_modules)
         connecting_elements = np.nonzero(w_matrix[offset:offset+number_of_elements, :])[1]
-        connected_elements = np.nonzero(w_matrix[:, offset:offset+number_of_elements])[0]
+        connected_elements = np.nonzero(self.get_w_columns()[:, offset:offset+number_of_elements])[0]
         return connecting_elements, connected_elements
 
+    def get_w_columns(self):
+        """
+        Returns w in a format suitable for column access: a CSC copy for sparse partitions, which is
+        only rebuilt after the links changed, or w itself for dense partitions.
+        """
+        w_matrix = self.w.get_value(borrow=True)
+        if not self.sparse:
+            return w_matrix
+        if self.__w_columns is None or self.__w_columns_source is not w_matrix:
+            self.__w_columns = w_matrix.tocsc()
+            self.__w_columns_source = w_matrix
+        return self.__w_columns
+
+    def invalidate_w_columns(self):
+        """ Has to be called after w has been modified in place """
+        self.__w_columns = None
+        self.__w_columns_source = None
+
+    def get_por_link_entries(self, nodespace_id):
+        """
+        Returns the positions of the positive por-links of the pipes in the given nodespace in w: indices into the
+        data array for sparse partitions, flat indices for dense ones.
+        Only searched again after links or nodes of the partition have changed.
+        """
+        w_matrix = self.w.get_value(borrow=True)
+        if nodespace_id in self.__por_link_entries:
+            entries, source = self.__por_link_entries[nodespace_id]
+            if source is w_matrix:
+                return entries
+        pipes = np.where((self.allocated_node_parents == nodespace_id) & (self.allocated_nodes == PIPE))[0]
+        por_columns = self.allocated_node_offsets[pipes] + POR
+        if self.sparse:
+            is_por_column = np.zeros(self.NoE, dtype=bool)
+            is_por_column[por_columns] = True
+            entries = np.where(is_por_column[w_matrix.indices] & (w_matrix.data > 0))[0]
+        else:
+            rows, columns = np.nonzero(w_matrix[:, por_columns] > 0)
+            entries = rows * self.NoE + por_columns[columns]
+        self.__por_link_entries[nodespace_id] = (entries, w_matrix)
+        return entries
+
+    def decay_por_links(self, nodespace_id, decay):
+        """ Multiplies the weights of the positive por-links of the pipes in the given nodespace with (1 - decay) """
+        entries = self.get_por_link_entries(nodespace_id)
+        if not len(entries):
+            return
+        w_matrix = self.w.get_value(borrow=True)
+        if self.sparse:
+            w_matrix.data[entries] *= (1 - decay)
+        else:
+            w_matrix.flat[entries] = w_matrix.flat[entries] * (1 - decay)
+        self.w.set_value(w_matrix, borrow=True)
+        self.invalidate_w_columns()
+        self.mark_dirty('w_data', 'w_scale')
+
+    def get_outgoing_elements(self, gate_element):
+        """ Returns the slot elements linked from the given gate element, in O(number of links) for sparse partitions """
+        w_columns = self.get_w_columns()
+        if self.sparse:
+            start, end = w_columns.indptr[gate_element], w_columns.indptr[gate_element + 1]
+            elements = w_columns.indices[start:end]
+            return elements[w_columns.data[start:end] != 0]
+        return np.nonzero(w_columns[:, gate_element])[0]
+
+    def get_linked_gate_flags(self, gate_elements):
+        """ Returns a boolean array telling for each of the given gate elements whether it has outgoing links, also to other partitions """
+        w_columns = self.get_w_columns()
+        if self.sparse:
+            linked = np.zeros(self.NoE, dtype=bool)
+            columns = np.repeat(np.arange(self.NoE), np.diff(w_columns.indptr))
+            linked[columns[w_columns.data != 0]] = True
+            flags = linked[gate_elements]
+        else:
+            flags = np.any(w_columns[:, gate_elements] != 0, axis=0)
+        for partition in self.nodenet.partitions.values():
+            if self.spid in partition.inlinks:
+                inlinks = partition.inlinks[self.spid]
+                from_elements = inlinks[0].get_value(borrow=True)
+                linked_columns = np.unique(np.nonzero(inlinks[2].get_value(borrow=True))[1])
+                flags = flags | np.in1d(gate_elements, from_elements[linked_columns])
+        return flags
+
     def get_associated_node_ids(self, node_id):
         connecting_elements, connected_elements = self.get_associated_elements(node_id)
         connecting_nodes = np.unique(self.allocated_elements_to_nodes[connecting_elements])
@@ -1552,8 +2472,10 @@ class TheanoPartition():
 
         self.last_allocated_nodespace = id
         self.allocated_nodespaces[id] = parent_id
+        self.mark_dirty(*NODE_ARRAYS)
         self.nodespaces_last_changed[id] = self.nodenet.current_step
         self.nodespaces_contents_last_changed[parent_id] = self.nodenet.current_step
+        self.journal_changes(CHANGED_NODESPACE, [id], [parent_id])
         return id
 
     def delete_nodespace(self, nodespace_id):
@@ -1567,6 +2489,7 @@ class TheanoPartition():
 
         self.nodenet.clear_supplements(nodespace_to_id(nodespace_id, self.pid))
         self.allocated_nodespaces[nodespace_id] = 0
+        self.mark_dirty(*NODE_ARRAYS)
         self.last_allocated_nodespace = nodespace_id
         self.nodenet._track_deletion('nodespaces', nodespace_to_id(nodespace_id, self.pid))
         self.nodespaces_contents_last_changed[self.allocated_nodespaces[nodespace_id]] = self.nodenet.current_step
@@ -1578,6 +2501,7 @@ class TheanoPartition():
             nodetype = self.nodenet.get_nodetype(get_string_node_type(numerical_node_type, self.nodenet.native_modules))
 
         elementindex = self.allocated_node_offsets[id] + get_numerical_gate_type(gate_type, nodetype)
+        self.mark_dirty(*GATE_ARRAYS)
         if parameter == 'threshold':
             g_threshold_array = self.g_threshold.get_value(borrow=True)
             g_threshold_array[elementindex] = value
@@ -1598,6 +2522,7 @@ class TheanoPartition():
             g_theta_array = self.g_theta.get_value(borrow=True)
             g_theta_array[elementindex] = value
             self.g_theta.set_value(g_theta_array, borrow=True)
+            self.__g_theta_shifted_dirty = True
 
     def set_node_gatefunction_name(self, id, gate_type, gatefunction_name):
         numerical_node_type = self.allocated_nodes[id]
@@ -1609,6 +2534,7 @@ class TheanoPartition():
         g_function_selector = self.g_function_selector.get_value(borrow=True)
         g_function_selector[elementindex] = get_numerical_gatefunction_type(gatefunction_name)
         self.g_function_selector.set_value(g_function_selector, borrow=True)
+        self.mark_dirty('g_function_selector')
         if g_function_selector[elementindex] == GATE_FUNCTION_ABSOLUTE:
             self.has_gatefunction_absolute = True
         elif g_function_selector[elementindex] == GATE_FUNCTION_SIGMOID:
@@ -1621,6 +2547,8 @@ class TheanoPartition():
             self.has_gatefunction_one_over_x = True
 
     def set_nodespace_gatetype_activator(self, nodespace_id, gate_type, activator_id):
+        self.__invalidate_element_indices()
+        self.mark_dirty(*NODE_ARRAYS)
         if gate_type == "por":
             self.allocated_nodespaces_por_activators[nodespace_id] = activator_id
             self.has_directional_activators = True
@@ -1647,6 +2575,8 @@ class TheanoPartition():
                                                       get_numerical_gate_type(gate_type)] = self.allocated_node_offsets[activator_id]
 
     def set_nodespace_sampling_activator(self, nodespace_id, activator_id):
+        self.__invalidate_element_indices()
+        self.mark_dirty(*NODE_ARRAYS)
         self.allocated_nodespaces_sampling_activators[nodespace_id] = activator_id
         self.has_sampling_activators = True
 
@@ -1676,19 +2606,20 @@ class TheanoPartition():
         if nst > get_slots_per_type(self.allocated_nodes[target_node_id], self.nodenet.native_modules):
             raise ValueError("Node %s does not have a slot of type %s" % (node_to_id(target_node_id, self.pid), slot_type))
 
-        w_matrix = self.w.get_value(borrow=True)
         x = self.allocated_node_offsets[target_node_id] + nst
         y = self.allocated_node_offsets[source_node_id] + ngt
         if self.sparse:
-            w_matrix[x, y] = weight
+            # changing the sparsity structure of w one entry at a time is expensive, stage the change instead
+            self.__staged_link_rows.append(x)
+            self.__staged_link_cols.append(y)
+            self.__staged_link_weights.append(weight)
         else:
+            w_matrix = self.w.get_value(borrow=True)
             w_matrix[x][y] = weight
-        self.w.set_value(w_matrix, borrow=True)
+            self.w.set_value(w_matrix, borrow=True)
+        self.mark_dirty(*LINK_ARRAYS)
 
-        self.nodes_last_changed[source_node_id] = self.nodenet.current_step
-        self.nodes_last_changed[target_node_id] = self.nodenet.current_step
-        self.nodespaces_contents_last_changed[self.allocated_node_parents[source_node_id]] = self.nodenet.current_step
-        self.nodespaces_contents_last_changed[self.allocated_node_parents[target_node_id]] = self.nodenet.current_step
+        self.nodes_changed([source_node_id, target_node_id])
 
         # if (slot_type == "por" or slot_type == "ret") and self.allocated_nodes[node_from_id(target_node_uid)] == PIPE:
         #     self.__por_ret_dirty = False
@@ -1712,6 +2643,96 @@ class TheanoPartition():
                     n_node_retlinked_array[self.allocated_node_offsets[target_node_id] + g] = 1
             self.n_node_retlinked.set_value(n_node_retlinked_array, borrow=True)
 
+    def set_link_weights_by_elements(self, slot_elements, gate_elements, weights):
+        """
+        Sets the weights of the links gate_elements[i] -> slot_elements[i] in one operation.
+        Setting a weight to 0 deletes the link.
+        """
+        slot_elements = np.asarray(slot_elements, dtype=np.int64)
+        gate_elements = np.asarray(gate_elements, dtype=np.int64)
+        weights = np.asarray(weights, dtype=self.nodenet.scipyfloatX)
+        if len(slot_elements) == 0:
+            return
+
+        if self.sparse:
+            self.stage_link_weights(slot_elements, gate_elements, weights)
+        else:
+            w_matrix = self.w.get_value(borrow=True)
+            w_matrix[slot_elements, gate_elements] = weights
+            self.w.set_value(w_matrix, borrow=True)
+            self.mark_dirty(*LINK_ARRAYS)
+
+        source_ids = self.allocated_elements_to_nodes[gate_elements]
+        target_ids = self.allocated_elements_to_nodes[slot_elements]
+        self.nodes_changed(np.unique(np.concatenate((source_ids, target_ids))))
+
+        if self.has_pipes:
+            pipe_links = np.where(self.allocated_nodes[target_ids] == PIPE)[0]
+            if len(pipe_links) > 0:
+                pipe_offsets = self.allocated_node_offsets[target_ids[pipe_links]]
+                pipe_slots = slot_elements[pipe_links] - pipe_offsets
+                linked = (weights[pipe_links] != 0).astype(T.config.floatX)
+                for slot, shared in ((POR, self.n_node_porlinked), (RET, self.n_node_retlinked)):
+                    selected = np.where(pipe_slots == slot)[0]
+                    if len(selected) > 0:
+                        flags = shared.get_value(borrow=True)
+                        # as in set_link_weight, the last change of a node's slot decides its flag
+                        flags[np.add.outer(pipe_offsets[selected], np.arange(7))] = linked[selected][:, np.newaxis]
+                        shared.set_value(flags, borrow=True)
+
+    def stage_link_weights(self, rows, cols, weights):
+        """ Stages the given link weights (arrays of slot elements, gate elements and weights) for a sparse w """
+        self.mark_dirty(*LINK_ARRAYS)
+        self.__stage_single_link_weights()
+        self.__staged_link_chunks.append((
+            np.asarray(rows, dtype=np.int64),
+            np.asarray(cols, dtype=np.int64),
+            np.asarray(weights, dtype=self.nodenet.scipyfloatX)))
+
+    def __stage_single_link_weights(self):
+        # turn the single staged changes into a chunk, to keep the order of changes intact
+        if self.__staged_link_rows:
+            self.__staged_link_chunks.append((
+                np.asarray(self.__staged_link_rows, dtype=np.int64),
+                np.asarray(self.__staged_link_cols, dtype=np.int64),
+                np.asarray(self.__staged_link_weights, dtype=self.nodenet.scipyfloatX)))
+            self.__staged_link_rows = []
+            self.__staged_link_cols = []
+            self.__staged_link_weights = []
+
+    def discard_link_updates(self):
+        """ Forgets all staged link weight changes """
+        self.__staged_link_rows = []
+        self.__staged_link_cols = []
+        self.__staged_link_weights = []
+        self.__staged_link_chunks = []
+
+    def flush_link_updates(self):
+        """ Merges all staged link weight changes into the sparse weight matrix in one operation """
+        self.__stage_single_link_weights()
+        if not self.__staged_link_chunks:
+            return
+        if not self.__w_expanded:
+            self.__expand_weights()
+
+        rows = np.concatenate([chunk[0] for chunk in self.__staged_link_chunks])
+        cols = np.concatenate([chunk[1] for chunk in self.__staged_link_chunks])
+        weights = np.concatenate([chunk[2] for chunk in self.__staged_link_chunks])
+        self.__staged_link_chunks = []
+
+        # only the last change to an entry counts
+        _, last = np.unique((rows * self.NoE + cols)[::-1], return_index=True)
+        last = len(rows) - 1 - last
+        rows, cols, weights = rows[last], cols[last], weights[last]
+
+        shape = (self.NoE, self.NoE)
+        w_matrix = self.__w.get_value(borrow=True)
+        staged = sp.csr_matrix((weights, (rows, cols)), shape=shape, dtype=self.nodenet.scipyfloatX)
+        mask = sp.csr_matrix((np.ones(len(rows), dtype=self.nodenet.scipyfloatX), (rows, cols)), shape=shape)
+        w_matrix = (w_matrix - w_matrix.multiply(mask) + staged).tocsr()
+        w_matrix.eliminate_zeros()
+        self.__w.set_value(w_matrix, borrow=True)
+
     def group_nodes_by_ids(self, nodespace_uid, ids, group_name, gatetype="gen"):
 
         if nodespace_uid not in self.nodegroups:
@@ -1728,6 +2749,59 @@ class TheanoPartition():
     def ungroup_nodes(self, nodespace_uid, group):
         if nodespace_uid in self.nodegroups and group in self.nodegroups[nodespace_uid]:
             del self.nodegroups[nodespace_uid][group]
+        for key in list(self.__weight_blocks.keys()):
+            if (nodespace_uid, group) in (key[0:2], key[2:4]):
+                del self.__weight_blocks[key]
+
+    def register_weight_block(self, nodespace_from_uid, group_from, nodespace_to_uid, group_to):
+        """
+        Keeps a dense matrix of the weights of the links from group_from to group_to, which get_link_weights returns
+        without searching w, and which set_link_weights copies to w through the positions of its entries in w.
+        """
+        if nodespace_from_uid not in self.nodegroups or group_from not in self.nodegroups[nodespace_from_uid]:
+            raise ValueError("Group %s does not exist in nodespace %s." % (group_from, nodespace_from_uid))
+        if nodespace_to_uid not in self.nodegroups or group_to not in self.nodegroups[nodespace_to_uid]:
+            raise ValueError("Group %s does not exist in nodespace %s." % (group_to, nodespace_to_uid))
+        from_elements = self.nodegroups[nodespace_from_uid][group_from]
+        to_elements = self.nodegroups[nodespace_to_uid][group_to]
+        self.__weight_blocks[(nodespace_from_uid, group_from, nodespace_to_uid, group_to)] = {
+            'from_elements': from_elements,
+            'to_elements': to_elements,
+            'weights': np.zeros((len(to_elements), len(from_elements)), dtype=T.config.floatX),
+            'positions': None,      # positions of the entries in the data of w, -1 for entries not in a sparse w,
+                                    # None after links have been added to or removed from w
+            'source': None,         # the w the positions have been found in
+            'stale': True}          # whether w has been changed since the weights have been read
+
+    def __get_weight_block(self, key):
+        block = self.__weight_blocks[key]
+        w_matrix = self.w.get_value(borrow=True)
+        if block['positions'] is None or block['source'] is not w_matrix:
+            block['positions'] = self.__get_weight_block_positions(w_matrix, block['from_elements'], block['to_elements'])
+            block['source'] = w_matrix
+        if block['stale']:
+            positions = block['positions']
+            present = positions >= 0
+            data = w_matrix.data if self.sparse else w_matrix.reshape(-1)
+            weights = block['weights'].reshape(-1)
+            weights[:] = 0
+            weights[present] = data[positions[present]]
+            block['stale'] = False
+        return block
+
+    def __get_weight_block_positions(self, w_matrix, from_elements, to_elements):
+        keys = (to_elements.astype(np.int64)[:, np.newaxis] * self.NoE + from_elements[np.newaxis, :]).reshape(-1)
+        if not self.sparse:
+            return keys
+        rows = np.repeat(np.arange(self.NoE, dtype=np.int64), np.diff(w_matrix.indptr))
+        entry_keys = rows * self.NoE + w_matrix.indices
+        if not len(entry_keys):
+            return np.zeros(len(keys), dtype=np.int64) - 1
+        # search in sorted keys, without reordering the entries of w
+        order = np.arange(len(entry_keys)) if w_matrix.has_sorted_indices else np.argsort(entry_keys, kind='mergesort')
+        entry_keys = entry_keys[order]
+        positions = np.minimum(np.searchsorted(entry_keys, keys), len(entry_keys) - 1)
+        return np.where(entry_keys[positions] == keys, order[positions], -1)
 
     def get_activations(self, nodespace_uid, group):
         if nodespace_uid not in self.nodegroups or group not in self.nodegroups[nodespace_uid]:
@@ -1741,6 +2815,7 @@ class TheanoPartition():
         a_array = self.a.get_value(borrow=True)
         a_array[self.nodegroups[nodespace_uid][group]] = new_activations
         self.a.set_value(a_array, borrow=True)
+        self.mark_dirty('a')
 
     def get_thetas(self, nodespace_uid, group):
         if nodespace_uid not in self.nodegroups or group not in self.nodegroups[nodespace_uid]:
@@ -1754,12 +2829,17 @@ class TheanoPartition():
         g_theta_array = self.g_theta.get_value(borrow=True)
         g_theta_array[self.nodegroups[nodespace_uid][group]] = thetas
         self.g_theta.set_value(g_theta_array, borrow=True)
+        self.mark_dirty('g_theta')
+        self.__g_theta_shifted_dirty = True
 
     def get_link_weights(self, nodespace_from_uid, group_from, nodespace_to_uid, group_to):
         if nodespace_from_uid not in self.nodegroups or group_from not in self.nodegroups[nodespace_from_uid]:
             raise ValueError("Group %s does not exist in nodespace %s." % (group_from, nodespace_from_uid))
         if nodespace_to_uid not in self.nodegroups or group_to not in self.nodegroups[nodespace_to_uid]:
             raise ValueError("Group %s does not exist in nodespace %s." % (group_to, nodespace_to_uid))
+        key = (nodespace_from_uid, group_from, nodespace_to_uid, group_to)
+        if key in self.__weight_blocks:
+            return self.__get_weight_block(key)['weights']
         w_matrix = self.w.get_value(borrow=True)
         cols, rows = np.meshgrid(self.nodegroups[nodespace_from_uid][group_from], self.nodegroups[nodespace_to_uid][group_to])
         if self.sparse:
@@ -1777,42 +2857,122 @@ class TheanoPartition():
         #if len(self.nodegroups[nodespace_to_uid][group_to]) != new_w.shape[0]:
         #    raise ValueError("group_to %s has length %i, but new_w.shape[0] is %i" % (group_to, len(self.nodegroups[nodespace_to_uid][group_to]), new_w.shape[0]))
 
-        w_matrix = self.w.get_value(borrow=True)
         grp_from = self.nodegroups[nodespace_from_uid][group_from]
         grp_to = self.nodegroups[nodespace_to_uid][group_to]
-        cols, rows = np.meshgrid(grp_from, grp_to)
-        w_matrix[rows, cols] = new_w
-        self.w.set_value(w_matrix, borrow=True)
+        key = (nodespace_from_uid, group_from, nodespace_to_uid, group_to)
+        if key in self.__weight_blocks:
+            block = self.__get_weight_block(key)
+            block['weights'][...] = new_w
+            weights = block['weights'].reshape(-1)
+            positions = block['positions']
+            present = positions >= 0
+            w_matrix = self.w.get_value(borrow=True)
+            data = w_matrix.data if self.sparse else w_matrix.reshape(-1)
+            data[positions[present]] = weights[present]
+            self.w.set_value(w_matrix, borrow=True)
+            # links that do not exist in a sparse w yet are created with the next flush
+            missing = np.where(~present & (weights != 0))[0]
+            if len(missing):
+                self.stage_link_weights(grp_to[missing // len(grp_from)], grp_from[missing % len(grp_from)], weights[missing])
+            # only the values of existing entries have changed, so the positions stay valid
+            self.mark_dirty('w_data', 'w_scale')
+            block['stale'] = False
+        else:
+            w_matrix = self.w.get_value(borrow=True)
+            cols, rows = np.meshgrid(grp_from, grp_to)
+            w_matrix[rows, cols] = new_w
+            self.w.set_value(w_matrix, borrow=True)
+            self.mark_dirty(*LINK_ARRAYS)
+        self.invalidate_w_columns()
 
-        cstep = self.nodenet.current_step
-        self.nodes_last_changed[self.allocated_elements_to_nodes[grp_from]] = cstep
-        self.nodespaces_contents_last_changed[self.allocated_node_parents[self.allocated_elements_to_nodes[grp_from]]] = cstep
-        self.nodes_last_changed[self.allocated_elements_to_nodes[grp_to]] = cstep
-        self.nodespaces_contents_last_changed[self.allocated_node_parents[self.allocated_elements_to_nodes[grp_to]]] = cstep
+        self.nodes_changed(np.unique(self.allocated_elements_to_nodes[np.concatenate((grp_from, grp_to))]))
 
         self.por_ret_dirty = self.has_pipes
 
-    def set_inlink_weights(self, partition_from_spid, new_from_elements, new_to_elements, new_weights):
-        from_partition = self.nodenet.partitions[partition_from_spid]
+    def set_inlink_weights(self, partition_from_spid, new_from_elements, new_to_elements, new_weights, pairwise=False):
+        """
+        Sets the weights of the inlinks from the given partition.
+        new_weights is a matrix (rows: new_to_elements, cols: new_from_elements), or, if pairwise is True,
+        a vector of weights for the links new_from_elements[i] -> new_to_elements[i]
+        """
         if partition_from_spid in self.inlinks:
-            theano_from_elements = self.inlinks[partition_from_spid][0]
-            theano_to_elements = self.inlinks[partition_from_spid][1]
-            theano_weights = self.inlinks[partition_from_spid][2]
-            old_from_elements = theano_from_elements.get_value(borrow=True)
-            old_to_elements = theano_to_elements.get_value(borrow=True)
-            old_weights = theano_weights.get_value(borrow=True)
-            propagation_function = self.inlinks[partition_from_spid][3]
+            old_from_elements = self.inlinks[partition_from_spid][0].get_value(borrow=True)
+            old_to_elements = self.inlinks[partition_from_spid][1].get_value(borrow=True)
+            old_rows, old_cols, old_weights = self.get_inlink_entries(partition_from_spid)
         else:
             old_from_elements = np.zeros(0, dtype=np.int32)
             old_to_elements = np.zeros(0, dtype=np.int32)
-            old_weights = np.eye(0, dtype=T.config.floatX)
+            old_rows = old_cols = np.zeros(0, dtype=np.int64)
+            old_weights = np.zeros(0, dtype=T.config.floatX)
+
+        from_elements = np.union1d(old_from_elements, new_from_elements)
+        to_elements = np.union1d(old_to_elements, new_to_elements)
 
+        new_from_indices = np.searchsorted(from_elements, new_from_elements)
+        new_to_indices = np.searchsorted(to_elements, new_to_elements)
+        if pairwise:
+            new_rows, new_cols = new_to_indices, new_from_indices
+        else:
+            new_cols, new_rows = np.meshgrid(new_from_indices, new_to_indices)
+        new_rows = np.ravel(new_rows)
+        new_cols = np.ravel(new_cols)
+        new_weights = np.zeros(len(new_rows), dtype=T.config.floatX) + np.ravel(np.asarray(new_weights, dtype=T.config.floatX))
+
+        # old entries move to their indices in the new element lists, new entries override old ones
+        rows = np.concatenate((np.searchsorted(to_elements, old_to_elements)[old_rows], new_rows))
+        cols = np.concatenate((np.searchsorted(from_elements, old_from_elements)[old_cols], new_cols))
+        weights = np.concatenate((old_weights, new_weights))
+        _, last = np.unique((rows * len(from_elements) + cols)[::-1], return_index=True)
+        last = len(rows) - 1 - last
+        last = last[weights[last] != 0]
+
+        self.set_inlink_entries(partition_from_spid, from_elements, to_elements, rows[last], cols[last], weights[last])
+
+    def get_inlink_entries(self, partition_from_spid):
+        """
+        Returns the non-zero entries of the inlink weights from the given partition as
+        rows (indices into the to_elements), cols (indices into the from_elements) and weights
+        """
+        weights = self.inlinks[partition_from_spid][2].get_value(borrow=True)
+        if sp.issparse(weights):
+            coo = weights.tocoo()
+            nonzero = coo.data != 0
+            return coo.row[nonzero].astype(np.int64), coo.col[nonzero].astype(np.int64), coo.data[nonzero]
+        rows, cols = np.nonzero(weights)
+        return rows.astype(np.int64), cols.astype(np.int64), weights[rows, cols]
+
+    def set_inlink_entries(self, partition_from_spid, from_elements, to_elements, rows, cols, weights):
+        """
+        Replaces the inlinks from the given partition with the given entries.
+        The weights are stored as a sparse matrix if the block is large and sparse enough, dense otherwise.
+        """
+        from_partition = self.nodenet.partitions[partition_from_spid]
+        from_elements = np.asarray(from_elements, dtype=np.int32)
+        to_elements = np.asarray(to_elements, dtype=np.int32)
+        shape = (len(to_elements), len(from_elements))
+
+        size = shape[0] * shape[1]
+        sparse = size >= self.sparse_inlinks_min_size and len(weights) <= size * self.sparse_inlinks_max_density
+        if sparse:
+            block = sp.csr_matrix((weights, (rows, cols)), shape=shape, dtype=self.nodenet.scipyfloatX)
+        else:
+            block = np.zeros(shape, dtype=T.config.floatX)
+            block[rows, cols] = weights
+
+        if partition_from_spid in self.inlinks and \
+                sp.issparse(self.inlinks[partition_from_spid][2].get_value(borrow=True)) == sparse:
+            theano_from_elements, theano_to_elements, theano_weights, propagation_function = self.inlinks[partition_from_spid]
+            theano_from_elements.set_value(from_elements, borrow=True)
+            theano_to_elements.set_value(to_elements, borrow=True)
+            theano_weights.set_value(block, borrow=True)
+        else:
+            # new partition pair, or the block switched between dense and sparse: the propagation needs to be compiled
             weightsname = "w_%s_%s" % (partition_from_spid, self.spid)
             fromname = "in_from_%s_%s" % (partition_from_spid, self.spid)
             toname = "in_to_%s_%s" % (partition_from_spid, self.spid)
-            theano_from_elements = theano.shared(value=old_from_elements, name=fromname, borrow=True)
-            theano_to_elements = theano.shared(value=old_to_elements, name=toname, borrow=True)
-            theano_weights = theano.shared(value=old_weights.astype(T.config.floatX), name=weightsname, borrow=True)
+            theano_from_elements = theano.shared(value=from_elements, name=fromname, borrow=True)
+            theano_to_elements = theano.shared(value=to_elements, name=toname, borrow=True)
+            theano_weights = theano.shared(value=block, name=weightsname, borrow=True)
 
             propagation_function = self.get_compiled_propagate_inlinks(
                 from_partition,
@@ -1820,49 +2980,62 @@ class TheanoPartition():
                 theano_to_elements,
                 theano_weights)
 
-        from_elements = np.union1d(old_from_elements, new_from_elements)
-        to_elements = np.union1d(old_to_elements, new_to_elements)
-        weights = np.zeros((len(to_elements), len(from_elements)), dtype=T.config.floatX)
-
-        old_from_indices = np.searchsorted(from_elements, old_from_elements)
-        old_to_indices = np.searchsorted(to_elements, old_to_elements)
-        oldcols, oldrows = np.meshgrid(old_from_indices, old_to_indices)
-        weights[oldrows, oldcols] = old_weights
-
-        new_from_indices = np.searchsorted(from_elements, new_from_elements)
-        new_to_indices = np.searchsorted(to_elements, new_to_elements)
-        newcols, newrows = np.meshgrid(new_from_indices, new_to_indices)
-        weights[newrows, newcols] = new_weights
-
-        theano_from_elements.set_value(from_elements, borrow=True)
-        theano_to_elements.set_value(to_elements, borrow=True)
-        theano_weights.set_value(weights, borrow=True)
-
-        for id in from_partition.allocated_elements_to_nodes[theano_from_elements.get_value()]:
-            from_partition.nodes_last_changed[id] = self.nodenet.current_step
-            from_partition.nodespaces_contents_last_changed[from_partition.allocated_node_parents[id]] = self.nodenet.current_step
-        for id in self.allocated_elements_to_nodes[theano_to_elements.get_value()]:
-            self.nodes_last_changed[id] = self.nodenet.current_step
-            self.nodespaces_contents_last_changed[self.allocated_node_parents[id]] = self.nodenet.current_step
+        from_partition.nodes_changed(np.unique(from_partition.allocated_elements_to_nodes[from_elements]))
+        self.nodes_changed(np.unique(self.allocated_elements_to_nodes[to_elements]))
 
         self.inlinks[partition_from_spid] = (
             theano_from_elements,
             theano_to_elements,
             theano_weights,
             propagation_function)
+        self.mark_dirty(*INLINK_ARRAYS)
 
     def has_nodespace_changes(self, nodespace_uid, since_step):
         ns_id = nodespace_from_id(nodespace_uid)
         return (self.nodespaces_contents_last_changed[ns_id] >= since_step).__bool__()
 
     def get_nodespace_changes(self, nodespace_uid, since_step):
+        """
+        Returns the ids of the nodes and nodespaces in the given nodespace that have changed since the given step,
+        from the change journal, or by scanning all nodes if the journal does not reach back to since_step
+        """
         ns_id = nodespace_from_id(nodespace_uid)
-        node_ids = np.where(self.nodes_last_changed >= since_step)[0]
-        node_ids = node_ids[np.where(self.allocated_node_parents[node_ids] == ns_id)[0]]
-        nodespace_ids = np.where(self.nodespaces_last_changed >= since_step)[0]
-        nodespace_ids = nodespace_ids[np.where(self.allocated_nodespaces[nodespace_ids] == ns_id)[0]]
+        if self.nodespaces_contents_last_changed[ns_id] < since_step:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32)
+        if since_step <= self.__change_journal_lost_step:
+            node_ids = np.where(self.nodes_last_changed >= since_step)[0]
+            node_ids = node_ids[np.where(self.allocated_node_parents[node_ids] == ns_id)[0]]
+            nodespace_ids = np.where(self.nodespaces_last_changed >= since_step)[0]
+            nodespace_ids = nodespace_ids[np.where(self.allocated_nodespaces[nodespace_ids] == ns_id)[0]]
+            return node_ids, nodespace_ids
+        ids, parents, kinds = self.__get_journal_changes(since_step)
+        in_nodespace = parents == ns_id
+        # nodes and nodespaces may have been deleted since
+        node_ids = np.unique(ids[in_nodespace & (kinds == CHANGED_NODE)])
+        node_ids = node_ids[(self.allocated_node_parents[node_ids] == ns_id) & (self.allocated_nodes[node_ids] != 0)]
+        nodespace_ids = np.unique(ids[in_nodespace & (kinds == CHANGED_NODESPACE)])
+        nodespace_ids = nodespace_ids[self.allocated_nodespaces[nodespace_ids] == ns_id]
         return node_ids, nodespace_ids
 
+    def get_activation_snapshot(self, ids=None):
+        """
+        Returns the activations of the given nodes (all nodes if None) as a tuple of contiguous arrays
+        (node_ids, offsets, counts, activations): the activations of node_ids[i] are
+        activations[offsets[i]:offsets[i] + counts[i]]. The activations are gathered with one copy.
+        """
+        if ids is None:
+            ids = np.nonzero(self.allocated_nodes)[0]
+        ids = np.asarray(ids, dtype=np.int32)
+        types = self.allocated_nodes[ids]
+        counts = np.zeros(len(ids), dtype=np.int32)
+        for type in np.unique(types):
+            counts[types == type] = get_elements_per_type(type, self.nodenet.native_modules)
+        offsets = np.zeros(len(ids), dtype=np.int32)
+        offsets[1:] = np.cumsum(counts)[:-1]
+        elements = np.repeat(self.allocated_node_offsets[ids] - offsets, counts) + np.arange(counts.sum(), dtype=np.int32)
+        activations = self.a.get_value(borrow=True)[elements]
+        return ids, offsets, counts, activations
+
     def get_node_data(self, ids=None, nodespace_ids=None, complete=False, include_links=True, include_followupnodes=True):
 
         a = self.a.get_value(borrow=True)
@@ -1882,50 +3055,84 @@ class TheanoPartition():
         if ids is not None:
             node_ids = np.intersect1d(node_ids, ids)
 
+        # gate functions, parameters and activations, built per node type for all nodes of the type at once
+        gate_data = {}
+        gatefunction_names = {}
+        gate_parameter_arrays = (('threshold', g_threshold_array), ('amplification', g_amplification_array),
+                                 ('minimum', g_min_array), ('maximum', g_max_array), ('theta', g_theta))
+        node_types = self.allocated_nodes[node_ids]
+        for numerical_type in np.unique(node_types):
+            type_ids = node_ids[node_types == numerical_type]
+            nodetype = self.nodenet.get_nodetype(get_string_node_type(numerical_type, self.nodenet.native_modules))
+            gatetypes = nodetype.gatetypes
+            numerical_gates = np.asarray([get_numerical_gate_type(gate, nodetype) for gate in gatetypes], dtype=np.int32)
+            elements = self.allocated_node_offsets[type_ids][:, np.newaxis] + numerical_gates[np.newaxis, :]
+
+            activations = a[elements].tolist()
+            selectors = g_function_selector[elements].tolist()
+            parameter_values = []
+            for parameter, array in gate_parameter_arrays:
+                values = array[elements].astype(np.float64)
+                non_default = np.ones(values.shape, dtype=bool)
+                for column, gate in enumerate(gatetypes):
+                    if parameter in nodetype.gate_defaults[gate]:
+                        non_default[:, column] = values[:, column] != nodetype.gate_defaults[gate][parameter]
+                parameter_values.append((parameter, values.tolist(), non_default.tolist()))
+
+            for row, id in enumerate(type_ids.tolist()):
+                gate_functions = {}
+                gate_parameters = {}
+                gate_activations = {}
+                for column, gate in enumerate(gatetypes):
+                    selector = selectors[row][column]
+                    if selector not in gatefunction_names:
+                        gatefunction_names[selector] = get_string_gatefunction_type(selector)
+                    gate_functions[gate] = gatefunction_names[selector]
+
+                    parameters = {}
+                    for parameter, values, non_default in parameter_values:
+                        if non_default[row][column]:
+                            parameters[parameter] = values[row][column]
+                    if not len(parameters) == 0:
+                        gate_parameters[gate] = parameters
+
+                    gate_activations[gate] = {"default": {
+                        "name": "default",
+                        "uid": "default",
+                        "activation": activations[row][column]}}
+                gate_data[id] = gate_functions, gate_parameters, gate_activations
+
+        # datasources, datatargets and activator types by element or node id, inverted once per call
+        datasources_by_element = {}
+        if len(self.sensor_indices):
+            datasources = self.nodenet.get_datasources()
+            for index, element in reversed(list(enumerate(self.sensor_indices.tolist()))):
+                datasources_by_element[element] = datasources[index]
+        datatargets_by_element = {}
+        if len(self.actuator_indices):
+            datatargets = self.nodenet.get_datatargets()
+            for index, element in reversed(list(enumerate(self.actuator_indices.tolist()))):
+                datatargets_by_element[element] = datatargets[index]
+        activator_types = {}
+        for activator_type, activators in (("por", self.allocated_nodespaces_por_activators),
+                                           ("ret", self.allocated_nodespaces_ret_activators),
+                                           ("sub", self.allocated_nodespaces_sub_activators),
+                                           ("sur", self.allocated_nodespaces_sur_activators),
+                                           ("cat", self.allocated_nodespaces_cat_activators),
+                                           ("exp", self.allocated_nodespaces_exp_activators),
+                                           ("sampling", self.allocated_nodespaces_sampling_activators)):
+            for activator_id in np.unique(activators).tolist():
+                activator_types.setdefault(activator_id, activator_type)
+        g_expect_array = self.g_expect.get_value(borrow=True)
+        g_wait_array = self.g_wait.get_value(borrow=True)
+
         nodes = {}
         followupuids = set()
-        for id in node_ids:
+        for id in node_ids.tolist():
             uid = node_to_id(id, self.pid)
             strtype = get_string_node_type(self.allocated_nodes[id], self.nodenet.native_modules)
-            nodetype = self.nodenet.get_nodetype(strtype)
-
-            gate_functions = {}
-            gate_parameters = {}
-            gate_activations = {}
-            links = {}
-            for gate in self.nodenet.get_nodetype(strtype).gatetypes:
-                numericalgate = get_numerical_gate_type(gate, self.nodenet.get_nodetype(strtype))
-                element = self.allocated_node_offsets[id] + numericalgate
-                gate_functions[gate] = get_string_gatefunction_type(g_function_selector[element])
-
-                parameters = {}
-                threshold = g_threshold_array[element].item()
-                if 'threshold' not in nodetype.gate_defaults[gate] or threshold != nodetype.gate_defaults[gate]['threshold']:
-                    parameters['threshold'] = float(threshold)
-
-                amplification = g_amplification_array[element].item()
-                if 'amplification' not in nodetype.gate_defaults[gate] or amplification != nodetype.gate_defaults[gate]['amplification']:
-                    parameters['amplification'] = float(amplification)
-
-                minimum = g_min_array[element].item()
-                if 'minimum' not in nodetype.gate_defaults[gate] or minimum != nodetype.gate_defaults[gate]['minimum']:
-                    parameters['minimum'] = float(minimum)
-
-                maximum = g_max_array[element].item()
-                if 'maximum' not in nodetype.gate_defaults[gate] or maximum != nodetype.gate_defaults[gate]['maximum']:
-                    parameters['maximum'] = float(maximum)
-
-                theta = g_theta[element].item()
-                if 'theta' not in nodetype.gate_defaults[gate] or theta != nodetype.gate_defaults[gate]['theta']:
-                    parameters['theta'] = float(theta)
-
-                if not len(parameters) == 0:
-                    gate_parameters[gate] = parameters
-
-                gate_activations[gate] = {"default": {
-                    "name": "default",
-                    "uid": "default",
-                    "activation": float(a[element])}}
+            offset = self.allocated_node_offsets[id]
+            gate_functions, gate_parameters, gate_activations = gate_data[id]
 
             state = None
             if uid in self.native_module_instances:
@@ -1933,42 +3140,14 @@ class TheanoPartition():
 
             parameters = {}
             if strtype == "Sensor":
-                sensor_element = self.allocated_node_offsets[id] + GEN
-                datasource_index = np.where(self.sensor_indices == sensor_element)[0]
-                if len(datasource_index) == 0:
-                    parameters['datasource'] = None
-                else:
-                    parameters['datasource'] = self.nodenet.get_datasources()[datasource_index[0]]
+                parameters['datasource'] = datasources_by_element.get(offset + GEN)
             elif strtype == "Actor":
-                actuator_element = self.allocated_node_offsets[id] + GEN
-                datatarget_index = np.where(self.actuator_indices == actuator_element)[0]
-                if len(datatarget_index) == 0:
-                    parameters['datatarget'] = None
-                else:
-                    parameters['datatarget'] = self.nodenet.get_datatargets()[datatarget_index[0]]
+                parameters['datatarget'] = datatargets_by_element.get(offset + GEN)
             elif strtype == "Activator":
-                activator_type = None
-                if id in self.allocated_nodespaces_por_activators:
-                    activator_type = "por"
-                elif id in self.allocated_nodespaces_ret_activators:
-                    activator_type = "ret"
-                elif id in self.allocated_nodespaces_sub_activators:
-                    activator_type = "sub"
-                elif id in self.allocated_nodespaces_sur_activators:
-                    activator_type = "sur"
-                elif id in self.allocated_nodespaces_cat_activators:
-                    activator_type = "cat"
-                elif id in self.allocated_nodespaces_exp_activators:
-                    activator_type = "exp"
-                elif id in self.allocated_nodespaces_sampling_activators:
-                    activator_type = "sampling"
-                parameters['type'] = activator_type
+                parameters['type'] = activator_types.get(id)
             elif strtype == "Pipe":
-                g_expect_array = self.g_expect.get_value(borrow=True)
-                value = g_expect_array[self.allocated_node_offsets[id] + get_numerical_gate_type("sur")].item()
-                parameters['expectation'] = value
-                g_wait_array = self.g_wait.get_value(borrow=True)
-                parameters['wait'] = g_wait_array[self.allocated_node_offsets[id] + get_numerical_gate_type("sur")].item()
+                parameters['expectation'] = g_expect_array[offset + get_numerical_gate_type("sur")].item()
+                parameters['wait'] = g_wait_array[offset + get_numerical_gate_type("sur")].item()
             elif strtype == "Comment":
                 parameters = self.comment_instances.get(uid).clone_parameters()
             elif strtype in self.nodenet.native_modules:
@@ -1984,8 +3163,8 @@ class TheanoPartition():
                     "gate_parameters": gate_parameters,
                     "sheaves": {"default": {"name": "default",
                                 "uid": "default",
-                                "activation": float(a[self.allocated_node_offsets[id] + GEN])}},
-                    "activation": float(a[self.allocated_node_offsets[id] + GEN]),
+                                "activation": float(a[offset + GEN])}},
+                    "activation": float(a[offset + GEN]),
                     "gate_activations": gate_activations,
                     "gate_functions": gate_functions}
             if complete:
@@ -0,0 +1,241 @@
+"""
+Stepping the partitions of a theano node net in worker processes
+"""
+
+import multiprocessing
+import traceback
+
+import numpy as np
+
+from micropsi_core.nodenet.theano_engine.theano_partition import VALUE_ARRAYS
+
+# the arrays a step of a partition changes, which are exchanged between the processes through shared memory
+SHARED_ARRAYS = ('a', 'a_prev', 'g_factor', 'g_countdown')
+
+
+def can_fork():
+    """ Returns True if worker processes can be forked from the running process """
+    return 'fork' in multiprocessing.get_all_start_methods()
+
+
+class PartitionShards():
+    """
+    Calculates the steps of the partitions of a node net in worker processes.
+
+    The workers are forked from the process holding the node net, so each one starts with a copy of all
+    partitions, and calculates the steps of its share of them. The SHARED_ARRAYS of all partitions live in
+    shared memory blocks: after a step, every worker copies the arrays of its partitions to their blocks,
+    and before the next step, it reads the activations of the other workers' partitions its own partitions
+    have inlinks from. A barrier keeps workers from writing the blocks before all of them have read them.
+
+    The node net in the parent process stays the proxy for netapi, monitors and the frontend: after every
+    step, it copies the shared arrays to its partitions. Changes made to the values of partitions in the parent
+    process (see partition.changed_arrays) are sent to the workers with the next step. Changes to nodes or
+    inlinks, and added or deleted partitions, restart the workers, see get_updates.
+
+    If the node net has a worldadapter, sensors or actuators, the workers send their propagated activations
+    back through the blocks, and the parent process writes the actuator values and reads the sensor values
+    for them, as in the unfused step, before they calculate the node functions.
+
+    The parent process is usually the multi-threaded runtime, with the runner and the server threads. Only
+    the forking thread continues in the workers, and locks held by the other threads at the time of the fork
+    stay locked there. The workers therefore only calculate and report through their pipes, and do not log.
+    """
+
+    def __init__(self, nodenet, processes):
+        self.nodenet = nodenet
+        self.context = multiprocessing.get_context('fork')
+
+        # distribute the partitions largest first, each one to the worker with the fewest elements so far
+        partitions = sorted(nodenet.partitions.values(), key=lambda partition: partition.NoE, reverse=True)
+        processes = min(processes, len(partitions))
+        self.assignments = [[] for i in range(processes)]
+        loads = [0] * processes
+        for partition in partitions:
+            worker = loads.index(min(loads))
+            self.assignments[worker].append(partition.spid)
+            loads[worker] += partition.NoE
+
+        # the partitions the workers have been forked with. their changes from then on are sent with the steps
+        self.partitions = dict(nodenet.partitions)
+        self.numbers_of_elements = dict((spid, partition.NoE) for spid, partition in nodenet.partitions.items())
+        for partition in nodenet.partitions.values():
+            partition.changed_arrays.clear()
+
+        self.blocks = {}
+        for spid, partition in nodenet.partitions.items():
+            self.blocks[spid] = {}
+            for name in SHARED_ARRAYS:
+                value = getattr(partition, name).get_value(borrow=True)
+                block = np.frombuffer(self.context.RawArray('b', value.nbytes), dtype=value.dtype, count=len(value))
+                block[:] = value
+                self.blocks[spid][name] = block
+
+        barrier = self.context.Barrier(processes)
+        pipes = [self.context.Pipe() for i in range(processes)]
+        self.connections = []
+        self.processes = []
+        for spids, (connection, worker_connection) in zip(self.assignments, pipes):
+            process = self.context.Process(target=run_worker,
+                                           args=(nodenet, spids, self.blocks, barrier, worker_connection, pipes),
+                                           name="partitions %s of %s" % (",".join(spids), nodenet.uid))
+            process.daemon = True
+            process.start()
+            worker_connection.close()
+            self.connections.append(connection)
+            self.processes.append(process)
+        nodenet.logger.debug("Started %i partition worker processes" % processes)
+
+    def get_updates(self):
+        """
+        Returns a dict of the values of the partitions that have changed since the last step, to be set by the
+        workers, for each worker, and writes their SHARED_ARRAYS to the blocks. Returns None if partitions have
+        changed in ways that require the workers to be restarted.
+        """
+        partitions = self.nodenet.partitions
+        if set(partitions.keys()) != set(self.partitions.keys()):
+            return None
+        for spid, partition in partitions.items():
+            if partition is not self.partitions[spid] or partition.NoE != self.numbers_of_elements[spid]:
+                return None
+            if not partition.changed_arrays.issubset(VALUE_ARRAYS):
+                return None
+
+        updates = [{} for spids in self.assignments]
+        for worker, spids in enumerate(self.assignments):
+            for spid in spids:
+                partition = partitions[spid]
+                if not partition.changed_arrays:
+                    continue
+                updates[worker][spid] = partition.get_values(partition.changed_arrays)
+                for name in SHARED_ARRAYS:
+                    self.blocks[spid][name][:] = getattr(partition, name).get_value(borrow=True)
+                partition.changed_arrays.clear()
+        return updates
+
+    def step(self, step, updates, exchange_values=False):
+        """
+        Lets the workers set the given updates (see get_updates) and calculate the given step of their partitions,
+        and copies the results to the partitions of the node net. If exchange_values is True, the actuator values
+        are written and the sensor values are read between propagation and calculation, see PartitionShards.
+        Raises a RuntimeError and stops the workers if one of them fails.
+        """
+        for connection, worker_updates in zip(self.connections, updates):
+            connection.send((step, worker_updates, exchange_values))
+        if exchange_values:
+            self.receive_results()
+            activations = dict((spid, blocks['a']) for spid, blocks in self.blocks.items())
+            self.nodenet.set_actuator_values(activations)
+            values = self.nodenet.get_sensor_and_actuator_feedback_values()
+            for connection in self.connections:
+                connection.send(values)
+        self.receive_results()
+
+        for spid, partition in self.nodenet.partitions.items():
+            for name in SHARED_ARRAYS:
+                getattr(partition, name).set_value(self.blocks[spid][name])
+
+    def receive_results(self):
+        """ Waits for all workers to report, and raises a RuntimeError and stops them if one of them has failed """
+        errors = []
+        for connection in self.connections:
+            try:
+                error = connection.recv()
+            except EOFError:
+                error = "The partition worker process has exited"
+            if error is not None:
+                errors.append(error)
+        if errors:
+            # the other workers only report the broken barrier
+            errors.sort(key=lambda error: 'BrokenBarrierError' in error)
+            self.stop()
+            raise RuntimeError("Partition worker failed: %s" % errors[0])
+
+    def stop(self):
+        """ Ends the worker processes """
+        for connection in self.connections:
+            try:
+                connection.send(None)
+            except OSError:
+                pass
+            connection.close()
+        for process in self.processes:
+            process.join(10)
+            if process.is_alive():  # pragma: no cover
+                process.terminate()
+        self.connections = []
+        self.processes = []
+
+
+def run_worker(nodenet, spids, blocks, barrier, connection, pipes):
+    """
+    Main loop of a worker process: for every (step, updates, exchange_values) received on connection, sets the
+    updates and calculates the step of the partitions with the given spids, and answers with None or the
+    traceback of the error. With exchange_values, it also answers after propagation, and waits for the sensor
+    and actuator feedback values. Ends on None, or when the parent process has closed its end of the connection.
+    """
+    # close the inherited ends of the other pipes, so that closing the parent's end ends the worker
+    for parent_connection, worker_connection in pipes:
+        parent_connection.close()
+        if worker_connection is not connection:
+            worker_connection.close()
+
+    partitions = [nodenet.partitions[spid] for spid in spids]
+    peers = set(spid for partition in partitions for spid in partition.inlinks) - set(spids)
+
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        step, updates, exchange_values = message
+        try:
+            for spid, values in updates.items():
+                nodenet.partitions[spid].set_values(values)
+            for spid in peers:
+                nodenet.partitions[spid].a.set_value(blocks[spid]['a'])
+            barrier.wait()
+
+            nodenet._step = step
+            for partition in partitions:
+                for inlinks in partition.inlinks.values():
+                    inlinks[3]()                        # call the theano_function at [3]
+            for partition in partitions:
+                partition.flush_link_updates()
+                partition.propagate()
+        except Exception:
+            # release the workers waiting at the barrier, they report the broken barrier as their error
+            barrier.abort()
+            connection.send(traceback.format_exc())
+            continue
+
+        if exchange_values:
+            for partition in partitions:
+                blocks[partition.spid]['a'][:] = partition.a.get_value(borrow=True)
+            connection.send(None)
+            try:
+                values = connection.recv()
+            except EOFError:
+                break
+            if values is None:
+                break
+            sensor_values, actuator_feedback_values = values
+
+        try:
+            for partition in partitions:
+                if exchange_values:
+                    a_array = partition.a.get_value(borrow=True)
+                    a_array[partition.sensor_indices] = sensor_values
+                    a_array[partition.actuator_indices] = actuator_feedback_values
+                    partition.a.set_value(a_array, borrow=True)
+                partition.calculate(native_modules=False)
+                for name in SHARED_ARRAYS:
+                    blocks[partition.spid][name][:] = getattr(partition, name).get_value(borrow=True)
+                partition.compact_weights()
+        except Exception:
+            connection.send(traceback.format_exc())
+        else:
+            connection.send(None)
+    connection.close()
@@ -1,5 +1,5 @@
 
-from micropsi_core.nodenet.stepoperators import Propagate, Calculate
+from micropsi_core.nodenet.stepoperators import StepOperator, Propagate, Calculate
 import numpy as np
 from micropsi_core.nodenet.theano_engine.theano_node import *
 from micropsi_core.nodenet.theano_engine.theano_definitions import *
@@ -17,14 +17,28 @@ class TheanoPropagate(Propagate):
     """
 
     def execute(self, nodenet, nodes, netapi):
-        # propagate cross-partition to the a_in vectors
+        if nodenet.can_shard_step() or nodenet.can_fuse_step():
+            # propagation is part of the sharded or fused step, calculated by TheanoCalculate
+            return
+
+        # switching between sparse and dense w recompiles the propagation, which can not be done in parallel
         for partition in nodenet.partitions.values():
-            for inlinks in partition.inlinks.values():
-                inlinks[3]()                                # call the theano_function at [3]
+            partition.update_sparsity()
+
+        # propagate cross-partition to the a_in vectors
+        nodenet.map_partitions(self.propagate_inlinks)
 
         # then propagate internally in all partitions
-        for partition in nodenet.partitions.values():
-            partition.propagate()
+        nodenet.map_partitions(self.propagate_partition)
+
+    def propagate_inlinks(self, partition):
+        # the inlinks of a partition all add to its a_in, so they are called one after the other
+        for inlinks in partition.inlinks.values():
+            inlinks[3]()                                # call the theano_function at [3]
+
+    def propagate_partition(self, partition):
+        partition.flush_link_updates()
+        partition.propagate()
 
 
 class TheanoCalculate(Calculate):
@@ -46,22 +60,65 @@ class TheanoCalculate(Calculate):
     def write_actuators(self):
         self.nodenet.set_actuator_values()
 
+    def calculate_partition(self, partition):
+        partition.calculate(native_modules=False)
+
     def count_success_and_failure(self, nodenet):
         nays = 0
         yays = 0
         for partition in nodenet.partitions.values():
             if partition.has_pipes:
-                nays += len(np.where((partition.n_function_selector.get_value(borrow=True) == NFPG_PIPE_SUR) & (partition.a.get_value(borrow=True) <= -1))[0])
-                yays += len(np.where((partition.n_function_selector.get_value(borrow=True) == NFPG_PIPE_SUR) & (partition.a.get_value(borrow=True) >= 1))[0])
+                sur_activations = partition.a.get_value(borrow=True)[partition.get_sur_elements()]
+                nays += np.count_nonzero(sur_activations <= -1)
+                yays += np.count_nonzero(sur_activations >= 1)
         nodenet.set_modulator('base_number_of_expected_events', yays)
         nodenet.set_modulator('base_number_of_unexpected_events', nays)
 
     def execute(self, nodenet, nodes, netapi):
         self.worldadapter = nodenet.worldadapter_instance
 
-        self.write_actuators()
-        self.read_sensors_and_actuator_feedback()
-        for partition in nodenet.partitions.values():
-            partition.calculate()
+        if nodenet.can_shard_step():
+            nodenet.calculate_sharded_step()
+        else:
+            # the partitions are calculated in this process, which leaves the worker processes behind
+            nodenet.stop_partition_shards()
+            if nodenet.can_fuse_step():
+                nodenet.calculate_fused_step()
+            else:
+                self.write_actuators()
+                self.read_sensors_and_actuator_feedback()
+                if nodenet.partition_threads < 2:
+                    for partition in nodenet.partitions.values():
+                        partition.calculate()
+                else:
+                    # theano compilation is not thread safe
+                    for partition in nodenet.partitions.values():
+                        partition.compile_calculate()
+                    # native modules may access other partitions, so they are calculated after all partitions
+                    nodenet.map_partitions(self.calculate_partition)
+                    for partition in nodenet.partitions.values():
+                        partition.calculate_native_modules()
         if nodenet.use_modulators:
             self.count_success_and_failure(nodenet)
+
+
+class TheanoPorLinkDecay(StepOperator):
+    """
+        Decays the por-links of the nodespaces set with netapi.set_por_link_decay after every step,
+        by multiplying the entries of w found by partition.get_por_link_entries with (1 - base_porret_decay_factor)
+    """
+
+    @property
+    def priority(self):
+        return 2
+
+    def execute(self, nodenet, nodes, netapi):
+        if not nodenet.por_link_decay_nodespaces:
+            return
+        porretdecay = nodenet.get_modulator('base_porret_decay_factor')
+        if porretdecay == 0:
+            return
+        for nodespace_uid in nodenet.por_link_decay_nodespaces:
+            partition = nodenet.get_partition(nodespace_uid)
+            if partition.has_pipes:
+                partition.decay_por_links(nodespace_from_id(nodespace_uid), porretdecay)
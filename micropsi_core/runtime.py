@@ -56,6 +56,12 @@ custom_operations = {}
 
 netapi_consoles = {}
 
+# nodenet uids to the threads writing their background saves, to the status of their last save,
+# and to the locks that serialise starting and waiting for their saves
+save_threads = {}
+save_status = {}
+save_locks = {}
+
 from code import InteractiveConsole
 
 
@@ -469,11 +475,13 @@ def unload_nodenet(nodenet_uid):
     """
     if nodenet_uid not in nodenets:
         return False
+    wait_for_save(nodenet_uid)
     if nodenet_uid in netapi_consoles:
         del netapi_consoles[nodenet_uid]
     nodenet = nodenets[nodenet_uid]
     if nodenet.world:
         worlds[nodenet.world].unregister_nodenet(nodenet.uid)
+    nodenet.close()
     del nodenets[nodenet_uid]
     logger.unregister_logger('agent.%s' % nodenet_uid)
     return True
@@ -529,9 +537,12 @@ def delete_nodenet(nodenet_uid):
     """
     filename = os.path.join(PERSISTENCY_PATH, NODENET_DIRECTORY, nodenet_uid + '.json')
     nodenet = get_nodenet(nodenet_uid)
+    wait_for_save(nodenet_uid)
     nodenet.remove(filename)
     unload_nodenet(nodenet_uid)
     del nodenet_data[nodenet_uid]
+    save_status.pop(nodenet_uid, None)
+    save_locks.pop(nodenet_uid, None)
     return True
 
 
@@ -668,14 +679,69 @@ def revert_nodenet(nodenet_uid, also_revert_world=False):
     return True
 
 
-def save_nodenet(nodenet_uid):
-    """Stores the nodenet on the server (but keeps it open)."""
+def save_nodenet(nodenet_uid, background=False):
+    """Stores the nodenet on the server (but keeps it open).
+    With background=True, a snapshot of the nodenet is taken while holding its netlock, and written to disk
+    on a worker thread, so the nodenet can keep running in the meantime. See get_save_status."""
     nodenet = get_nodenet(nodenet_uid)
-    nodenet.save(os.path.join(PERSISTENCY_PATH, NODENET_DIRECTORY, nodenet_uid + '.json'))
-    nodenet_data[nodenet_uid] = Bunch(**nodenet.metadata)
+    filename = os.path.join(PERSISTENCY_PATH, NODENET_DIRECTORY, nodenet_uid + '.json')
+    with _get_save_lock(nodenet_uid):
+        _join_save_thread(nodenet_uid)
+        if not background:
+            nodenet.save(filename)
+            _finish_save(nodenet_uid, nodenet.metadata)
+            return True
+
+        with nodenet.netlock:
+            write = nodenet.get_save_snapshot(filename)
+            metadata = nodenet.metadata
+        save_status[nodenet_uid] = dict(get_save_status(nodenet_uid), status='saving', error=None)
+        thread = threading.Thread(target=_write_snapshot, args=(nodenet_uid, write, metadata), name="save %s" % nodenet_uid)
+        save_threads[nodenet_uid] = thread
+        thread.start()
     return True
 
 
+def _get_save_lock(nodenet_uid):
+    # setdefault is atomic, so concurrent callers always get the same lock
+    return save_locks.setdefault(nodenet_uid, threading.Lock())
+
+
+def _join_save_thread(nodenet_uid):
+    # callers hold the save lock. the thread is only forgotten once it has finished writing
+    thread = save_threads.get(nodenet_uid)
+    if thread is not None:
+        thread.join()
+        del save_threads[nodenet_uid]
+
+
+def _write_snapshot(nodenet_uid, write, metadata):
+    try:
+        write()
+    except Exception as err:
+        logging.getLogger("system").error("Could not save nodenet %s: %s" % (nodenet_uid, str(err)))
+        save_status[nodenet_uid] = dict(get_save_status(nodenet_uid), status='failed', error=str(err))
+    else:
+        _finish_save(nodenet_uid, metadata)
+
+
+def _finish_save(nodenet_uid, metadata):
+    nodenet_data[nodenet_uid] = Bunch(**metadata)
+    save_status[nodenet_uid] = {'status': 'saved', 'last_save': datetime.now().isoformat(), 'error': None}
+
+
+def wait_for_save(nodenet_uid):
+    """Waits until a background save of the given nodenet, if one is running, has been written"""
+    with _get_save_lock(nodenet_uid):
+        _join_save_thread(nodenet_uid)
+
+
+def get_save_status(nodenet_uid):
+    """Returns a dict with the status ('idle', 'saving', 'saved' or 'failed') of the last save of the given nodenet,
+    the time it has last been saved by this runtime, if at all, and the error of the last save, if it failed"""
+    return save_status.get(nodenet_uid, {'status': 'idle', 'last_save': None, 'error': None})
+
+
 def export_nodenet(nodenet_uid):
     """Exports the nodenet state to the user, so it can be viewed and exchanged.
 
@@ -1466,6 +1532,8 @@ def parse_definition(json, filename=None):
             result['config'] = json['config']
         if 'use_modulators' in json:
             result['use_modulators'] = json['use_modulators']
+        if 'compiled_functions' in json:
+            result['compiled_functions'] = json['compiled_functions']
         return Bunch(**result)
 
 
@@ -1484,6 +1552,22 @@ def load_definitions():
     return nodenet_data, world_data
 
 
+def warm_up_compiled_functions():
+    """Compiles the theano functions used by the saved theano_engine nodenets, so that their first step
+    after loading does not wait for the compiler"""
+    keys = []
+    for uid in nodenet_data:
+        if nodenet_data[uid].get('engine') == 'theano_engine':
+            keys.extend(nodenet_data[uid].get('compiled_functions', []))
+    if keys:
+        try:
+            from micropsi_core.nodenet.theano_engine.theano_nodenet import warm_up_compiled_functions as warm_up
+        except ImportError as e:
+            logging.getLogger('system').warn("Could not warm up the theano_engine: %s" % str(e))
+            return
+        warm_up(keys)
+
+
 # set up all worlds referred to in the world_data:
 def init_worlds(world_data):
     global worlds
@@ -1689,6 +1773,9 @@ def initialize(persistency_path=None, resource_path=None):
     for e in errors:
         logging.getLogger("system").error(e)
 
+    if 'theano' in cfg and cfg['theano'].get('warm_up_compiled_functions', 'True') == 'True':
+        warm_up_compiled_functions()
+
     # initialize runners
     # Initialize the threads for the continuous calculation of nodenets and worlds
     if 'runner_timestep' not in configs:
@@ -6,6 +6,7 @@ Tests for netapi, i.e. the interface native modules will be developed against
 """
 
 import pytest
+import numpy as np
 from micropsi_core import runtime as micropsi
 
 
@@ -984,6 +985,82 @@ def test_set_link_weights(fixed_nodenet):
     assert len(netapi.get_node(sepp2.uid).get_gate('gen').get_links()) == 1
 
 
+@pytest.mark.engine("theano_engine")
+def test_weight_block(fixed_nodenet):
+    net, netapi, source = prepare(fixed_nodenet)
+    sepp1 = netapi.create_node("Register", None, "sepp1")
+    sepp2 = netapi.create_node("Register", None, "sepp2")
+    netapi.group_nodes_by_names(None, node_name_prefix="sepp")
+    hugo1 = netapi.create_node("Register", None, "hugo1")
+    hugo2 = netapi.create_node("Register", None, "hugo2")
+    netapi.group_nodes_by_names(None, node_name_prefix="hugo")
+    netapi.link(sepp2, "gen", hugo1, "gen", 0.4)
+
+    netapi.register_weight_block(None, "sepp", None, "hugo")
+    w = netapi.get_link_weights(None, "sepp", None, "hugo")
+    assert round(float(w[0, 1]), 2) == 0.4
+
+    new_w = w.copy()
+    new_w[0, 1] = 0.6
+    new_w[1, 0] = 0.5
+    netapi.set_link_weights(None, "sepp", None, "hugo", new_w)
+    assert netapi.get_link_weights(None, "sepp", None, "hugo") is w
+    assert round(float(w[1, 0]), 2) == 0.5
+    assert round(float(netapi.get_node(sepp2.uid).get_gate('gen').get_links()[0].weight), 2) == 0.6
+    assert netapi.get_node(sepp1.uid).get_gate('gen').get_links()[0].target_node.uid == hugo2.uid
+
+    # changes of single links show up in the block
+    netapi.link(sepp1, "gen", hugo1, "gen", 0.3)
+    assert round(float(netapi.get_link_weights(None, "sepp", None, "hugo")[0, 0]), 2) == 0.3
+
+    # and links set to 0 are removed
+    new_w[0, 1] = 0
+    netapi.set_link_weights(None, "sepp", None, "hugo", new_w)
+    assert len(netapi.get_node(sepp2.uid).get_gate('gen').get_links()) == 0
+
+
+@pytest.mark.engine("theano_engine")
+def test_weight_block_after_other_link_changes(fixed_nodenet):
+    net, netapi, source = prepare(fixed_nodenet)
+    sepp1 = netapi.create_node("Register", None, "sepp1")
+    sepp2 = netapi.create_node("Register", None, "sepp2")
+    netapi.group_nodes_by_names(None, node_name_prefix="sepp")
+    hugo1 = netapi.create_node("Register", None, "hugo1")
+    hugo2 = netapi.create_node("Register", None, "hugo2")
+    netapi.group_nodes_by_names(None, node_name_prefix="hugo")
+    otto1 = netapi.create_node("Register", None, "otto1")
+    otto2 = netapi.create_node("Register", None, "otto2")
+    netapi.group_nodes_by_names(None, node_name_prefix="otto")
+    netapi.link(sepp2, "gen", hugo1, "gen", 0.4)
+    netapi.link(sepp1, "gen", hugo2, "gen", 0.7)
+    netapi.link(source, "gen", hugo2, "gen", 0.2)
+    netapi.register_weight_block(None, "sepp", None, "hugo")
+    assert round(float(netapi.get_link_weights(None, "sepp", None, "hugo")[0, 1]), 2) == 0.4
+
+    # links between other groups are inserted into w in place
+    netapi.set_link_weights(None, "sepp", None, "otto", np.array([[0.1, 0.2], [0.3, 0.0]]))
+    w = netapi.get_link_weights(None, "sepp", None, "hugo")
+    assert [[round(float(value), 2) for value in row] for row in w] == [[0, 0.4], [0.7, 0]]
+
+    new_w = np.array([[0.5, 0.6], [0.8, 0.0]])
+    netapi.set_link_weights(None, "sepp", None, "hugo", new_w)
+    weights = dict(((link.source_node.uid, link.target_node.uid), round(float(link.weight), 2)) for node in [sepp1, sepp2] for link in node.get_gate('gen').get_links())
+    assert weights == {
+        (sepp1.uid, hugo1.uid): 0.5, (sepp2.uid, hugo1.uid): 0.6, (sepp1.uid, hugo2.uid): 0.8,
+        (sepp1.uid, otto1.uid): 0.1, (sepp2.uid, otto1.uid): 0.2, (sepp1.uid, otto2.uid): 0.3}
+
+    # removing the links of a node writes explicit zeros into w in place
+    netapi.delete_node(source)
+    w = netapi.get_link_weights(None, "sepp", None, "hugo")
+    assert [[round(float(value), 2) for value in row] for row in w] == [[0.5, 0.6], [0.8, 0]]
+    new_w[0, 0] = 0.9
+    netapi.set_link_weights(None, "sepp", None, "hugo", new_w)
+    weights = dict(((link.source_node.uid, link.target_node.uid), round(float(link.weight), 2)) for node in [sepp1, sepp2] for link in node.get_gate('gen').get_links())
+    assert weights[(sepp1.uid, hugo1.uid)] == 0.9
+    assert weights[(sepp1.uid, otto1.uid)] == 0.1
+    assert weights[(sepp2.uid, otto1.uid)] == 0.2
+
+
 def test_get_node_ids(fixed_nodenet):
     net, netapi, source = prepare(fixed_nodenet)
     sepp1 = netapi.create_node("Register", None, "sepp1")
@@ -1085,6 +1162,52 @@ def test_decay_porret_links(test_nodenet):
     assert round(pipes[7].get_gate('ret').get_links()[0].weight, 3) == 0.7
 
 
+@pytest.mark.engine("theano_engine")
+def test_por_link_decay_step_operator(test_nodenet):
+    nodenet = micropsi.get_nodenet(test_nodenet)
+    netapi = nodenet.netapi
+    netapi.set_modulator('base_porret_decay_factor', 0.1)
+    source = netapi.create_node("Pipe", None, "source")
+    target = netapi.create_node("Pipe", None, "target")
+    netapi.link_with_reciprocal(source, target, 'porret', weight=0.5)
+    netapi.set_por_link_decay(None)
+    micropsi.step_nodenet(test_nodenet)
+    assert round(source.get_gate('por').get_links()[0].weight, 3) == 0.45
+
+    # links created later are decayed as well
+    netapi.link(target, 'por', source, 'gen', weight=1)
+    micropsi.step_nodenet(test_nodenet)
+    assert round(source.get_gate('por').get_links()[0].weight, 4) == 0.405
+    assert round(target.get_gate('por').get_links()[0].weight, 3) == 0.9
+    assert round(target.get_gate('ret').get_links()[0].weight, 3) == 0.5
+
+    netapi.set_por_link_decay(None, False)
+    micropsi.step_nodenet(test_nodenet)
+    assert round(target.get_gate('por').get_links()[0].weight, 3) == 0.9
+
+
+@pytest.mark.engine("theano_engine")
+def test_por_link_decay_with_int8_weight_storage(test_nodenet):
+    nodenet = micropsi.get_nodenet(test_nodenet)
+    netapi = nodenet.netapi
+    # a decay by less than half an int8 step of the weight would be rounded away if the weights were stored as int8
+    netapi.set_modulator('base_porret_decay_factor', 0.001)
+    nodespace = netapi.create_nodespace(None, name="int8", options={'new_partition': True, 'weight_storage': 'int8'})
+    source = netapi.create_node("Pipe", nodespace.uid, "source")
+    target = netapi.create_node("Pipe", nodespace.uid, "target")
+    netapi.link_with_reciprocal(source, target, 'porret', weight=0.5)
+    netapi.set_por_link_decay(nodespace.uid)
+    for i in range(3):
+        micropsi.step_nodenet(test_nodenet)
+    assert round(source.get_gate('por').get_links()[0].weight, 4) == 0.4985
+    assert nodenet.get_weight_storage_report()[nodespace.partition.spid]['expanded']
+
+    # without por-link decay, the weights are stored as int8 again
+    netapi.set_por_link_decay(nodespace.uid, False)
+    micropsi.step_nodenet(test_nodenet)
+    assert not nodenet.get_weight_storage_report()[nodespace.partition.spid]['expanded']
+
+
 def test_unlink_gate(test_nodenet):
     nodenet = micropsi.get_nodenet(test_nodenet)
     netapi = nodenet.netapi
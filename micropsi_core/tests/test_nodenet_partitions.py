@@ -1,6 +1,26 @@
 
+import numpy as np
 import pytest
 from micropsi_core import runtime as micropsi
+from micropsi_core.world.worldadapter import ArrayWorldAdapter
+
+
+class ArrayAdapter(ArrayWorldAdapter):
+    def get_available_datasources(self):
+        return ['foo', 'bar']
+
+    def get_available_datatargets(self):
+        return ['baz']
+
+    def update_data_sources_and_targets(self):
+        pass
+
+
+class EchoAdapter(ArrayAdapter):
+    """ Reports the value written to its datatarget as the value of its bar datasource right away """
+    def set_datatarget_values(self, values):
+        super(EchoAdapter, self).set_datatarget_values(values)
+        self.datasource_values[1] = values[0]
 
 
 def prepare(netapi, partition_options={}):
@@ -267,6 +287,44 @@ def test_sensor_actuator_indices(test_nodenet):
     assert set(nodenet.rootpartition.sensor_indices) == {0}
 
 
+@pytest.mark.engine("theano_engine")
+def test_array_worldadapter_value_buffers(test_nodenet):
+    nodenet = micropsi.get_nodenet(test_nodenet)
+    netapi = nodenet.netapi
+    result, world_uid = micropsi.new_world('default', 'World')
+    adapter = ArrayAdapter(micropsi.worlds[world_uid])
+    nodenet.worldadapter_instance = adapter
+    sensor = netapi.create_node("Sensor", None, "bar_sensor")
+    sensor.set_parameter("datasource", "bar")
+    actor = netapi.create_node("Actor", None, "baz_actor")
+    actor.set_parameter("datatarget", "baz")
+    register = netapi.create_node("Register", None, "source")
+    register.activation = 0.7
+    netapi.link(register, 'gen', register, 'gen')
+    netapi.link(register, 'gen', actor, 'gen')
+
+    # the adapter's datasource array is a view on the nodenet's buffer and is filled in place
+    assert np.may_share_memory(adapter.datasource_values, nodenet.sensor_values)
+    adapter.datasource_values[:] = [0.3, 0.6]
+    micropsi.step_nodenet(test_nodenet)
+    micropsi.step_nodenet(test_nodenet)
+    assert round(sensor.activation, 3) == 0.6
+
+    # the datatarget values are copied into the adapter's own array, unaffected by the nodenet reusing its buffer
+    datatarget_values = adapter.datatarget_values
+    assert not np.may_share_memory(datatarget_values, nodenet.actuator_values)
+    assert round(float(datatarget_values[0]), 3) == 0.7
+    nodenet.actuator_values.fill(0)
+    assert round(float(datatarget_values[0]), 3) == 0.7
+    micropsi.step_nodenet(test_nodenet)
+    assert adapter.datatarget_values is datatarget_values
+
+    # adapters that replace their arrays are still read
+    adapter.datasource_values = np.array([0.3, 0.2])
+    micropsi.step_nodenet(test_nodenet)
+    assert round(sensor.activation, 3) == 0.2
+
+
 def test_partition_get_node_data(test_nodenet):
     nodenet = micropsi.get_nodenet(test_nodenet)
     netapi = nodenet.netapi
@@ -299,3 +357,533 @@ def test_partition_get_node_data(test_nodenet):
     assert len(node_data.keys()) == 12
     assert node_data[n4.uid]['links'] == {}
     assert third.uid not in node_data
+
+
+@pytest.mark.engine("theano_engine")
+def test_link_bulk(test_nodenet):
+    nodenet = micropsi.get_nodenet(test_nodenet)
+    netapi = nodenet.netapi
+    nodespace, source, register = prepare(netapi)
+    pipes = [netapi.create_node("Pipe", None, "pipe %d" % i) for i in range(3)]
+    remote = netapi.create_node("Register", nodespace.uid, "remote")
+
+    netapi.link_bulk(
+        [source.uid, pipes[0].uid, pipes[1].uid, source.uid],
+        ['gen', 'por', 'sub', 'gen'],
+        [pipes[0].uid, pipes[1].uid, pipes[2].uid, remote.uid],
+        ['gen', 'por', 'sub', 'gen'],
+        [0.5, 1, 1, 0.3])
+
+    assert round(pipes[0].get_slot('gen').get_links()[0].weight, 3) == 0.5
+    assert pipes[1].get_slot('por').get_links()[0].source_node.uid == pipes[0].uid
+    assert pipes[2].get_slot('sub').get_links()[0].source_node.uid == pipes[1].uid
+    assert round(remote.get_slot('gen').get_links()[0].weight, 3) == 0.3
+    assert len(source.get_gate('gen').get_links()) == 4
+    nodenet.step()
+    assert round(remote.activation, 3) == 0.3
+
+    netapi.unlink_bulk([source.uid, source.uid], 'gen', [pipes[0].uid, remote.uid], 'gen')
+    assert pipes[0].get_slot('gen').empty
+    assert remote.get_slot('gen').empty
+    assert len(source.get_gate('gen').get_links()) == 2
+
+    with pytest.raises(ValueError):
+        netapi.link_bulk([source.uid], ['foo'], [register.uid], ['gen'])
+
+
+@pytest.mark.engine("theano_engine")
+def test_outgoing_links_follow_link_changes(test_nodenet):
+    nodenet = micropsi.get_nodenet(test_nodenet)
+    netapi = nodenet.netapi
+    nodespace, source, register = prepare(netapi)
+    partition = nodenet.rootpartition
+    target = netapi.create_node("Register", None, "target")
+    netapi.link(source, 'gen', target, 'gen', weight=0.5)
+    assert len(source.get_gate('gen').get_links()) == 3
+    w_columns = partition.get_w_columns()
+    assert partition.get_w_columns() is w_columns
+    netapi.unlink(source, 'gen', target, 'gen')
+    assert len(netapi.get_node(source.uid).get_gate('gen').get_links()) == 2
+    assert target.uid not in netapi.get_node(source.uid).get_associated_node_uids()
+
+
+@pytest.mark.engine("theano_engine")
+def test_sparse_inlinks(test_nodenet):
+    import scipy.sparse as sp
+    nodenet = micropsi.get_nodenet(test_nodenet)
+    netapi = nodenet.netapi
+    nodespace, source, register = prepare(netapi)
+    sources = [netapi.create_node("Register", None, "source %d" % i).uid for i in range(100)]
+    targets = [netapi.create_node("Register", nodespace.uid, "target %d" % i).uid for i in range(100)]
+    # a diagonal between 100 x 100 elements is sparse enough to be stored as a sparse matrix
+    netapi.link_bulk(sources, 'gen', targets, 'gen', 0.5)
+    inlinks = nodespace.partition.inlinks[nodenet.rootpartition.spid]
+    assert sp.issparse(inlinks[2].get_value())
+    for uid in sources:
+        netapi.get_node(uid).activation = 1
+    nodenet.step()
+    assert round(netapi.get_node(targets[42]).activation, 3) == 0.5
+    assert round(netapi.get_node(targets[42]).get_slot('gen').get_links()[0].weight, 3) == 0.5
+
+    micropsi.save_nodenet(test_nodenet)
+    micropsi.revert_nodenet(test_nodenet)
+    nodenet = micropsi.get_nodenet(test_nodenet)
+    netapi = nodenet.netapi
+    link = netapi.get_node(targets[42]).get_slot('gen').get_links()[0]
+    assert link.source_node.uid == sources[42]
+    assert round(link.weight, 3) == 0.5
+    netapi.delete_node(netapi.get_node(targets[42]))
+    assert netapi.get_node(sources[42]).get_gate('gen').empty
+
+
+@pytest.mark.engine("theano_engine")
+def test_fused_step_matches_partition_step(test_nodenet):
+    nodenet = micropsi.get_nodenet(test_nodenet)
+    netapi = nodenet.netapi
+    nodespace, source, register = prepare(netapi)
+    parent = netapi.create_node("Pipe", nodespace.uid, "Parent")
+    child = netapi.create_node("Pipe", nodespace.uid, "Child")
+    target = netapi.create_node("Register", None, "Target")
+    netapi.link(source, 'gen', parent, 'sub')
+    netapi.link_with_reciprocal(parent, child, 'subsur')
+    netapi.link(child, 'sur', target, 'gen', weight=0.5)
+    netapi.link(register, 'gen', target, 'gen', weight=0.3)
+
+    # the actuator value is the sensor value of the same step: both paths need to write actuators before reading sensors
+    result, world_uid = micropsi.new_world('default', 'World')
+    nodenet.worldadapter_instance = EchoAdapter(micropsi.worlds[world_uid])
+    sensor = netapi.create_node("Sensor", nodespace.uid, "bar_sensor")
+    sensor.set_parameter("datasource", "bar")
+    actor = netapi.create_node("Actor", None, "baz_actor")
+    actor.set_parameter("datatarget", "baz")
+    netapi.link(target, 'gen', actor, 'gen')
+    netapi.link(sensor, 'gen', child, 'gen', weight=0.4)
+    uids = [source.uid, register.uid, parent.uid, child.uid, target.uid, sensor.uid, actor.uid]
+    micropsi.save_nodenet(test_nodenet)
+
+    assert nodenet.can_fuse_step()
+    fused = []
+    for i in range(5):
+        nodenet.step()
+        fused.append([netapi.get_node(uid).activation for uid in uids])
+    assert any(values[5] != 0 for values in fused)
+
+    micropsi.revert_nodenet(test_nodenet)
+    nodenet = micropsi.get_nodenet(test_nodenet)
+    nodenet.worldadapter_instance = EchoAdapter(micropsi.worlds[world_uid])
+    netapi = nodenet.netapi
+    nodenet.fuse_steps = False
+    for i in range(5):
+        nodenet.step()
+        assert [round(netapi.get_node(uid).activation, 4) for uid in uids] == [round(value, 4) for value in fused[i]]
+
+
+@pytest.mark.engine("theano_engine")
+def test_partition_threads_match_serial_step(test_nodenet):
+    nodenet = micropsi.get_nodenet(test_nodenet)
+    netapi = nodenet.netapi
+    nodespace, source, register = prepare(netapi)
+    other = netapi.create_nodespace(None, name="other", options={'new_partition': True})
+    pipe = netapi.create_node("Pipe", other.uid, "Pipe")
+    target = netapi.create_node("Register", None, "Target")
+    netapi.link(source, 'gen', pipe, 'sub', weight=0.8)
+    netapi.link(register, 'gen', target, 'gen', weight=0.3)
+    netapi.link(pipe, 'sub', target, 'gen', weight=0.5)
+    uids = [source.uid, register.uid, pipe.uid, target.uid]
+    micropsi.save_nodenet(test_nodenet)
+
+    nodenet.fuse_steps = False
+    serial = []
+    for i in range(4):
+        nodenet.step()
+        serial.append([netapi.get_node(uid).activation for uid in uids])
+
+    micropsi.revert_nodenet(test_nodenet)
+    nodenet = micropsi.get_nodenet(test_nodenet)
+    netapi = nodenet.netapi
+    nodenet.fuse_steps = False
+    nodenet.partition_threads = 3
+    for i in range(4):
+        nodenet.step()
+        assert [netapi.get_node(uid).activation for uid in uids] == serial[i]
+    pool = nodenet.partition_pool
+    assert pool is not None
+
+    # reloaded node nets reuse the worker threads instead of starting new ones
+    micropsi.revert_nodenet(test_nodenet)
+    nodenet = micropsi.get_nodenet(test_nodenet)
+    nodenet.fuse_steps = False
+    nodenet.partition_threads = 3
+    nodenet.step()
+    assert nodenet.partition_pool is pool
+
+
+@pytest.mark.engine("theano_engine")
+def test_partition_processes_match_serial_step(test_nodenet):
+    nodenet = micropsi.get_nodenet(test_nodenet)
+    netapi = nodenet.netapi
+    nodespace, source, register = prepare(netapi)
+    other = netapi.create_nodespace(None, name="other", options={'new_partition': True})
+    pipe = netapi.create_node("Pipe", other.uid, "Pipe")
+    target = netapi.create_node("Register", None, "Target")
+    netapi.link(source, 'gen', pipe, 'sub', weight=0.8)
+    netapi.link(register, 'gen', target, 'gen', weight=0.3)
+    netapi.link(pipe, 'sub', target, 'gen', weight=0.5)
+    uids = [source.uid, register.uid, pipe.uid, target.uid]
+    micropsi.save_nodenet(test_nodenet)
+
+    nodenet.fuse_steps = False
+    serial = []
+    for i in range(4):
+        nodenet.step()
+        serial.append([netapi.get_node(uid).activation for uid in uids])
+
+    micropsi.revert_nodenet(test_nodenet)
+    nodenet = micropsi.get_nodenet(test_nodenet)
+    netapi = nodenet.netapi
+    nodenet.partition_processes = 2
+    assert nodenet.can_shard_step()
+    for i in range(4):
+        nodenet.step()
+        assert [netapi.get_node(uid).activation for uid in uids] == serial[i]
+    shards = nodenet.partition_shards
+    processes = list(shards.processes)
+    assert len(processes) == 2
+    assert all(process.is_alive() for process in processes)
+
+    # changed weights and activations are sent to the running workers
+    netapi.link(source, 'gen', source, 'gen', weight=0.5)
+    nodenet.step()
+    assert netapi.get_node(source.uid).activation == 0.5
+    netapi.get_node(source.uid).activation = 0
+    nodenet.step()
+    assert netapi.get_node(register.uid).activation == 0
+    assert nodenet.partition_shards is shards
+    assert all(process.is_alive() for process in processes)
+
+    # new nodes restart the workers
+    netapi.create_node("Register", other.uid, "New")
+    nodenet.step()
+    assert nodenet.partition_shards is not shards
+    assert not any(process.is_alive() for process in processes)
+
+    # unloading the node net ends its workers
+    processes = list(nodenet.partition_shards.processes)
+    micropsi.revert_nodenet(test_nodenet)
+    assert not any(process.is_alive() for process in processes)
+
+
+@pytest.mark.engine("theano_engine")
+def test_partition_processes_exchange_sensor_and_actuator_values(test_nodenet):
+    nodenet = micropsi.get_nodenet(test_nodenet)
+    netapi = nodenet.netapi
+    nodespace, source, register = prepare(netapi)
+    target = netapi.create_node("Register", None, "Target")
+    netapi.link(register, 'gen', target, 'gen', weight=0.3)
+    result, world_uid = micropsi.new_world('default', 'World')
+    nodenet.worldadapter_instance = EchoAdapter(micropsi.worlds[world_uid])
+    sensor = netapi.create_node("Sensor", nodespace.uid, "bar_sensor")
+    sensor.set_parameter("datasource", "bar")
+    actor = netapi.create_node("Actor", None, "baz_actor")
+    actor.set_parameter("datatarget", "baz")
+    netapi.link(target, 'gen', actor, 'gen')
+    netapi.link(sensor, 'gen', register, 'gen', weight=0.4)
+    uids = [source.uid, register.uid, target.uid, sensor.uid, actor.uid]
+    micropsi.save_nodenet(test_nodenet)
+
+    nodenet.fuse_steps = False
+    serial = []
+    for i in range(5):
+        nodenet.step()
+        serial.append([netapi.get_node(uid).activation for uid in uids])
+    assert any(values[3] != 0 for values in serial)
+
+    micropsi.revert_nodenet(test_nodenet)
+    nodenet = micropsi.get_nodenet(test_nodenet)
+    nodenet.worldadapter_instance = EchoAdapter(micropsi.worlds[world_uid])
+    netapi = nodenet.netapi
+    nodenet.partition_processes = 2
+    assert nodenet.can_shard_step()
+    for i in range(5):
+        nodenet.step()
+        assert [round(netapi.get_node(uid).activation, 4) for uid in uids] == [round(value, 4) for value in serial[i]]
+    assert nodenet.partition_shards is not None
+    micropsi.revert_nodenet(test_nodenet)
+
+
+@pytest.mark.engine("theano_engine")
+def test_run_steps_matches_single_steps(test_nodenet):
+    # modulators need python between the steps, so reload the net without them
+    micropsi.get_nodenet(test_nodenet).use_modulators = False
+    micropsi.save_nodenet(test_nodenet)
+    micropsi.revert_nodenet(test_nodenet)
+    nodenet = micropsi.get_nodenet(test_nodenet)
+    netapi = nodenet.netapi
+    nodespace, source, register = prepare(netapi)
+    parent = netapi.create_node("Pipe", nodespace.uid, "Parent")
+    child = netapi.create_node("Pipe", nodespace.uid, "Child")
+    netapi.link(source, 'gen', parent, 'sub')
+    netapi.link_with_reciprocal(parent, child, 'subsur')
+    uids = [register.uid, parent.uid, child.uid]
+    micropsi.save_nodenet(test_nodenet)
+
+    assert nodenet.can_run_steps()
+    scanned = nodenet.run_steps(5, uids)
+    assert nodenet.current_step == 5
+    assert scanned[parent.uid].shape == (5, 7)
+    final = [netapi.get_node(node_uid).activation for node_uid in uids]
+
+    micropsi.revert_nodenet(test_nodenet)
+    nodenet = micropsi.get_nodenet(test_nodenet)
+    netapi = nodenet.netapi
+    nodenet.fuse_steps = False
+    stepped = nodenet.run_steps(5, uids)
+    assert nodenet.current_step == 5
+    for node_uid in uids:
+        assert np.allclose(scanned[node_uid], stepped[node_uid])
+    assert np.allclose(final, [netapi.get_node(node_uid).activation for node_uid in uids])
+
+
+@pytest.mark.engine("theano_engine")
+def test_activation_snapshot(test_nodenet):
+    nodenet = micropsi.get_nodenet(test_nodenet)
+    netapi = nodenet.netapi
+    nodespace, source, register = prepare(netapi)
+    pipe = netapi.create_node("Pipe", nodespace.uid, "Pipe")
+    netapi.link(source, 'gen', pipe, 'sub')
+    nodenet.step()
+    nodenet.step()
+
+    ids, offsets, counts, activations = nodenet.get_activation_snapshot([nodespace.uid])[nodespace.partition.spid]
+    assert sorted(counts.tolist()) == [1, 7]
+    position = ids.tolist().index(int(pipe.uid[4:]))
+    assert activations[offsets[position] + 3] == pipe.get_gate('sub').activation
+
+    data = micropsi.get_nodenet_activation_data(test_nodenet, nodespaces=[nodespace.uid])['activations']
+    assert set(data.keys()) == {register.uid, pipe.uid}
+    assert data[register.uid] == [1.0]
+    assert data[pipe.uid] == [round(pipe.get_gate(gate).activation, 1) for gate in pipe.get_gate_types()]
+
+
+@pytest.mark.engine("theano_engine")
+def test_npy_partition_storage(test_nodenet):
+    import os
+    import json
+    nodenet = micropsi.get_nodenet(test_nodenet)
+    netapi = nodenet.netapi
+    nodespace, source, register = prepare(netapi)
+    netapi.link(source, 'gen', register, 'gen', weight=0.5)
+    nodenet.step()
+    nodenet.partition_storage = "npy"
+    micropsi.save_nodenet(test_nodenet)
+
+    directory = os.path.join(micropsi.PERSISTENCY_PATH, micropsi.NODENET_DIRECTORY)
+    with open(os.path.join(directory, test_nodenet + '.json')) as fp:
+        layout = json.load(fp)['partition_storage']
+    assert layout['format'] == 'npy'
+    for spid, datafilename in layout['partitions'].items():
+        assert os.path.isdir(os.path.join(directory, datafilename))
+
+    micropsi.revert_nodenet(test_nodenet)
+    nodenet = micropsi.get_nodenet(test_nodenet)
+    source = nodenet.get_node(source.uid)
+    register = nodenet.get_node(register.uid)
+    assert source.activation == 1
+    assert register.activation == 0.5
+    link = register.get_slot('gen').get_links()[0]
+    assert round(link.weight, 3) == 0.5
+    nodenet.step()
+    assert register.activation == 0.5
+
+
+@pytest.mark.engine("theano_engine")
+def test_npy_partition_storage_saves_changed_arrays(test_nodenet):
+    import os
+    import json
+    nodenet = micropsi.get_nodenet(test_nodenet)
+    netapi = nodenet.netapi
+    nodespace, source, register = prepare(netapi)
+    nodenet.partition_storage = "npy"
+    nodenet.checkpoint_compaction_interval = 2
+    micropsi.save_nodenet(test_nodenet)
+
+    directory = os.path.join(micropsi.PERSISTENCY_PATH, micropsi.NODENET_DIRECTORY)
+    datafilename = os.path.join(directory, test_nodenet + "-data-" + nodespace.partition.spid)
+
+    def get_manifest():
+        with open(os.path.join(datafilename, "manifest.json")) as fp:
+            return json.load(fp)
+
+    full = get_manifest()
+    micropsi.save_nodenet(test_nodenet)
+    assert get_manifest() == full
+
+    netapi.link(source, 'gen', register, 'gen', weight=0.3)
+    micropsi.save_nodenet(test_nodenet)
+    delta = get_manifest()
+    assert delta['deltas'] == 1
+    changed = [key for key in full['arrays'] if delta['arrays'][key] != full['arrays'][key]]
+    assert set(changed) == {'inlink_pids', 'inlink_from_lengths', 'inlink_to_lengths', 'inlink_weight_lengths', 'inlink_from_elements',
+                            'inlink_to_elements', 'inlink_weight_rows', 'inlink_weight_cols', 'inlink_weight_data'}
+
+    nodenet.step()
+    micropsi.save_nodenet(test_nodenet)
+    compacted = get_manifest()
+    assert compacted['deltas'] == 0
+    assert sorted(os.listdir(datafilename)) == sorted(list(compacted['arrays'].values()) + ["manifest.json"])
+
+    micropsi.revert_nodenet(test_nodenet)
+    nodenet = micropsi.get_nodenet(test_nodenet)
+    link = nodenet.get_node(register.uid).get_slot('gen').get_links()[0]
+    assert round(link.weight, 3) == 0.3
+
+
+@pytest.mark.engine("theano_engine")
+def test_quantized_weight_storage(test_nodenet):
+    nodenet = micropsi.get_nodenet(test_nodenet)
+    netapi = nodenet.netapi
+    nodespace = netapi.create_nodespace(None, name="int8", options={'new_partition': True, 'weight_storage': 'int8'})
+    source = netapi.create_node('Register', nodespace.uid, "Source")
+    first = netapi.create_node('Register', nodespace.uid, "First")
+    second = netapi.create_node('Register', nodespace.uid, "Second")
+    netapi.link(source, 'gen', first, 'gen', weight=0.8)
+    netapi.link(second, 'gen', first, 'gen', weight=-0.31)
+    netapi.link(source, 'gen', second, 'gen', weight=0.001)
+
+    report = nodenet.get_weight_storage_report()[nodespace.partition.spid]
+    assert report['weight_storage'] == 'int8'
+    assert report['links'] == 3
+    assert report['bytes'] < report['full_bytes'] + nodespace.partition.NoE * 4
+    assert report['max_error'] <= 0.8 / 254 + 1e-6
+    assert report['expanded']
+
+    # between steps, only the int8 weights are kept in memory
+    nodenet.step()
+    report = nodenet.get_weight_storage_report()[nodespace.partition.spid]
+    assert not report['expanded']
+    assert report['links'] == 3
+    itemsize = report['full_bytes'] // 3
+    assert report['bytes'] == 3 + nodespace.partition.NoE * itemsize
+    weights = dict((link.source_node.uid, link.weight) for link in nodenet.get_node(first.uid).get_slot('gen').get_links())
+    assert round(weights[source.uid], 2) == 0.8
+    assert nodenet.get_weight_storage_report()[nodespace.partition.spid]['expanded']
+
+    micropsi.save_nodenet(test_nodenet)
+    micropsi.revert_nodenet(test_nodenet)
+    nodenet = micropsi.get_nodenet(test_nodenet)
+    partition = nodenet.get_nodespace(nodespace.uid).partition
+    assert partition.weight_storage == 'int8'
+    assert not partition.get_weight_storage_report()['expanded']
+    weights = dict((link.source_node.uid, link.weight) for link in nodenet.get_node(first.uid).get_slot('gen').get_links())
+    assert round(weights[source.uid], 2) == 0.8
+    assert round(weights[second.uid], 2) == -0.31
+    assert round(nodenet.get_node(second.uid).get_slot('gen').get_links()[0].weight, 4) == 0.001
+
+    with pytest.raises(ValueError):
+        netapi.create_nodespace(None, name="invalid", options={'new_partition': True, 'weight_storage': 'int4'})
+
+
+@pytest.mark.engine("theano_engine")
+def test_automatic_weight_matrix_sparsity(test_nodenet):
+    nodenet = micropsi.get_nodenet(test_nodenet)
+    netapi = nodenet.netapi
+    nodespace = netapi.create_nodespace(None, name="auto", options={'new_partition': True, 'sparse': 'auto', 'initial_number_of_nodes': 3, 'average_elements_per_node_assumption': 1})
+    partition = nodespace.partition
+    registers = [netapi.create_node('Register', nodespace.uid, "Register %d" % i) for i in range(3)]
+    assert partition.sparse
+
+    # linking all registers with each other makes the weight matrix dense enough to switch
+    for source in registers:
+        for target in registers:
+            netapi.link(source, 'gen', target, 'gen', weight=0.5)
+    registers[0].activation = 1
+    micropsi.step_nodenet(test_nodenet)
+    assert not partition.sparse
+    assert registers[1].activation == 0.5
+    assert len(registers[1].get_slot('gen').get_links()) == 3
+
+    micropsi.save_nodenet(test_nodenet)
+    micropsi.revert_nodenet(test_nodenet)
+    nodenet = micropsi.get_nodenet(test_nodenet)
+    netapi = nodenet.netapi
+    partition = nodenet.get_nodespace(nodespace.uid).partition
+    assert partition.auto_sparse
+    registers = [nodenet.get_node(register.uid) for register in registers]
+    assert len(registers[1].get_slot('gen').get_links()) == 3
+
+    # removing most links switches back to a sparse weight matrix
+    for source in registers[1:]:
+        for target in registers:
+            netapi.unlink(source, 'gen', target, 'gen')
+    netapi.unlink(registers[0], 'gen', registers[1], 'gen')
+    micropsi.step_nodenet(test_nodenet)
+    assert partition.sparse
+    assert sorted(link.target_node.uid for link in registers[0].get_gate('gen').get_links()) == sorted([registers[0].uid, registers[2].uid])
+
+
+@pytest.mark.engine("theano_engine")
+def test_proxy_cache_size(test_nodenet):
+    nodenet = micropsi.get_nodenet(test_nodenet)
+    netapi = nodenet.netapi
+    nodenet.proxycache.clear()
+    nodenet.proxycache.maxsize = 5
+    registers = [netapi.create_node('Register', None, "Register %d" % i) for i in range(10)]
+    for register in registers:
+        nodenet.get_node(register.uid)
+    assert len(nodenet.proxycache) == 5
+    assert registers[0].uid not in nodenet.proxycache
+    assert registers[9].uid in nodenet.proxycache
+
+    # evicted proxies are recreated on access
+    node = nodenet.get_node(registers[0].uid)
+    assert node.name == "Register 0"
+    assert registers[0].uid in nodenet.proxycache
+    assert len(nodenet.proxycache) == 5
+
+    # proxies evicted by other threads between lookups do not make get_node fail
+    import threading
+    errors = []
+
+    def get_nodes():
+        try:
+            for i in range(200):
+                for register in registers:
+                    nodenet.get_node(register.uid)
+        except KeyError as err:
+            errors.append(err)
+    threads = [threading.Thread(target=get_nodes) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert len(nodenet.proxycache) == 5
+
+
+@pytest.mark.engine("theano_engine")
+def test_compiled_function_cache(test_nodenet):
+    from micropsi_core.nodenet.theano_engine.theano_partition import compiled_functions
+    from micropsi_core.nodenet.theano_engine.theano_nodenet import warm_up_compiled_functions
+    nodenet = micropsi.get_nodenet(test_nodenet)
+    netapi = nodenet.netapi
+    nodespace, source, register = prepare(netapi)
+    partition = nodespace.partition
+
+    # partitions using the same features share their compiled functions
+    assert partition.get_compiled_function_keys() == nodenet.rootpartition.get_compiled_function_keys()
+    micropsi.step_nodenet(test_nodenet)
+    assert register.activation == 1
+    for key in partition.get_compiled_function_keys():
+        assert key in compiled_functions
+        # but run copies of their own, which can be called from different threads at once
+        assert partition.compiled_function_copies[key] is not nodenet.rootpartition.compiled_function_copies[key]
+
+    netapi.create_node('Pipe', nodespace.uid, "Pipe")
+    assert partition.get_compiled_function_keys()[1] != nodenet.rootpartition.get_compiled_function_keys()[1]
+    keys = partition.get_compiled_function_keys()
+    compiled_functions.clear()
+    warm_up_compiled_functions([list(key) for key in keys])
+    for key in keys:
+        assert key in compiled_functions
+    micropsi.step_nodenet(test_nodenet)
+    assert register.activation == 1
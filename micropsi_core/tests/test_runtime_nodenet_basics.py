@@ -451,6 +451,32 @@ def test_get_nodespace_changes_cycles(fixed_nodenet):
     assert nodes['B2'].uid not in result['nodes_deleted']
 
 
+@pytest.mark.engine("theano_engine")
+def test_get_nodespace_changes_journal(test_nodenet):
+    net = micropsi.nodenets[test_nodenet]
+    netapi = net.netapi
+    partition = net.rootpartition
+    partition.change_journal_size = 4
+    partition.clear_change_journal()
+    source = netapi.create_node('Register', None, "Source")
+    net.step()
+    register = netapi.create_node('Register', None, "Register")
+    netapi.link(source, 'gen', register, 'gen')
+    net.step()
+    result = micropsi.get_nodespace_changes(test_nodenet, [None], 1)
+    assert set(result['nodes_dirty'].keys()) == {source.uid, register.uid}
+    net.step()
+    assert micropsi.get_nodespace_changes(test_nodenet, [None], 3)['nodes_dirty'] == {}
+
+    # more changes than the journal holds: asking for the changes of steps before the oldest entry scans all nodes
+    new_uids = set(netapi.create_node('Register', None, "Register %d" % i).uid for i in range(4))
+    net.step()
+    result = micropsi.get_nodespace_changes(test_nodenet, [None], 3)
+    assert set(result['nodes_dirty'].keys()) == new_uids
+    result = micropsi.get_nodespace_changes(test_nodenet, [None], 1)
+    assert set(result['nodes_dirty'].keys()) == new_uids | {source.uid, register.uid}
+
+
 def test_nodespace_properties(test_nodenet):
     data = {'testvalue': 'foobar'}
     rootns = micropsi.get_nodenet(test_nodenet).get_nodespace(None)
@@ -462,3 +488,33 @@ def test_nodespace_properties(test_nodenet):
     assert micropsi.get_nodespace_properties(test_nodenet, rootns.uid) == data
     properties = micropsi.get_nodespace_properties(test_nodenet)
     assert properties[rootns.uid] == data
+
+
+@pytest.mark.engine("theano_engine")
+def test_dashboard_node_statistics(test_nodenet):
+    nodenet = micropsi.get_nodenet(test_nodenet)
+    netapi = nodenet.netapi
+    parent = netapi.create_node("Pipe", None, "Parent")
+    child = netapi.create_node("Pipe", None, "Child")
+    netapi.link_with_reciprocal(parent, child, 'subsur')
+    parent.get_gate('sub').activation = 1
+    child.activation = -1
+    data = micropsi.get_agent_dashboard(test_nodenet)
+    assert data['count_nodes'] == 2
+    assert data['nodetypes']['Pipe'] == 2
+    assert data['count_negative_nodes'] == 1
+    assert data['concepts']['checking'] == 1
+    assert data['concepts']['failed'] == 1
+    # only the parent has no sur links and counts as a schema
+    assert data['schemas']['checking'] == 1
+    assert data['schemas']['total'] == 1
+
+    # statistics are cached per step, but creating nodes invalidates them
+    netapi.create_node("Register", None, "Register")
+    assert micropsi.get_agent_dashboard(test_nodenet)['count_nodes'] == 3
+
+    # and so does setting activations while the node net is not running
+    child.activation = 1
+    data = micropsi.get_agent_dashboard(test_nodenet)
+    assert data['count_negative_nodes'] == 0
+    assert data['count_positive_nodes'] == 1
@@ -6,6 +6,7 @@
 """
 from micropsi_core import runtime as micropsi
 import pytest
+import threading
 
 __author__ = 'joscha'
 __date__ = '29.10.12'
@@ -153,6 +154,36 @@ def test_save_nodenet(test_nodenet):
     micropsi.delete_nodenet(test_nodenet)
 
 
+def test_save_nodenet_in_background(test_nodenet):
+    nodes = prepare_nodenet(test_nodenet)
+    assert micropsi.get_save_status(test_nodenet)['status'] == 'idle'
+    micropsi.save_nodenet(test_nodenet, background=True)
+    # changes made after the snapshot do not end up in the saved nodenet
+    micropsi.delete_node(test_nodenet, nodes['a'])
+    micropsi.wait_for_save(test_nodenet)
+    status = micropsi.get_save_status(test_nodenet)
+    assert status['status'] == 'saved'
+    assert status['last_save'] is not None
+    micropsi.revert_nodenet(test_nodenet)
+    nodespace = micropsi.get_nodes(test_nodenet)
+    assert len(nodespace["nodes"]) == 4
+
+
+def test_concurrent_background_saves(test_nodenet):
+    prepare_nodenet(test_nodenet)
+    threads = [threading.Thread(target=micropsi.save_nodenet, args=(test_nodenet,), kwargs={'background': True}) for i in range(3)]
+    threads += [threading.Thread(target=micropsi.wait_for_save, args=(test_nodenet,)) for i in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    micropsi.wait_for_save(test_nodenet)
+    assert test_nodenet not in micropsi.save_threads
+    assert micropsi.get_save_status(test_nodenet)['status'] == 'saved'
+    micropsi.revert_nodenet(test_nodenet)
+    assert len(micropsi.get_nodes(test_nodenet)["nodes"]) == 4
+
+
 def test_reload_native_modules(fixed_nodenet):
     def hashlink(l):
         return "%s:%s:%s:%s" % (l['source_node_uid'], l['source_gate_name'], l['target_node_uid'], l['target_slot_name'])
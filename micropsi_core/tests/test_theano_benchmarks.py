@@ -0,0 +1,136 @@
+"""
+Benchmarks for the theano engine.
+These are skipped unless py.test is run with --benchmarks, use -s to see the timings.
+"""
+import time
+import random
+
+import numpy as np
+import pytest
+from micropsi_core import runtime as micropsi
+
+
+def report(name, count, seconds):
+    print("\n%s: %d in %.2fs (%.1f us each)" % (name, count, seconds, seconds * 1000000 / count))
+
+
+@pytest.mark.benchmark
+@pytest.mark.engine("theano_engine")
+def test_benchmark_create_and_delete_nodes(test_nodenet):
+    nodenet = micropsi.get_nodenet(test_nodenet)
+    nodetypes = ["Register", "Pipe", "LSTM"]
+    count = 100000
+
+    start = time.time()
+    uids = [nodenet.create_node(nodetypes[i % 3], None, None) for i in range(count)]
+    report("create nodes", count, time.time() - start)
+
+    random.seed(42)
+    random.shuffle(uids)
+    start = time.time()
+    for uid in uids[:count // 2]:
+        nodenet.delete_node(uid)
+    report("delete nodes", count // 2, time.time() - start)
+
+    # re-use the freed IDs and element ranges
+    start = time.time()
+    for i in range(count // 2):
+        nodenet.create_node(nodetypes[i % 3], None, None)
+    report("re-create nodes", count // 2, time.time() - start)
+
+    partition = nodenet.rootpartition
+    assert len(partition.allocated_nodes.nonzero()[0]) == count
+
+
+@pytest.mark.benchmark
+@pytest.mark.engine("theano_engine")
+def test_benchmark_shifted_activations(test_nodenet):
+    nodenet = micropsi.get_nodenet(test_nodenet)
+    nodenet.fuse_steps = False
+    netapi = nodenet.netapi
+    nodespace = netapi.create_nodespace(None, name="pipes", options={'new_partition': True, 'initial_number_of_nodes': 72000, 'average_elements_per_node_assumption': 7})
+    for i in range(71500):
+        nodenet.create_node("Pipe", nodespace.uid, None)
+    partition = nodespace.partition
+    count = 100
+
+    # the former per-step rebuild of the shifted matrices, for comparison
+    a_array = partition.a.get_value(borrow=True)
+    g_theta_array = partition.g_theta.get_value(borrow=True)
+    start = time.time()
+    for i in range(count):
+        np.lib.stride_tricks.as_strided(np.roll(a_array, 7), shape=(partition.NoE, 14), strides=(a_array.itemsize, a_array.itemsize))
+        np.lib.stride_tricks.as_strided(np.roll(g_theta_array, 7), shape=(partition.NoE, 14), strides=(a_array.itemsize, a_array.itemsize))
+    report("roll %d elements" % partition.NoE, count, time.time() - start)
+
+    partition.calculate()
+    start = time.time()
+    for i in range(count):
+        partition.calculate()
+    report("calculate %d elements" % partition.NoE, count, time.time() - start)
+
+
+@pytest.mark.benchmark
+@pytest.mark.engine("theano_engine")
+def test_benchmark_weight_storage(test_nodenet):
+    nodenet = micropsi.get_nodenet(test_nodenet)
+    netapi = nodenet.netapi
+    np.random.seed(42)
+    count = 10000
+    links = 500000
+    sources = np.random.randint(0, count, links)
+    targets = np.random.randint(0, count, links)
+    weights = np.random.uniform(-1, 1, links)
+    for weight_storage in ["full", "float16", "int8"]:
+        nodespace = netapi.create_nodespace(None, name=weight_storage, options={'new_partition': True, 'initial_number_of_nodes': count + 1, 'weight_storage': weight_storage})
+        uids = [nodenet.create_node("Register", nodespace.uid, None) for i in range(count)]
+        uids = np.asarray(uids, dtype=object)
+        nodenet.set_link_weights_bulk(uids[sources], "gen", uids[targets], "gen", weights)
+
+    start = time.time()
+    micropsi.save_nodenet(test_nodenet)
+    report("save", 1, time.time() - start)
+    start = time.time()
+    micropsi.revert_nodenet(test_nodenet)
+    report("load", 1, time.time() - start)
+
+    nodenet = micropsi.get_nodenet(test_nodenet)
+    nodenet.fuse_steps = False
+    for spid, data in sorted(nodenet.get_weight_storage_report().items()):
+        print("\npartition %s, %s weights: %d links, %d bytes (%d bytes in full precision), max. error %.5f" %
+              (spid, data['weight_storage'], data['links'], data['bytes'], data['full_bytes'], data['max_error']))
+        partition = nodenet.partitions[spid]
+        start = time.time()
+        for i in range(100):
+            partition.propagate()
+            partition.calculate()
+        report("steps of %s partition %s" % (data['weight_storage'], spid), 100, time.time() - start)
+
+
+@pytest.mark.benchmark
+@pytest.mark.engine("theano_engine")
+def test_benchmark_compiled_function_calls(test_nodenet):
+    from micropsi_core.nodenet.theano_engine.theano_partition import compiled_functions
+    nodenet = micropsi.get_nodenet(test_nodenet)
+    netapi = nodenet.netapi
+    count = 10000
+    for nodes in [10, 10000]:
+        nodespace = netapi.create_nodespace(None, name="%d nodes" % nodes, options={'new_partition': True, 'initial_number_of_nodes': nodes + 1})
+        for i in range(nodes):
+            nodenet.create_node("Register", nodespace.uid, None)
+        partition = nodespace.partition
+        partition.calculate()
+
+        # the cost of reading the inputs from and writing the results to the shared variables on every call
+        for key, run in zip(partition.get_compiled_function_keys(), [partition.propagate, partition.calculate_nodes]):
+            function, input_names, output_names = compiled_functions[key]
+            function = partition.compiled_function_copies[key]
+            inputs = [getattr(partition, name).get_value(borrow=True, return_internal_type=True) for name in input_names]
+            start = time.time()
+            for i in range(count):
+                function(*inputs)
+            report("%s on %d elements, function only" % (key[0], partition.NoE), count, time.time() - start)
+            start = time.time()
+            for i in range(count):
+                run()
+            report("%s on %d elements, with %d shared variables" % (key[0], partition.NoE, len(input_names) + len(output_names)), count, time.time() - start)
@@ -19,6 +19,7 @@ and treated as parts of the world.
 __author__ = 'joscha'
 __date__ = '10.05.12'
 
+from copy import copy
 from threading import Lock
 from micropsi_core.world.worldobject import WorldObject
 from abc import ABCMeta, abstractmethod
@@ -130,6 +131,9 @@ class ArrayWorldAdapter(WorldAdapter, metaclass=ABCMeta):
     to nodenet engines.
     Engines that bulk-query values, such as the theano_engine, will be faster.
     Numpy arrays can be passed directly into the engine.
+    Engines may hand preallocated arrays to the world adapter via set_value_buffers, which concrete
+    world adapters should then fill in place. The datatarget values are copied into an array owned by
+    the world adapter, so they stay valid while the engine calculates the next step.
     """
     def __init__(self, world, uid=None, **data):
         WorldAdapter.__init__(self, world, duid=uid)
@@ -167,12 +171,34 @@ class ArrayWorldAdapter(WorldAdapter, metaclass=ABCMeta):
 
     def set_datatarget_values(self, values):
         """allows the agent to write a list of value to the datatargets"""
-        self.datatarget_values = values
+        # copy, since engines may reuse the array they pass in for the next step
+        if len(self.datatarget_values) == len(values):
+            self.datatarget_values[:] = values
+        else:
+            self.datatarget_values = copy(values)
 
     def reset_datatargets(self):
         """ resets (zeros) the datatargets """
         pass
 
+    def set_value_buffers(self, datasource_values, datatarget_values, datatarget_feedback_values):
+        """
+        Called by engines that preallocate the arrays they exchange with the world adapter.
+        Concrete world adapters should write into the datasource and feedback arrays in place
+        (e.g. self.datasource_values[:] = values) instead of replacing them, so that the engine can read them
+        without copying.
+        The engine keeps refilling its datatarget buffer, so the world adapter gets an array of its own for the
+        datatarget values, which set_datatarget_values copies the values into.
+        """
+        for name, values in (('datasource_values', datasource_values),
+                             ('datatarget_feedback_values', datatarget_feedback_values)):
+            if len(getattr(self, name)) == len(values):
+                values[:] = getattr(self, name)
+            setattr(self, name, values)
+        if len(self.datatarget_values) == len(datatarget_values):
+            datatarget_values[:] = self.datatarget_values
+        self.datatarget_values = datatarget_values.copy()
+
     @abstractmethod
     def get_available_datasources(self):
         """
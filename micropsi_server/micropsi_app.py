@@ -505,9 +505,16 @@ def delete_nodenet_from_console(nodenet_uid):
 def save_all_nodenets():
     user_id, permissions, token = get_request_data()
     if "manage nodenets" in permissions:
-        for uid in runtime.nodenets:
-            runtime.save_nodenet(uid)
-        response.set_cookie('notification', '{"msg":"All nodenets saved", "status":"success"}', path='/')
+        # save all nodenets in parallel, each one only blocks while its snapshot is taken
+        uids = list(runtime.nodenets.keys())
+        for uid in uids:
+            runtime.save_nodenet(uid, background=True)
+        for uid in uids:
+            runtime.wait_for_save(uid)
+        if all(runtime.get_save_status(uid)['status'] == 'saved' for uid in uids):
+            response.set_cookie('notification', '{"msg":"All nodenets saved", "status":"success"}', path='/')
+        else:
+            response.set_cookie('notification', '{"msg":"Some nodenets could not be saved", "status":"error"}', path='/')
         redirect('/nodenet_mgt')
     return template("error", msg="Insufficient rights to access nodenet console")
 
@@ -857,8 +864,13 @@ def revert_nodenet(nodenet_uid):
 
 
 @rpc("save_nodenet", permission_required="manage nodenets")
-def save_nodenet(nodenet_uid):
-    return runtime.save_nodenet(nodenet_uid)
+def save_nodenet(nodenet_uid, background=False):
+    return runtime.save_nodenet(nodenet_uid, background)
+
+
+@rpc("get_save_status")
+def get_save_status(nodenet_uid):
+    return True, runtime.get_save_status(nodenet_uid)
 
 
 @rpc("export_nodenet")
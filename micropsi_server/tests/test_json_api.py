@@ -312,6 +312,18 @@ def test_save_nodenet(app, test_nodenet, test_world):
     app.get_json('/rpc/delete_nodenet(nodenet_uid="%s")' % test_nodenet)
 
 
+def test_save_nodenet_in_background(app, test_nodenet):
+    from micropsi_core import runtime
+    app.set_auth()
+    response = app.post_json('/rpc/save_nodenet', params=dict(nodenet_uid=test_nodenet, background=True))
+    assert_success(response)
+    runtime.wait_for_save(test_nodenet)
+    response = app.get_json('/rpc/get_save_status(nodenet_uid="%s")' % test_nodenet)
+    assert_success(response)
+    assert response.json_body['data']['status'] == 'saved'
+    assert response.json_body['data']['last_save'] is not None
+
+
 def test_export_nodenet(app, test_nodenet, node):
     response = app.get_json('/rpc/export_nodenet(nodenet_uid="%s")' % test_nodenet)
     assert_success(response)